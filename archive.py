@@ -0,0 +1,386 @@
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import deque
+from urllib.parse import quote
+
+# Kanavien levyloki ja hakuindeksi
+# Viestit kirjoitetaan kanavakohtaisiin segmenttitiedostoihin erillisessä
+# kirjoittajasäikeessä, joten levy ei hidasta viestin lähetystä. Samalla
+# päivitetään käänteistä indeksiä: jokaisesta viestin sanasta ja lähettäjästä
+# (from:nimi) pidetään listaa rivien paikoista segmentissä.
+#
+# Avoimen segmentin indeksi on muistissa. Kun segmentti täyttyy, sen indeksi
+# kirjoitetaan viereen .idx-tiedostoksi, jossa termit ovat järjestyksessä:
+#   <otsake><termitaulu: loppu, postausten alku, määrä (u32)><termit><postaukset (u32)>
+# Haku etsii termin jokaisen segmentin taulusta puolitushaulla mmapin kautta
+# ja lukee lokista vain osuvat rivit, joten hakuaika ei riipu lokin koosta.
+# Luvut ovat koneen tavujärjestyksessä. Käynnistyessä vain avoin segmentti
+# (ja indeksiään vaille jäänyt täysi segmentti) luetaan uudelleen.
+
+SEGMENT_BYTES = 4 * 1024 * 1024
+INDEX_MAGIC = b'IDX1'
+INDEX_HEADER = struct.Struct('=4sII')  # tunniste, termien määrä, termien tavut
+MAX_TERM_BYTES = 64
+# Muistiarvio indeksin uudelle termille: termi, tyhjä taulukko ja sanakirjan paikka
+TERM_OVERHEAD_BYTES = sys.getsizeof(array('I')) + 3 * 8
+SENDER_PREFIX = 'from:'
+WORD = re.compile(r'\w+')
+
+
+# Palauttaa viestirivin hakutermit: sanat pienellä ja lähettäjä from:-etuliitteellä
+def message_terms(payload):
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return ()
+    terms = set(WORD.findall(str(data.get('message', '')).lower()))
+    sender = data.get('from')
+    if sender:
+        terms.add(SENDER_PREFIX + str(sender).lower())
+    return [term for term in terms if len(term.encode()) <= MAX_TERM_BYTES]
+
+
+# Pilkkoo hakulausekkeen termeiksi samalla tavalla kuin viestit
+def query_terms(text):
+    terms = []
+    for word in text.lower().split():
+        if word.startswith(SENDER_PREFIX):
+            found = [word] if len(word) > len(SENDER_PREFIX) else []
+        else:
+            found = WORD.findall(word)
+        terms.extend(term for term in found if term not in terms)
+    return terms
+
+
+# Kanavan levyloki
+# Viestit lisätään nykyisen segmentin loppuun; kun segmentti kasvaa yli
+# SEGMENT_BYTES, aloitetaan uusi. Lukeminen tehdään mmapilla uusimmasta
+# segmentistä taaksepäin, joten koko historiaa ei tarvitse pitää muistissa.
+class SegmentLog:
+    def __init__(self, directory, channel_name):
+        self.directory = os.path.join(directory, quote(channel_name, safe=''))
+        os.makedirs(self.directory, exist_ok=True)
+        self.segments = sorted(
+            int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.log')
+        ) or [0]
+        self.file = open(self.segment_path(self.segments[-1]), 'ab')
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, f"{number:012d}.log")
+
+    # Palauttaa (segmentti, kohta), johon rivi kirjoitettiin
+    def append(self, payload):
+        position = (self.segments[-1], self.file.tell())
+        self.file.write(payload)
+        if self.file.tell() >= SEGMENT_BYTES:
+            self.file.close()
+            self.segments.append(self.segments[-1] + 1)
+            self.file = open(self.segment_path(self.segments[-1]), 'ab')
+        return position
+
+    # Palauttaa enintään count viimeisintä riviä vanhimmasta uusimpaan
+    def tail(self, count):
+        self.file.flush()
+        lines = []
+        for number in reversed(self.segments):
+            path = self.segment_path(number)
+            if os.path.getsize(path) == 0:
+                continue
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                end = len(data)
+                segment_lines = []
+                while end > 0 and len(lines) + len(segment_lines) < count:
+                    start = data.rfind(b'\n', 0, end - 1) + 1
+                    segment_lines.append(data[start:end])
+                    end = start
+            lines.extend(segment_lines)
+            if len(lines) >= count:
+                break
+        lines.reverse()
+        return lines
+
+    # Lukee rivit annetuista kohdista
+    def read(self, number, offsets):
+        if number == self.segments[-1]:
+            self.file.flush()
+        with open(self.segment_path(number), 'rb') as f:
+            lines = []
+            for offset in offsets:
+                f.seek(offset)
+                lines.append(f.readline())
+            return lines
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# Rakentaa segmentin indeksin lukemalla sen rivit (käynnistyksessä)
+def build_index(path):
+    index = {}
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.endswith(b'\n'):
+                for term in message_terms(line):
+                    index.setdefault(term, array('I')).append(offset)
+            offset += len(line)
+    return index
+
+
+# Arvioi muistissa olevan indeksin koon tavuina
+def index_memory(index):
+    return sum(sys.getsizeof(term) + TERM_OVERHEAD_BYTES + len(offsets) * offsets.itemsize
+               for term, offsets in index.items())
+
+
+# Kirjoittaa segmentin indeksin järjestettynä tiedostoon
+# Kirjoitus tehdään väliaikaiseen tiedostoon, joten keskeytynyt kirjoitus ei
+# jätä rikkinäistä indeksiä; puuttuva indeksi rakennetaan uudelleen
+def write_index(path, index):
+    entries = sorted((term.encode(), offsets) for term, offsets in index.items())
+    table = array('I')
+    terms = bytearray()
+    postings = array('I')
+    for term, offsets in entries:
+        terms += term
+        table.extend((len(terms), len(postings), len(offsets)))
+        postings.extend(offsets)
+    terms += bytes(-len(terms) % postings.itemsize)
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(entries), len(terms)))
+        f.write(table.tobytes())
+        f.write(terms)
+        f.write(postings.tobytes())
+    os.replace(temp, path)
+
+
+# Täyden segmentin indeksi mmapin kautta
+# Avataan haun ajaksi, jotta suljetut segmentit eivät pidä tiedostokahvoja auki
+class SegmentIndex:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, terms_size = INDEX_HEADER.unpack_from(self.data)
+        if magic != INDEX_MAGIC:
+            self.data.close()
+            raise ValueError(f"Tuntematon indeksitiedosto: {path}")
+        view = memoryview(self.data)
+        self.terms_start = INDEX_HEADER.size + self.count * 12
+        self.table = view[INDEX_HEADER.size:self.terms_start].cast('I')
+        self.postings = view[self.terms_start + terms_size:].cast('I')
+        view.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Palauttaa termin rivikohdat nousevassa järjestyksessä tai None
+    def lookup(self, term):
+        table = self.table
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = table[middle * 3 - 3] if middle else 0
+            found = self.data[self.terms_start + start:self.terms_start + table[middle * 3]]
+            if found < term:
+                low = middle + 1
+            elif found > term:
+                high = middle
+            else:
+                first = table[middle * 3 + 1]
+                return self.postings[first:first + table[middle * 3 + 2]]
+        return None
+
+    def close(self):
+        self.table.release()
+        self.postings.release()
+        self.data.close()
+
+
+# Palauttaa enintään limit uusinta kohtaa, joissa kaikki termit esiintyvät
+# postings ovat termien nousevat kohtalistat; harvinaisimman termin kohdat
+# käydään läpi lopusta ja muista tarkistetaan puolitushaulla
+def match_offsets(postings, limit):
+    postings = sorted(postings, key=len)
+    matches = []
+    for offset in reversed(postings[0]):
+        for other in postings[1:]:
+            position = bisect_left(other, offset)
+            if position == len(other) or other[position] != offset:
+                break
+        else:
+            matches.append(offset)
+            if len(matches) >= limit:
+                break
+    return matches
+
+
+# Kanavan loki ja sen hakuindeksi
+# Avataan laiskasti ensimmäisellä käytöllä, jotta avoimen segmentin
+# indeksin uudelleenrakennus ei osu viestin lähetykseen. memory on avoimen
+# segmentin indeksin arvioitu koko, jota päivitetään lisäysten mukana.
+class ChannelArchive:
+    def __init__(self, directory, channel_name):
+        self.directory = directory
+        self.channel_name = channel_name
+        self.lock = threading.Lock()
+        self.log = None
+        self.index = {}
+        self.memory = 0
+
+    def index_path(self, number):
+        return self.log.segment_path(number)[:-4] + '.idx'
+
+    def _open(self):
+        if self.log is not None:
+            return self.log
+        log = self.log = SegmentLog(self.directory, self.channel_name)
+        for number in log.segments[:-1]:
+            if not os.path.exists(self.index_path(number)):
+                write_index(self.index_path(number), build_index(log.segment_path(number)))
+        self.index = build_index(log.segment_path(log.segments[-1]))
+        self.memory = index_memory(self.index)
+        return log
+
+    @property
+    def segments(self):
+        return len(self.log.segments) if self.log else 0
+
+    # Kirjoittaa rivin ja lisää sen termit indeksiin (kirjoittajasäikeessä)
+    def append(self, payload):
+        with self.lock:
+            log = self._open()
+            number, offset = log.append(payload)
+            for term in message_terms(payload):
+                postings = self.index.get(term)
+                if postings is None:
+                    postings = self.index[term] = array('I')
+                    self.memory += sys.getsizeof(term) + TERM_OVERHEAD_BYTES
+                postings.append(offset)
+                self.memory += postings.itemsize
+            if log.segments[-1] != number:
+                write_index(self.index_path(number), self.index)
+                self.index = {}
+                self.memory = 0
+
+    def flush(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.flush()
+
+    def tail(self, count):
+        with self.lock:
+            return self._open().tail(count)
+
+    # Palauttaa enintään limit uusinta riviä, joissa kaikki termit esiintyvät
+    def search(self, terms, limit):
+        if not terms:
+            return []
+        with self.lock:
+            log = self._open()
+            results = []
+            for number in reversed(log.segments):
+                if number == log.segments[-1]:
+                    postings = [self.index.get(term) for term in terms]
+                    offsets = match_offsets(postings, limit - len(results)) if all(postings) else []
+                else:
+                    offsets = self._search_sealed(number, terms, limit - len(results))
+                results.extend(log.read(number, offsets))
+                if len(results) >= limit:
+                    break
+            return results
+
+    def _search_sealed(self, number, terms, limit):
+        path = self.index_path(number)
+        if not os.path.exists(path):
+            return []
+        with SegmentIndex(path) as index:
+            postings = [index.lookup(term.encode()) for term in terms]
+            offsets = match_offsets(postings, limit) if all(postings) else []
+            del postings
+        return offsets
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+                self.index = {}
+                self.memory = 0
+
+
+# Kirjoittajasäie
+# Kaikkien kanavien rivit kulkevat yhden jonon kautta; säie kirjoittaa kerralla
+# kaiken jonossa olevan ja tyhjentää tiedostopuskurit erän lopuksi.
+# flush odottaa, että siihen mennessä jonoon lisätyt rivit on kirjoitettu.
+# close sulkee lokin jonossa jo olevien rivien jälkeen odottamatta.
+class ArchiveWriter:
+    def __init__(self):
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.submitted = 0
+        self.written = 0
+        self.thread = None
+
+    def submit(self, archive, payload):
+        with self.cond:
+            self.items.append((archive, payload))
+            self.submitted += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.items:
+                    self.cond.wait()
+                batch = list(self.items)
+                self.items.clear()
+            touched = set()
+            for archive, payload in batch:
+                try:
+                    if payload is None:
+                        archive.close()
+                        touched.discard(archive)
+                        continue
+                    archive.append(payload)
+                    touched.add(archive)
+                except OSError as e:
+                    print(f"Kanavalokin kirjoitus epäonnistui: {e}")
+            for archive in touched:
+                try:
+                    archive.flush()
+                except OSError as e:
+                    print(f"Kanavalokin kirjoitus epäonnistui: {e}")
+            with self.cond:
+                self.written += len(batch)
+                self.cond.notify_all()
+
+    def close(self, archive):
+        self.submit(archive, None)
+
+    def pending(self):
+        return self.submitted - self.written
+
+    def flush(self):
+        with self.cond:
+            target = self.submitted
+            self.cond.wait_for(lambda: self.written >= target)
+
+
+archive_writer = ArchiveWriter()
@@ -0,0 +1,65 @@
+# Mittaa kanavalähetyksen hinnan viestiä kohden eri kanavakoilla
+# Vertaa vanhaa tapaa (json.dumps jokaiselle vastaanottajalle) ja
+# broadcast_messagea, joka koodaa viestin vain kerran.
+#
+# Käyttö: python benchmarks/bench_broadcast.py
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+
+SIZES = [10, 1000, 10000]
+CHANNEL = '#bench'
+
+
+# Yhteys, joka ottaa tavut vastaan mutta ei lähetä niitä mihinkään
+class NullConnection:
+    def sendall(self, payload):
+        pass
+
+
+# Vanha toteutus: sama viesti koodataan uudestaan jokaiselle vastaanottajalle
+def broadcast_per_recipient(sender_conn, message, channel):
+    username = server.authenticated_users.get(sender_conn, "Tuntematon")
+    color = server.client_colors.get(sender_conn, 15)
+    for client in server.channels[channel].members:
+        if client != sender_conn:
+            server.send_raw(client, (json.dumps({
+                'action': 'message',
+                'from': username,
+                'color': color,
+                'message': message,
+                'channel': channel
+            }) + '\n').encode())
+
+
+def measure(func, sender, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        func(sender, f"viesti numero {i} kanavalle", CHANNEL)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    print(f"{'jäseniä':>8} {'vanha µs/viesti':>16} {'uusi µs/viesti':>15} {'nopeutus':>9}")
+    for size in SIZES:
+        members = [NullConnection() for _ in range(size)]
+        server.channels[CHANNEL] = channel = server.Channel(CHANNEL)
+        for member in members:
+            channel.add(member, 'bench')
+        sender = members[0]
+        server.authenticated_users[sender] = 'bench'
+        rounds = max(20, 200000 // size)
+        old = measure(broadcast_per_recipient, sender, rounds)
+        new = measure(server.broadcast_message, sender, rounds)
+        print(f"{size:>8} {old * 1e6:>16.1f} {new * 1e6:>15.1f} {old / new:>8.1f}x")
+        server.authenticated_users.pop(sender, None)
+    server.channels.pop(CHANNEL, None)
+
+
+if __name__ == "__main__":
+    main()
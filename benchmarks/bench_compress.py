@@ -0,0 +1,93 @@
+# Mittaa pakatun siirron säästämän kaistan ja sen hinnan prosessoriaikana
+# raw:        pakkaamaton lähetys (vertailukohta)
+# per-yhteys: jokainen vastaanottaja pakkaa viestin omaan virtaansa
+#             (sama lähetys pakataan N kertaa)
+# jaettu:     lähetys pakataan kerran kanavan jaettuun virtaan ja samat
+#             tavut menevät kaikille (palvelimen toteutus)
+#
+# Viestit ovat tavallisen näköisiä kanavaviestejä muutamalta lähettäjältä.
+# Tavut ovat vastaanottajaa kohden lähteviä tavuja viestiä kohden lohkojen
+# otsikot mukaan lukien, aika on yhden lähetyksen kesto kaikille jäsenille.
+#
+# Käyttö: python benchmarks/bench_compress.py [--members 10 100 1000] [--messages 2000]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from compress import Compressor
+
+CHANNEL = '#bench'
+WORDS = ('moi', 'kuka', 'tietää', 'miten', 'palvelin', 'toimii', 'kanava', 'viesti', 'tänään',
+         'huomenna', 'kiitos', 'joo', 'ei', 'ehkä', 'linkki', 'https://example.com/juttu', 'lol',
+         'kahvi', 'kokous', 'valmis', 'testi', 'bugi', 'korjattu', 'versio', 'julkaisu')
+SENDERS = ('alice', 'bob', 'carol', 'dave', 'erin')
+
+
+# Yhteys, joka laskee lähtevät tavut mutta ei lähetä niitä mihinkään
+class CountingConnection:
+    def __init__(self):
+        self.encoder = None
+        self.bytes = 0
+
+    def sendall(self, payload, raw=False):
+        if self.encoder is not None and not raw:
+            payload = self.encoder(payload)
+        self.bytes += len(payload)
+
+
+def make_messages(count):
+    rng = random.Random(1)
+    return [(rng.choice(SENDERS), ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 15))))
+            for _ in range(count)]
+
+
+def reset_server():
+    server.channels.pop(CHANNEL, None)
+    server.compressors.clear()
+    server.shared_streams.clear()
+
+
+def measure(mode, size, messages):
+    reset_server()
+    members = [CountingConnection() for _ in range(size)]
+    channel = server.channels[CHANNEL] = server.Channel(CHANNEL)
+    for member in members:
+        channel.add(member, 'bench')
+        if mode != 'raw':
+            compressor = Compressor(server.COMPRESS_LEVEL)
+            member.encoder = compressor.encode
+            if mode == 'jaettu':
+                server.compressors[member] = compressor
+    start = time.process_time()
+    for sender, message in messages:
+        server.deliver_message(sender, 4, message, CHANNEL)
+    elapsed = time.process_time() - start
+    sent = sum(member.bytes for member in members)
+    reset_server()
+    return sent / size / len(messages), elapsed / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pakatun siirron kaista ja prosessoriaika")
+    parser.add_argument('--members', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+    print(f"{'jäseniä':>8} {'tapa':<10} {'tavua/viesti':>13} {'säästö':>7} {'µs/lähetys':>11} {'µs/vast.':>9}")
+    for size in args.members:
+        # Suurilla kanavilla riittää pienempi otos, jotta ajo pysyy lyhyenä
+        messages = make_messages(max(50, args.messages * 10 // size))
+        raw_bytes = None
+        for mode in ('raw', 'per-yhteys', 'jaettu'):
+            per_message, seconds = measure(mode, size, messages)
+            raw_bytes = raw_bytes or per_message
+            print(f"{size:>8} {mode:<10} {per_message:>13.1f} {1 - per_message / raw_bytes:>6.0%} "
+                  f"{seconds * 1e6:>11.1f} {seconds * 1e6 / size:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
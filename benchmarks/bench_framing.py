@@ -0,0 +1,108 @@
+# Mittaa vastaanottopuolen kehystyksen läpäisyn
+# Vertaa vanhaa silmukkaa (recv(1024), decode, merkkijonopuskuri ja
+# buffer.split('\n', 1)) ja framing.LineFrameria (recv_into bytearray-puskuriin).
+# Purskeessa vanha silmukka ajetaan myös isoilla lukukoilla, jolloin jokainen
+# rivi kopioi puskurin loppuosan ja aika kasvaa neliöllisesti.
+# Data on ASCII-muotoista, koska vanha silmukka kaatuu, jos monitavuinen
+# UTF-8-merkki jakautuu kahteen lukuun.
+#
+# Käyttö: python benchmarks/bench_framing.py
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framing import LineFramer
+
+LINES = 50000
+
+
+# Socketin korvike, joka palauttaa valmiin tavujonon paloina
+class FakeSocket:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def recv(self, size):
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return bytes(chunk)
+
+    def recv_into(self, buffer):
+        chunk = self.data[self.pos:self.pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.pos += len(chunk)
+        return len(chunk)
+
+
+# Vanha vastaanottosilmukka
+def old_loop(sock, read_size, parse):
+    buffer = ""
+    count = 0
+    while True:
+        data = sock.recv(read_size).decode()
+        if not data:
+            break
+        buffer += data
+        while '\n' in buffer:
+            line, buffer = buffer.split('\n', 1)
+            if parse:
+                json.loads(line)
+            count += 1
+    return count
+
+
+# Uusi vastaanottosilmukka, sama kuin server.py:n handle_client
+def framer_loop(sock, read_size, parse):
+    framer = LineFramer(read_size=read_size)
+    count = 0
+    while framer.recv_into(sock):
+        for line in framer.lines():
+            if parse:
+                json.loads(line.decode())
+            count += 1
+    return count
+
+
+# Paras kolmesta ajosta
+def measure(func, data, read_size, parse):
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        count = func(FakeSocket(data), read_size, parse)
+        elapsed = time.perf_counter() - start
+        assert count == LINES, count
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    data = b''.join(
+        (json.dumps({
+            'action': 'message',
+            'from': f'käyttäjä{i % 100}',
+            'color': 4,
+            'message': f'hyvää huomenta numero {i} ✓',
+            'channel': '#general'
+        }) + '\n').encode()
+        for i in range(LINES)
+    )
+    megabytes = len(data) / 1e6
+    print(f"{LINES} riviä, {megabytes:.1f} MB")
+    print(f"{'silmukka':<32} {'kehystys MB/s':>14} {'+ JSON MB/s':>12} {'+ JSON riviä/s':>15}")
+    cases = [
+        ("vanha, recv(1024)", old_loop, 1024),
+        ("vanha, recv(65536) purske", old_loop, 65536),
+        ("LineFramer, recv_into(65536)", framer_loop, 65536),
+    ]
+    for name, func, read_size in cases:
+        framing_only = measure(func, data, read_size, False)
+        elapsed = measure(func, data, read_size, True)
+        print(f"{name:<32} {megabytes / framing_only:>14.1f} {megabytes / elapsed:>12.1f} "
+              f"{LINES / elapsed:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# Mittaa viestin viiveen linkitetyssä palvelinverkossa
+# Käynnistää kolme solmua ketjuksi A - B - C paikalliseen osoitteeseen.
+# Lähettäjä on solmussa A ja jokaisessa solmussa on kuuntelija, joten
+# samasta viestistä saadaan viive paikalliselle, yhden linkin ja kahden
+# linkin päässä olevalle vastaanottajalle.
+#
+# Käyttö: python benchmarks/bench_link.py [--messages 2000] [--rate 200] [--core asyncio]
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadgen import free_port, spawn_server
+
+HOST = '127.0.0.1'
+SECRET = 'bench'
+CHANNEL = '#general'
+LINK_WAIT = 10.0
+
+
+class Listener:
+    def __init__(self, port, username):
+        self.sock = socket.create_connection((HOST, port))
+        self.file = self.sock.makefile('rb')
+        self.username = username
+        self.latencies = []
+        self.request({'action': 'register', 'username': username, 'password': 'salasana', 'color': 4},
+                      'register')
+        self.send({'action': 'command', 'message': f'/join {CHANNEL}'})
+
+    def send(self, data):
+        self.sock.sendall((json.dumps(data) + '\n').encode())
+
+    def request(self, data, action):
+        self.send(data)
+        for line in self.file:
+            response = json.loads(line)
+            if response.get('action') == action:
+                if response.get('status') == 'error':
+                    raise RuntimeError(response.get('message'))
+                return response
+
+    # Odottaa, että kaikki annetut käyttäjät näkyvät kanavalla
+    def wait_for(self, usernames):
+        deadline = time.monotonic() + LINK_WAIT
+        while time.monotonic() < deadline:
+            response = self.request({'action': 'command', 'message': f'/who {CHANNEL}'}, 'who')
+            if set(usernames) <= set(response['users']):
+                return
+            time.sleep(0.2)
+        raise RuntimeError("Solmut eivät linkittyneet ajoissa")
+
+    def collect(self, count):
+        for line in self.file:
+            response = json.loads(line)
+            text = response.get('message', '')
+            if response.get('action') == 'message' and text.startswith('t '):
+                self.latencies.append(time.perf_counter() - float(text[2:]))
+                if len(self.latencies) == count:
+                    return
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Linkitetyn verkon viivemittaus")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200.0, help="Viestiä sekunnissa")
+    parser.add_argument('--core', choices=['thread', 'asyncio'], default='thread')
+    args = parser.parse_args()
+
+    common = ['--core', args.core, '--kdf-iterations', '1000', '--link-secret', SECRET, '--conn-rate', '0']
+    processes = []
+    ports = []
+    try:
+        for name in 'ABC':
+            port = free_port(HOST)
+            node_args = common + ['--node-name', name]
+            if ports:
+                node_args += ['--link', f'{HOST}:{ports[-1]}']
+            processes.append(spawn_server(HOST, port, node_args, tempfile.mkdtemp(prefix=f'link{name}')))
+            ports.append(port)
+
+        sender = Listener(ports[0], 'lahettaja')
+        listeners = [Listener(port, f'kuuntelija{index}') for index, port in enumerate(ports)]
+        sender.wait_for([listener.username for listener in listeners])
+        threads = [threading.Thread(target=listener.collect, args=(args.messages,), daemon=True)
+                   for listener in listeners]
+        for thread in threads:
+            thread.start()
+
+        start = time.perf_counter()
+        for index in range(args.messages):
+            delay = start + index / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sender.send({'action': 'message', 'channel': CHANNEL, 'message': f't {time.perf_counter()!r}'})
+        for thread in threads:
+            thread.join(LINK_WAIT)
+
+        print(f"{'vastaanottaja':<16} {'viestejä':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for hops, listener in enumerate(listeners):
+            values = listener.latencies
+            if not values:
+                print(f"{hops} linkkiä        {0:>9}")
+                continue
+            print(f"{hops} linkkiä        {len(values):>9} {percentile(values, 0.5) * 1000:>8.2f} "
+                  f"{percentile(values, 0.99) * 1000:>8.2f} {max(values) * 1000:>8.2f}")
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
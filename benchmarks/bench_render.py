@@ -0,0 +1,87 @@
+# Mittaa asiakkaan ruudunpäivityksen läpäisyn viestipurskeessa
+# Vertaa vanhaa tapaa (jokaiselle viestille terminaalin koon kysely, rivin
+# tyhjennys, print ja syöterivi, kukin omalla flushilla) ja render.Rendereriä,
+# joka kokoaa yhden ruudun aikana saapuneet rivit yhteen kirjoitukseen.
+# Tuloste kirjoitetaan tiedostoon /dev/null, joten jokainen flush on oikea
+# write-kutsu. Terminaalin kokokysely epäonnistuu, koska tuloste ei ole
+# terminaali, mutta se on silti järjestelmäkutsu kuten oikeassa terminaalissa.
+#
+# Käyttö: python benchmarks/bench_render.py
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render import Renderer
+
+MESSAGES = 50000
+PROMPT = "\033[1;38;5;4mVeeti [#general]>\033[0m "
+LINE = "\033[1;38;5;11mHakan [#general]>\033[0m moi kaikki, mitä kuuluu?"
+
+
+# Tuloste, joka laskee write-kutsut ja piirretyt rivit
+class CountingOutput:
+    def __init__(self):
+        self.fd = os.open(os.devnull, os.O_WRONLY)
+        self.buffer = []
+        self.writes = 0
+        self.lines = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.lines += text.count('\n')
+
+    def flush(self):
+        if self.buffer:
+            os.write(self.fd, ''.join(self.buffer).encode())
+            self.buffer.clear()
+            self.writes += 1
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Vanha tapa: kolme flushia ja terminaalin kokokysely jokaista viestiä kohden
+def old_render(out, count):
+    for _ in range(count):
+        try:
+            columns = os.get_terminal_size(out.fd).columns
+        except OSError:
+            columns = 80
+        out.write('\r' + ' ' * (columns - 1) + '\r')
+        out.flush()
+        out.write(f"\r{LINE}\n")
+        out.flush()
+        out.write(PROMPT)
+        out.flush()
+
+
+def new_render(out, count):
+    renderer = Renderer(out, lambda: PROMPT)
+    thread = threading.Thread(target=renderer.run, daemon=True)
+    thread.start()
+    for _ in range(count):
+        renderer.write(LINE)
+    while out.lines < count:
+        time.sleep(0.001)
+
+
+def measure(name, func):
+    out = CountingOutput()
+    start = time.perf_counter()
+    func(out, MESSAGES)
+    elapsed = time.perf_counter() - start
+    out.close()
+    print(f"{name:<10} {MESSAGES / elapsed:>14.0f} {out.writes:>9} {out.writes / MESSAGES:>12.3f}")
+
+
+def main():
+    print(f"{'tapa':<10} {'viestiä/s':>14} {'write':>9} {'write/viesti':>12}")
+    measure('vanha', old_render)
+    measure('renderer', new_render)
+
+
+if __name__ == "__main__":
+    main()
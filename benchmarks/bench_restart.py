@@ -0,0 +1,153 @@
+# Mittaa palvelimen uudelleenkäynnistyksen katkon
+# cold:     vanha prosessi lopetetaan ja uusi käynnistetään samaan porttiin
+# handoff:  uusi prosessi ottaa kuuntelevan socketin vanhalta (--takeover)
+# migrate:  kuten handoff, mutta myös avoimet yhteydet siirretään (--migrate-clients)
+#
+# Ensimmäinen accept on aika uuden prosessin käynnistyksestä siihen, kun se
+# kertoo kuuntelevan socketin olevan käytössä. Koettelija avaa samalla koko
+# ajan uusia yhteyksiä ja lähettää pingin: tuloksena pisin aika ilman
+# onnistunutta pingiä ja epäonnistuneet yritykset. Lopuksi lasketaan, montako
+# alussa avatuista yhteyksistä vastaa yhä ilman uudelleenyhdistämistä.
+#
+# Käyttö: python benchmarks/bench_restart.py [--clients 200] [--core asyncio] [--mode cold handoff migrate]
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadgen import ROOT, free_port, spawn_server
+
+HOST = '127.0.0.1'
+PROBE_TIMEOUT = 2.0
+SETTLE_TIME = 1.0
+# Uuden prosessin ensimmäinen tulosterivi, kun yhteyksiä hyväksytään
+READY_LINES = (b'Kuunteleva socket saatu', b'Palvelin k')
+
+
+class Client:
+    def __init__(self, port, username):
+        self.sock = socket.create_connection((HOST, port))
+        self.file = self.sock.makefile('rb')
+        self.request({'action': 'register', 'username': username, 'password': 'salasana', 'color': 4},
+                     'register')
+        self.request({'action': 'command', 'message': '/join #general', 'id': 'join'}, 'channel_update')
+
+    def request(self, data, action):
+        self.sock.sendall((json.dumps(data) + '\n').encode())
+        for line in self.file:
+            if json.loads(line).get('action') == action:
+                return True
+        return False
+
+    # Vastaako yhteys yhä samalle socketille
+    def alive(self):
+        try:
+            self.sock.settimeout(PROBE_TIMEOUT)
+            return self.request({'action': 'ping', 'id': 'elossa'}, 'pong')
+        except (OSError, ValueError):
+            return False
+
+    def close(self):
+        self.sock.close()
+
+
+# Avaa yhteyksiä ja pingaa, kunnes stop asetetaan
+# Tallentaa (aloitus, valmis tai None) jokaisesta yrityksestä
+class Prober:
+    def __init__(self, port):
+        self.port = port
+        self.attempts = []
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop.is_set():
+            started = time.perf_counter()
+            try:
+                with socket.create_connection((HOST, self.port), timeout=PROBE_TIMEOUT) as sock:
+                    sock.sendall(b'{"action": "ping"}\n')
+                    ok = b'pong' in sock.recv(4096)
+            except OSError:
+                ok = False
+            self.attempts.append((started, time.perf_counter() if ok else None))
+            if not ok:
+                time.sleep(0.01)
+
+    def finish(self):
+        self.stop.set()
+        self.thread.join()
+
+    # Pisin väli kahden onnistuneen pingin välillä
+    def longest_gap(self):
+        done = sorted(end for _, end in self.attempts if end is not None)
+        return max((b - a for a, b in zip(done, done[1:])), default=0.0)
+
+
+# Lukee uuden prosessin tulostetta ja kirjaa hetken, jolloin se alkaa hyväksyä yhteyksiä
+def watch_ready(process, ready):
+    for line in process.stdout:
+        if not ready and line.startswith(READY_LINES):
+            ready.append(time.perf_counter())
+
+
+def run(mode, args):
+    workdir = tempfile.mkdtemp(prefix='bench-restart-')
+    port = free_port(HOST)
+    handoff_socket = os.path.join(workdir, 'handoff.sock')
+    server_args = ['--core', args.core, '--kdf-iterations', '1000', '--conn-rate', '0',
+                   '--handoff-socket', handoff_socket]
+    old = spawn_server(HOST, port, server_args, workdir)
+    clients = [Client(port, f"c{i}") for i in range(args.clients)]
+    prober = Prober(port)
+    time.sleep(SETTLE_TIME)
+
+    command = [sys.executable, os.path.join(ROOT, 'server.py'), '--host', HOST, '--port', str(port)] + server_args
+    restarted = time.perf_counter()
+    if mode == 'cold':
+        old.terminate()
+        old.wait()
+    else:
+        command.append('--takeover')
+        if mode == 'migrate':
+            command.append('--migrate-clients')
+    new = subprocess.Popen(command, cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                           env=dict(os.environ, PYTHONUNBUFFERED='1'))
+    ready = []
+    threading.Thread(target=watch_ready, args=(new, ready), daemon=True).start()
+    old.wait()
+    while not ready:
+        time.sleep(0.01)
+    time.sleep(SETTLE_TIME)
+    prober.finish()
+    alive = sum(client.alive() for client in clients)
+    for client in clients:
+        client.close()
+    new.terminate()
+    new.wait()
+    failed = sum(1 for _, end in prober.attempts if end is None)
+    print(f"{mode:<8} {(ready[0] - restarted) * 1000:>14.1f} {prober.longest_gap() * 1000:>12.1f} "
+          f"{failed:>11} {alive:>6}/{args.clients}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Palvelimen uudelleenkäynnistyksen katko")
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--core', choices=['thread', 'asyncio'], default='thread')
+    parser.add_argument('--mode', nargs='+', choices=['cold', 'handoff', 'migrate'],
+                        default=['cold', 'handoff', 'migrate'])
+    args = parser.parse_args()
+    print(f"{'tapa':<8} {'1. accept ms':>14} {'katko ms':>12} {'epäonnist.':>11} {'säilyi':>10}")
+    for mode in args.mode:
+        run(mode, args)
+
+
+if __name__ == "__main__":
+    main()
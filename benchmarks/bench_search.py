@@ -0,0 +1,127 @@
+# Mittaa kanavalokin hakuindeksin rakentamisen ja haun nopeuden
+# Kirjoittaa väliaikaiseen hakemistoon --lines tavallisen näköistä viestiä
+# (sanat Zipfin jakaumasta, parisataa lähettäjää) suoraan ChannelArchive-
+# luokalla, kuten palvelimen kirjoittajasäie tekee, ja mittaa:
+#   - kirjoituksen ja indeksoinnin läpäisyn (riviä sekunnissa)
+#   - lokin avaamisen uudelleenkäynnistyksen jälkeen (avoimen segmentin indeksointi)
+#   - haun keston erilaisilla termeillä (mediaani ja pisin, 20 uusinta osumaa)
+#   - vertailuksi yhden haun koko lokin läpikäynnillä
+#
+# Käyttö: python benchmarks/bench_search.py [--lines 1000000] [--keep HAKEMISTO]
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import ChannelArchive, query_terms
+
+CHANNEL = '#bench'
+VOCABULARY = 20000
+SENDERS = 200
+LIMIT = 20
+REPEATS = 50
+
+
+def make_words(rng):
+    letters = 'abcdefghijklmnopqrstuvwxyzäö'
+    words = set()
+    while len(words) < VOCABULARY:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(2, 10))))
+    return sorted(words)
+
+
+def generate(rng, words, count):
+    cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    for seq in range(1, count + 1):
+        text = ' '.join(rng.choices(words, cum_weights=cumulative, k=rng.randint(3, 15)))
+        yield (json.dumps({
+            'action': 'message',
+            'from': f"user{rng.randrange(SENDERS)}",
+            'color': 4,
+            'message': text,
+            'channel': CHANNEL,
+            'seq': seq
+        }) + '\n').encode()
+
+
+# Haku lukemalla koko loki läpi, kuten ilman indeksiä jouduttaisiin tekemään
+def scan(archive, terms, limit):
+    matches = []
+    for number in archive.log.segments:
+        with open(archive.log.segment_path(number), 'rb') as f:
+            for line in f:
+                message = json.loads(line)
+                words = set(message['message'].lower().split()) | {'from:' + message['from'].lower()}
+                if all(term in words for term in terms):
+                    matches.append(line)
+    return matches[-limit:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kanavalokin indeksin rakentaminen ja haku")
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--keep', default=None, help="Käytä tätä hakemistoa äläkä poista sitä lopuksi")
+    args = parser.parse_args()
+    rng = random.Random(1)
+    words = make_words(rng)
+    directory = args.keep or tempfile.mkdtemp(prefix='bench-search-')
+    try:
+        archive = ChannelArchive(directory, CHANNEL)
+        lines = list(generate(rng, words, args.lines))
+        size = sum(map(len, lines))
+        start = time.perf_counter()
+        for line in lines:
+            archive.append(line)
+        archive.flush()
+        elapsed = time.perf_counter() - start
+        segments = archive.segments
+        archive.close()
+        del lines
+        index_bytes = sum(os.path.getsize(os.path.join(root, name))
+                          for root, _, names in os.walk(directory) for name in names if name.endswith('.idx'))
+        print(f"{args.lines} riviä, {size / 1e6:.0f} Mt lokia, {segments} segmenttiä, "
+              f"indeksit {index_bytes / 1e6:.0f} Mt")
+        print(f"kirjoitus ja indeksointi: {elapsed:.1f} s ({args.lines / elapsed:.0f} riviä/s)")
+
+        archive = ChannelArchive(directory, CHANNEL)
+        start = time.perf_counter()
+        archive.search(['avaus'], 1)
+        print(f"avaus uudelleenkäynnistyksen jälkeen: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        queries = {
+            'yleinen sana': words[0],
+            'harvinainen sana': words[-1],
+            'lähettäjä': 'from:user7',
+            'sana ja lähettäjä': f"{words[50]} from:user7",
+            'kaksi sanaa': f"{words[10]} {words[200]}",
+            'ei osumia': 'olematon'
+        }
+        print(f"{'haku':<20} {'osumia':>7} {'mediaani ms':>12} {'pisin ms':>9}")
+        for name, query in queries.items():
+            terms = query_terms(query)
+            times = []
+            for _ in range(REPEATS):
+                start = time.perf_counter()
+                results = archive.search(terms, LIMIT)
+                times.append(time.perf_counter() - start)
+            print(f"{name:<20} {len(results):>7} {statistics.median(times) * 1000:>12.2f} {max(times) * 1000:>9.2f}")
+
+        start = time.perf_counter()
+        scan(archive, query_terms(queries['sana ja lähettäjä']), LIMIT)
+        print(f"vertailu, sama haku lukemalla koko loki: {(time.perf_counter() - start) * 1000:.0f} ms")
+        archive.close()
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Mittaa käyttäjätaustojen käynnistysajan ja rekisteröitymisen hinnan
+# Molemmat taustat täytetään samalla määrällä käyttäjiä, minkä jälkeen
+# mitataan avaus (palvelimen käynnistys), haku ja uusien käyttäjien lisäys.
+#
+# Käyttö: python benchmarks/bench_userstore.py [käyttäjämäärä]
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from userstore import JsonUserStore, SqliteUserStore
+
+SIGNUPS = 50
+
+
+def fill_json(path, count):
+    password = hashlib.sha256(b'salasana').hexdigest()
+    with open(path, 'w') as f:
+        json.dump({f'user{i}': {'password': password, 'color': 4} for i in range(count)}, f)
+
+
+def fill_sqlite(path, count):
+    password = hashlib.sha256(b'salasana').hexdigest()
+    SqliteUserStore(path).close()
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO users VALUES (?, ?, ?)',
+                     ((f'user{i}', password, 4) for i in range(count)))
+    conn.commit()
+    conn.close()
+
+
+def measure(store_class, path, count):
+    start = time.perf_counter()
+    store = store_class(path)
+    opened = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, count, max(1, count // 1000)):
+        store.get(f'user{i}')
+    lookups = min(count, 1000)
+    lookup = (time.perf_counter() - start) / lookups
+
+    start = time.perf_counter()
+    for i in range(SIGNUPS):
+        store.add(f'new{i}', {'password': 'x', 'color': 4})
+    store.close()
+    signup = (time.perf_counter() - start) / SIGNUPS
+    return opened, lookup, signup
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print(f"{count} käyttäjää, {SIGNUPS} uutta rekisteröitymistä")
+    print(f"{'tausta':<8} {'avaus ms':>10} {'haku µs':>10} {'rekisteröinti ms':>18}")
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'users.json')
+        fill_json(json_path, count)
+        opened, lookup, signup = measure(JsonUserStore, json_path, count)
+        print(f"{'json':<8} {opened * 1e3:>10.1f} {lookup * 1e6:>10.1f} {signup * 1e3:>18.3f}")
+
+        db_path = os.path.join(tmp, 'users.db')
+        fill_sqlite(db_path, count)
+        opened, lookup, signup = measure(SqliteUserStore, db_path, count)
+        print(f"{'sqlite':<8} {opened * 1e3:>10.1f} {lookup * 1e6:>10.1f} {signup * 1e3:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
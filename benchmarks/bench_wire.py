@@ -0,0 +1,84 @@
+# Vertaa JSON-rivejä ja binääriprotokollan kehyksiä
+# Mittaa tavut viestiä kohden sekä koodauksen ja purun hinnan tyypillisille
+# palvelimen viesteille. Binäärikehysten koko mitataan tilanteessa, jossa
+# kanavan ja lähettäjän numerot on jo kerrottu vastaanottajalle; ensimmäisen
+# viestin define-kehykset näytetään erikseen.
+#
+# Käyttö: python benchmarks/bench_wire.py
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wire import Interner, Peer, encode
+from framing import LineFramer
+
+ROUNDS = 100000
+
+MESSAGES = {
+    'chat': {
+        'action': 'message',
+        'from': 'Veeti',
+        'color': 4,
+        'message': 'moi kaikki, mitä kuuluu?',
+        'channel': '#general'
+    },
+    'join': {
+        'action': 'message',
+        'from': 'Hakan',
+        'color': 11,
+        'message': ' Hakan on liittynyt kanavalle #random',
+        'channel': '#random'
+    },
+    'pm': {
+        'action': 'private_message',
+        'from': 'Veeti',
+        'color': 4,
+        'message': 'nähdäänkö huomenna?'
+    },
+    'update': {
+        'action': 'channel_update',
+        'type': 'join',
+        'channel': '#general'
+    }
+}
+
+
+def per_call(func, rounds=ROUNDS):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    print(f"{'viesti':<8} {'JSON B':>7} {'bin B':>6} {'1. bin B':>9} "
+          f"{'JSON koodaus µs':>16} {'bin koodaus µs':>15} {'JSON purku µs':>14} {'bin purku µs':>13}")
+    for name, data in MESSAGES.items():
+        line = (json.dumps(data) + '\n').encode()
+
+        interner = Interner()
+        sender = Peer(interner)
+        receiver = Peer()
+        first = sender.encode(data)
+        framer = LineFramer()
+        framer.feed(first)
+        for body in framer.frames():
+            receiver.decode(body)
+        frame = sender.encode(data)
+        body = frame[1:]  # Pituusetuliite on näillä viesteillä yksi tavu
+
+        json_encode = per_call(lambda: (json.dumps(data) + '\n').encode())
+        wire_encode = per_call(lambda: sender.frame(encode(data, interner)))
+        json_decode = per_call(lambda: json.loads(line[:-1].decode()))
+        wire_decode = per_call(lambda: receiver.decode(body))
+        assert receiver.decode(body) == data
+        print(f"{name:<8} {len(line):>7} {len(frame):>6} {len(first):>9} "
+              f"{json_encode * 1e6:>16.2f} {wire_encode * 1e6:>15.2f} "
+              f"{json_decode * 1e6:>14.2f} {wire_decode * 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
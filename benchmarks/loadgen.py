@@ -0,0 +1,416 @@
+# Kuormitusgeneraattori server.py:lle
+# Avaa tuhansia yhteyksiä paikalliseen palvelimeen ilman käyttöliittymää,
+# rekisteröi tai kirjaa ne sisään, liittää ne DEFAULT_CHANNELS-kanaville
+# tasaisesti ja lähettää viestejä annetulla kokonaisnopeudella. Jokainen viesti
+# sisältää lähetyshetken, joten vastaanottajat mittaavat viiveen
+# lähetyksestä toimitukseen. Tuloksena p50/p99/p999-viive, viestiä/s ja
+# palvelimen muistinkäyttö (RSS), tallennettuna JSON-tiedostoon versioiden
+# vertailua varten.
+#
+# Käyttö:
+#   python benchmarks/loadgen.py --spawn --connections 2000 --rate 500 --duration 30 --output tulos.json
+#   python benchmarks/loadgen.py --host 127.0.0.1 --port 6668 --server-pid 1234
+#
+# --spawn käynnistää palvelimen väliaikaisessa hakemistossa (tyhjä käyttäjäkanta).
+# Rekisteröinti on hidasta oletuskierrosmäärillä, joten käynnistettävälle
+# palvelimelle annetaan oletuksena --kdf-iterations 1000.
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import queue
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from framing import LineFramer
+from wire import Peer
+from channel import DEFAULT_CHANNELS
+from connection import raise_fd_limit
+
+PASSWORD = 'kuorma'
+MARKER = 'lg '
+SEND_TICK = 0.01
+DRAIN_TIME = 2.0
+RETRY_DELAY = 0.2
+BUCKETS_PER_DOUBLING = 64  # Noin 1 % tarkkuus viiveille
+
+
+# Logaritminen viivehistogrammi mikrosekunteina
+# Pitää vain lokeroiden laskurit, joten miljoonat mittaukset eivät kasvata muistia
+class Histogram:
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+
+    def add(self, micros):
+        bucket = int(math.log2(max(micros, 1)) * BUCKETS_PER_DOUBLING)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+    def merge(self, counts):
+        for bucket, count in counts.items():
+            self.counts[int(bucket)] = self.counts.get(int(bucket), 0) + count
+
+    def total(self):
+        return sum(self.counts.values())
+
+    # Palauttaa lokeron ylärajan mikrosekunteina
+    def percentile(self, fraction):
+        total = self.total()
+        if not total:
+            return None
+        target = fraction * total
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING)
+        return None
+
+
+# Yksi simuloitu käyttäjä
+class LoadClient:
+    def __init__(self, index, username, channel, histogram, binary):
+        self.index = index
+        self.username = username
+        self.channel = channel
+        self.histogram = histogram
+        self.binary = binary
+        self.peer = None
+        self.framer = LineFramer()
+        self.reader = None
+        self.writer = None
+        self.waiting = {}
+        self.received = 0
+        self.errors = 0
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        asyncio.get_running_loop().create_task(self.read_loop())
+
+    def send(self, data):
+        if self.peer:
+            self.writer.write(self.peer.encode(data))
+        else:
+            self.writer.write((json.dumps(data) + '\n').encode())
+
+    # Lähettää pyynnön ja odottaa vastausta, jonka action on annettu
+    async def request(self, data, action):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[action] = future
+        self.send(data)
+        return await future
+
+    def responses(self):
+        if self.peer:
+            for frame in self.framer.frames():
+                data = self.peer.decode(frame)
+                if data is not None:
+                    yield data
+            return
+        lines = self.framer.lines()
+        for index, line in enumerate(lines):
+            yield json.loads(line)
+            if self.peer:
+                self.framer.unread(b''.join(rest + b'\n' for rest in lines[index + 1:]))
+                yield from self.responses()
+                return
+
+    async def read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                self.framer.feed(data)
+                now = time.perf_counter_ns()
+                for response in self.responses():
+                    self.handle(response, now)
+        except (ConnectionError, ValueError):
+            self.errors += 1
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Yhteys katkesi"))
+
+    def handle(self, response, now):
+        action = response.get('action')
+        if action == 'message':
+            message = response.get('message', '')
+            if message.startswith(MARKER):
+                self.received += 1
+                self.histogram.add((now - int(message[len(MARKER):])) / 1000)
+            return
+        # Vastaa palvelimen pingiin, muuten hiljainen yhteys katkaistaan
+        if action == 'ping':
+            self.send({'action': 'pong'})
+            return
+        if action in ('register', 'login') and response.get('status') == 'success' \
+                and response.get('protocol') == 'binary':
+            self.peer = Peer()
+        future = self.waiting.pop(action, None)
+        if future and not future.done():
+            future.set_result(response)
+
+    # Rekisteröi käyttäjän tai kirjautuu, jos nimi on jo olemassa
+    async def authenticate(self):
+        data = {'username': self.username, 'password': PASSWORD, 'color': 4}
+        if self.binary:
+            data['protocol'] = 'binary'
+        action = 'register'
+        while True:
+            response = await self.request(dict(data, action=action), action)
+            if response.get('status') == 'success':
+                return
+            message = response.get('message', '')
+            if 'ruuhka' in message:
+                await asyncio.sleep(RETRY_DELAY)
+            elif action == 'register':
+                action = 'login'
+            else:
+                raise RuntimeError(f"{self.username}: {message}")
+
+    async def join(self):
+        await self.request({'action': 'command', 'message': f'/join {self.channel}'}, 'channel_update')
+
+    def send_probe(self):
+        self.send({
+            'action': 'message',
+            'channel': self.channel,
+            'message': f'{MARKER}{time.perf_counter_ns()}'
+        })
+
+
+# Yhden työprosessin asiakkaat
+async def run_clients(config, indices, barrier):
+    histogram = Histogram()
+    clients = [
+        LoadClient(i, f"{config['prefix']}{i}", DEFAULT_CHANNELS[i % len(DEFAULT_CHANNELS)],
+                   histogram, config['binary'])
+        for i in indices
+    ]
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(config['connect_concurrency'])
+
+    async def setup(client):
+        async with limit:
+            await client.connect(config['host'], config['port'])
+            await client.authenticate()
+            await client.join()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(setup(client) for client in clients))
+    setup_time = time.perf_counter() - start
+
+    await loop.run_in_executor(None, barrier.wait)
+    histogram.counts.clear()
+
+    # Lähetys: viestit jaetaan tasaisesti omille asiakkaille SEND_TICK-välein.
+    # Lähetettävä määrä lasketaan kuluneesta ajasta, joten hetkellinen
+    # viive tasoittuu seuraavalla kierroksella.
+    share = config['rate'] * len(clients) / config['connections']
+    sent = 0
+    start = time.perf_counter()
+    deadline = start + config['duration']
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        while sent < share * (now - start):
+            clients[sent % len(clients)].send_probe()
+            sent += 1
+        await asyncio.sleep(SEND_TICK)
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(DRAIN_TIME)
+
+    result = {
+        'setup_time': setup_time,
+        'elapsed': elapsed,
+        'sent': sent,
+        'received': sum(client.received for client in clients),
+        'errors': sum(client.errors for client in clients),
+        'histogram': histogram.counts
+    }
+    for client in clients:
+        client.writer.close()
+    return result
+
+
+def worker(config, indices, barrier, results):
+    raise_fd_limit()
+    try:
+        results.put(asyncio.run(run_clients(config, indices, barrier)))
+    except Exception as e:
+        barrier.abort()
+        results.put({'error': repr(e)})
+
+
+# Palauttaa prosessin muistinkäytön tavuina (vain Linux /proc)
+def read_rss(pid):
+    if not pid:
+        return None
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+# log on avoin tiedosto palvelimen tulosteelle, oletuksena tuloste hylätään
+def spawn_server(host, port, server_args, workdir, log=None):
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), '--host', host, '--port', str(port)] + server_args,
+        cwd=workdir, stdout=log or subprocess.DEVNULL,
+        stderr=subprocess.STDOUT if log else subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Palvelin ei käynnistynyt")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kuormitusgeneraattori server.py:lle")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6668)
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=200, help="Lähetettäviä viestejä sekunnissa yhteensä")
+    parser.add_argument('--duration', type=float, default=10, help="Mittauksen kesto sekunteina")
+    parser.add_argument('--workers', type=int, default=1, help="Asiakkaita ajavien prosessien määrä")
+    parser.add_argument('--connect-concurrency', type=int, default=100)
+    parser.add_argument('--prefix', default=None, help="Käyttäjänimien etuliite (oletus satunnainen)")
+    parser.add_argument('--binary', action='store_true', help="Käytä binääriprotokollaa")
+    parser.add_argument('--spawn', action='store_true', help="Käynnistä palvelin väliaikaisessa hakemistossa")
+    parser.add_argument('--server-args', default='--core asyncio --kdf-iterations 1000 --conn-rate 0',
+                        help="Käynnistettävän palvelimen parametrit")
+    parser.add_argument('--server-pid', type=int, default=None, help="Palvelimen prosessi RSS-mittausta varten")
+    parser.add_argument('--output', default=None, help="Tulosten JSON-tiedosto")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    workdir = None
+    process = None
+    server_pid = args.server_pid
+    if args.spawn:
+        workdir = tempfile.TemporaryDirectory(prefix='loadgen')
+        if args.port == 6668:
+            args.port = free_port(args.host)
+        process = spawn_server(args.host, args.port, shlex.split(args.server_args), workdir.name)
+        server_pid = process.pid
+
+    config = {
+        'host': args.host,
+        'port': args.port,
+        'connections': args.connections,
+        'rate': args.rate,
+        'duration': args.duration,
+        'connect_concurrency': max(1, args.connect_concurrency // args.workers),
+        'prefix': args.prefix or f"lg{os.urandom(3).hex()}_",
+        'binary': args.binary
+    }
+    try:
+        rss_idle = read_rss(server_pid)
+        barrier = multiprocessing.Barrier(args.workers + 1)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(
+                config, range(w, args.connections, args.workers), barrier, results))
+            for w in range(args.workers)
+        ]
+        for p in processes:
+            p.start()
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        rss_connected = read_rss(server_pid)
+        rss_peak = rss_connected
+        gathered = []
+        while len(gathered) < len(processes):
+            try:
+                gathered.append(results.get(timeout=0.5))
+            except queue.Empty:
+                rss = read_rss(server_pid)
+                if rss and (rss_peak is None or rss > rss_peak):
+                    rss_peak = rss
+        for p in processes:
+            p.join()
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        if workdir:
+            workdir.cleanup()
+
+    failed = [r['error'] for r in gathered if 'error' in r]
+    if failed:
+        print("Kuormitus epäonnistui:", failed[0])
+        sys.exit(1)
+
+    histogram = Histogram()
+    for r in gathered:
+        histogram.merge(r['histogram'])
+    elapsed = max(r['elapsed'] for r in gathered)
+    sent = sum(r['sent'] for r in gathered)
+    received = sum(r['received'] for r in gathered)
+    latency = {
+        name: histogram.percentile(fraction) / 1000 if histogram.total() else None
+        for name, fraction in (('p50', 0.5), ('p99', 0.99), ('p999', 0.999), ('max', 1.0))
+    }
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: config[key] for key in ('connections', 'rate', 'duration', 'binary')},
+        'server_args': args.server_args if args.spawn else None,
+        'setup_time_s': max(r['setup_time'] for r in gathered),
+        'sent': sent,
+        'delivered': received,
+        'sent_per_s': sent / elapsed,
+        'delivered_per_s': received / elapsed,
+        'latency_ms': latency,
+        'server_rss': {'idle': rss_idle, 'connected': rss_connected, 'peak': rss_peak},
+        'client_errors': sum(r['errors'] for r in gathered)
+    }
+
+    print(f"Yhteyksiä {args.connections}, asetus {report['setup_time_s']:.1f} s")
+    print(f"Lähetetty {sent} ({report['sent_per_s']:.0f}/s), toimitettu {received} "
+          f"({report['delivered_per_s']:.0f}/s)")
+    if histogram.total():
+        print("Viive ms: " + ", ".join(f"{name} {value:.2f}" for name, value in latency.items()))
+    if rss_peak:
+        print(f"Palvelimen RSS: {rss_connected / 2**20:.1f} MiB yhdistettynä, huippu {rss_peak / 2**20:.1f} MiB")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# Toistaa palvelimen --capture-tallenteen paikalliselle palvelimelle
+# Jokainen tallenteen yhteys avataan, sen rivit ja kehykset lähetetään ja se
+# suljetaan samoilla hetkillä kuin tallennettaessa, --speed kertaa nopeammin.
+# Vastaukset luetaan ja lasketaan, mutta niitä ei tulkita, paitsi
+# istuntotunnisteet: tallenteessa ne on korvattu, joten istunnon jatkon
+# tunniste vaihdetaan toistossa saman käyttäjän viimeksi saamaan tunnisteeseen.
+#
+# Salasanat on tallenteessa korvattu samalla arvolla, joten tallenteen
+# rekisteröinnit ja kirjautumiset toimivat keskenään. Käyttäjät, jotka vain
+# kirjautuvat, rekisteröidään ennen toistoa. Linkkiyhteydet ohitetaan.
+#
+# Tuloksena toiston kesto, myöhästymiset aikataulusta (kertoo, pysyikö
+# toistaja tahdissa) ja palvelimen muistinkäyttö, tallennettuna halutessa
+# JSON-tiedostoon versioiden vertailua varten.
+#
+# Käyttö:
+#   python server.py --capture liikenne.trc ...      (tallennus, lopetus Ctrl+C)
+#   python benchmarks/replay.py liikenne.trc --spawn [--speed 10] [--output tulos.json]
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadgen import Histogram, free_port, git_revision, read_rss, spawn_server
+from capture import CLOSE, LINE, OPEN, REDACTED, TraceError, read_trace
+from wire import write_varint
+from connection import raise_fd_limit
+
+SETUP_TIMEOUT = 10.0
+DRAIN_TIME = 1.0
+SETTLE_TIME = 0.5
+
+
+def decode_line(payload):
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+# Tallenteen yhteys: avaus- ja sulkemishetki sekä lähetettävät tapahtumat
+class TracedConnection:
+    def __init__(self, number, opened):
+        self.number = number
+        self.opened = opened
+        self.closed = None
+        self.events = []
+
+    def is_link(self):
+        for kind, _, payload in self.events:
+            if kind == LINE:
+                data = decode_line(payload)
+                return data is not None and data.get('action') == 'link'
+        return False
+
+
+# Ryhmittelee tallenteen tietueet yhteyksittäin
+def load_connections(path):
+    _, records = read_trace(path)
+    connections = {}
+    for kind, number, at, payload in records:
+        if kind == OPEN:
+            connections[number] = TracedConnection(number, at)
+        elif number not in connections:
+            continue
+        elif kind == CLOSE:
+            connections[number].closed = at
+        else:
+            connections[number].events.append((kind, at, payload))
+    end = records[-1][2] if records else 0.0
+    return sorted(connections.values(), key=lambda c: c.opened), end
+
+
+# Käyttäjät, jotka kirjautuvat tallenteessa mutta eivät rekisteröidy siinä
+def users_to_register(connections):
+    logins = set()
+    registered = set()
+    for connection in connections:
+        for kind, _, payload in connection.events:
+            data = decode_line(payload) if kind == LINE else None
+            if data is None:
+                continue
+            if data.get('action') == 'login':
+                logins.add(data.get('username', '').strip())
+            elif data.get('action') == 'register':
+                registered.add(data.get('username', '').strip())
+    return sorted(name for name in logins - registered if name)
+
+
+# Jokainen käyttäjä rekisteröidään omalla yhteydellään, joka suljetaan heti,
+# jotta toiston kirjautuminen ei törmää vielä avoimeen istuntoon
+async def register_users(host, port, usernames):
+    for username in usernames:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write((json.dumps({'action': 'register', 'username': username, 'password': REDACTED,
+                                      'color': 15}) + '\n').encode())
+            while True:
+                line = await asyncio.wait_for(reader.readline(), SETUP_TIMEOUT)
+                if not line:
+                    raise ConnectionError("Palvelin sulki yhteyden rekisteröinnin aikana")
+                if json.loads(line).get('action') == 'register':
+                    break
+        finally:
+            writer.close()
+    await asyncio.sleep(SETTLE_TIME)
+
+
+class Replayer:
+    def __init__(self, host, port, speed):
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.sessions = {}
+        self.lateness = Histogram()
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.start = None
+
+    async def wait_until(self, at):
+        delay = self.start + at / self.speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.lateness.add(max(0.0, time.perf_counter() - self.start - at / self.speed) * 1e6)
+
+    # Korvaa istunnon jatkon tunnisteen toistossa saadulla
+    def rewrite(self, payload):
+        if b'"resume"' not in payload:
+            return payload
+        data = decode_line(payload)
+        if data is None or data.get('action') != 'resume':
+            return payload
+        data['session_id'] = self.sessions.get(str(data.get('username')), REDACTED)
+        return json.dumps(data).encode()
+
+    # Laskee vastaanotetut tavut ja poimii istuntotunnisteet
+    # Vastaukset ovat JSON-rivejä, kunnes palvelin ottaa binääriprotokollan
+    # tai pakkauksen käyttöön; sen jälkeisiä tavuja ei enää tulkita
+    async def drain(self, reader):
+        buffered = b''
+        plain = True
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                self.received += len(data)
+                if not plain:
+                    continue
+                buffered += data
+                *lines, buffered = buffered.split(b'\n')
+                for line in lines:
+                    response = decode_line(line)
+                    if response is None:
+                        continue
+                    if response.get('session_id') and response.get('username'):
+                        self.sessions[response['username']] = response['session_id']
+                    if response.get('protocol') or response.get('compress'):
+                        plain = False
+                        break
+        except ConnectionError:
+            pass
+
+    async def replay(self, connection, end):
+        await self.wait_until(connection.opened)
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self.errors += 1
+            return
+        drain = asyncio.get_running_loop().create_task(self.drain(reader))
+        try:
+            for kind, at, payload in connection.events:
+                await self.wait_until(at)
+                if kind == LINE:
+                    writer.write(self.rewrite(payload) + b'\n')
+                else:
+                    head = bytearray()
+                    write_varint(head, len(payload))
+                    writer.write(bytes(head) + payload)
+                self.sent += 1
+            await self.wait_until(end if connection.closed is None else connection.closed)
+        except ConnectionError:
+            self.errors += 1
+        finally:
+            writer.close()
+            await asyncio.wait([drain], timeout=DRAIN_TIME)
+            drain.cancel()
+
+    async def run(self, connections, end):
+        self.start = time.perf_counter()
+        await asyncio.gather(*(self.replay(connection, end) for connection in connections))
+        return time.perf_counter() - self.start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tallennetun liikenteen toisto")
+    parser.add_argument('trace', help="Palvelimen --capture-valinnalla tallentama tiedosto")
+    parser.add_argument('--speed', type=float, default=1.0, help="Toistonopeus, esim. 10 = kymmenkertainen")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6668)
+    parser.add_argument('--spawn', action='store_true', help="Käynnistä palvelin väliaikaisessa hakemistossa")
+    parser.add_argument('--server-args', default='--core asyncio --kdf-iterations 1000 --conn-rate 0',
+                        help="Käynnistettävän palvelimen parametrit")
+    parser.add_argument('--server-pid', type=int, default=None, help="Palvelimen prosessi RSS-mittausta varten")
+    parser.add_argument('--output', default=None, help="Tulosten JSON-tiedosto")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed on oltava positiivinen")
+
+    try:
+        connections, end = load_connections(args.trace)
+    except (OSError, TraceError) as e:
+        sys.exit(f"Tallenteen luku epäonnistui: {e}")
+    links = [connection for connection in connections if connection.is_link()]
+    connections = [connection for connection in connections if not connection.is_link()]
+    frames = sum(len(connection.events) for connection in connections)
+    print(f"Tallenteessa {len(connections)} yhteyttä ja {frames} pyyntöä {end:.1f} sekunnin ajalta"
+          + (f", {len(links)} linkkiyhteyttä ohitetaan" if links else ""))
+
+    raise_fd_limit()
+    workdir = None
+    process = None
+    server_pid = args.server_pid
+    if args.spawn:
+        workdir = tempfile.TemporaryDirectory(prefix='replay')
+        if args.port == 6668:
+            args.port = free_port(args.host)
+        process = spawn_server(args.host, args.port, shlex.split(args.server_args), workdir.name)
+        server_pid = process.pid
+
+    replayer = Replayer(args.host, args.port, args.speed)
+    try:
+        usernames = users_to_register(connections)
+        if usernames:
+            asyncio.run(register_users(args.host, args.port, usernames))
+        rss_idle = read_rss(server_pid)
+        elapsed = asyncio.run(replayer.run(connections, end))
+        rss_end = read_rss(server_pid)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        if workdir:
+            workdir.cleanup()
+
+    lateness = {
+        name: replayer.lateness.percentile(fraction) / 1000 if replayer.lateness.total() else None
+        for name, fraction in (('p50', 0.5), ('p99', 0.99), ('max', 1.0))
+    }
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'trace': os.path.basename(args.trace),
+        'speed': args.speed,
+        'server_args': args.server_args if args.spawn else None,
+        'connections': len(connections),
+        'sent': replayer.sent,
+        'received_bytes': replayer.received,
+        'trace_duration_s': end,
+        'elapsed_s': elapsed,
+        'lateness_ms': lateness,
+        'server_rss': {'idle': rss_idle, 'end': rss_end},
+        'client_errors': replayer.errors
+    }
+
+    print(f"Toistettu {replayer.sent} pyyntöä {elapsed:.1f} sekunnissa "
+          f"(tallenne {end / args.speed:.1f} s nopeudella {args.speed:g}x), "
+          f"vastaanotettu {replayer.received / 1e6:.1f} Mt, virheitä {replayer.errors}")
+    if replayer.lateness.total():
+        print("Myöhästyminen aikataulusta ms: " + ", ".join(f"{name} {value:.2f}" for name, value in lateness.items()))
+    if rss_end:
+        print(f"Palvelimen RSS: {rss_idle / 2**20:.1f} MiB alussa, {rss_end / 2**20:.1f} MiB lopussa")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
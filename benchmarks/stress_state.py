@@ -0,0 +1,146 @@
+# Rasitustesti palvelimen jaetulle tilalle
+# Useat asiakkaat liittyvät kanaville, poistuvat, lähettävät viestejä ja
+# kysyvät /who- ja /list-tietoja yhtä aikaa ilman vastausten odottamista.
+# Aika sisältää myös palvelimen jonoon jääneiden pyyntöjen käsittelyn.
+# Lopuksi kaikki rasittajat katkaisevat yhteyden, ja tarkistetaan, että
+# palvelimen lokissa ei ole poikkeuksia ja että kanavien jäsenmäärät
+# palautuivat nollaan. Palauttaa virhekoodin 1, jos jokin tarkistus epäonnistuu.
+#
+# Käyttö: python benchmarks/stress_state.py [--clients 50] [--duration 10] [--core asyncio]
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadgen import free_port, spawn_server
+
+HOST = '127.0.0.1'
+CHANNELS = ['#general', '#random', '#help', '#stress1', '#stress2']
+SETTLE_TIME = 2.0
+DRAIN_TIMEOUT = 120.0
+
+
+class StressClient:
+    def __init__(self, port, username):
+        self.sock = socket.create_connection((HOST, port))
+        self.file = self.sock.makefile('rb')
+        self.received = 0
+        self.sent = 0
+        self.done = threading.Event()
+        self.send({'action': 'register', 'username': username, 'password': 'salasana', 'color': 4})
+        for line in self.file:
+            if json.loads(line).get('action') == 'register':
+                break
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.reader.start()
+
+    def send(self, data):
+        self.sock.sendall((json.dumps(data) + '\n').encode())
+        self.sent += 1
+
+    def read(self):
+        try:
+            for line in self.file:
+                self.received += 1
+                if b'"id": "valmis"' in line:
+                    self.done.set()
+        except OSError:
+            pass
+
+    def hammer(self, deadline, seed):
+        rng = random.Random(seed)
+        joined = set()
+        while time.monotonic() < deadline:
+            choice = rng.random()
+            channel = rng.choice(CHANNELS)
+            if choice < 0.3:
+                self.send({'action': 'command', 'message': f'/join {channel}'})
+                joined.add(channel)
+            elif choice < 0.5:
+                self.send({'action': 'command', 'message': f'/leave {channel}'})
+                joined.discard(channel)
+            elif choice < 0.9 and joined:
+                self.send({'action': 'message', 'channel': rng.choice(sorted(joined)), 'message': 'rasitus'})
+            elif choice < 0.95:
+                self.send({'action': 'command', 'message': f'/who {channel}'})
+            else:
+                self.send({'action': 'command', 'message': '/list'})
+        # Palvelin on käsitellyt kaikki pyynnöt, kun viimeiseen on vastattu
+        self.send({'action': 'command', 'message': '/list', 'id': 'valmis'})
+        self.done.wait(DRAIN_TIMEOUT)
+
+    def close(self):
+        # makefile pitää socketin auki, joten yhteys katkaistaan shutdownilla
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+
+
+def request(sock, file, data, action):
+    sock.sendall((json.dumps(data) + '\n').encode())
+    for line in file:
+        response = json.loads(line)
+        if response.get('action') == action:
+            return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jaetun tilan rasitustesti")
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--core', choices=['thread', 'asyncio'], default='thread')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stress')
+    log_path = os.path.join(workdir, 'server.log')
+    port = free_port(HOST)
+    with open(log_path, 'w') as log:
+        process = spawn_server(HOST, port, ['--core', args.core, '--kdf-iterations', '1000',
+                                            '--conn-rate', '0'], workdir, log)
+    try:
+        clients = [StressClient(port, f'rasittaja{index}') for index in range(args.clients)]
+        deadline = time.monotonic() + args.duration
+        threads = [threading.Thread(target=client.hammer, args=(deadline, index))
+                   for index, client in enumerate(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        sent = sum(client.sent for client in clients)
+        received = sum(client.received for client in clients)
+        for client in clients:
+            client.close()
+        time.sleep(SETTLE_TIME)
+
+        checker = socket.create_connection((HOST, port))
+        file = checker.makefile('rb')
+        request(checker, file, {'action': 'register', 'username': 'tarkistaja', 'password': 'salasana',
+                                'color': 4}, 'register')
+        listing = request(checker, file, {'action': 'command', 'message': '/list'}, 'channel_list')
+        leftovers = {entry['name']: entry['members'] for entry in listing['channels'] if entry['members']}
+        checker.close()
+    finally:
+        process.terminate()
+        process.wait()
+
+    with open(log_path) as log:
+        errors = log.read().count('Traceback')
+    print(f"{args.clients} asiakasta, {sent} pyyntöä {elapsed:.1f} s ({sent / elapsed:.0f}/s), "
+          f"{received} vastaanotettua viestiä")
+    print(f"poikkeuksia lokissa: {errors}, jäseniä jäljellä: {leftovers or 0}")
+    if errors or leftovers:
+        print(f"EPÄONNISTUI, loki: {log_path}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import itertools
+import json
+import struct
+import threading
+import time
+from collections import deque
+
+from wire import read_varint, write_varint
+
+# Saapuvan liikenteen tallennus toistoa varten
+# Palvelin kirjaa valinnalla --capture jokaisen asiakkaalta luetun rivin tai
+# binäärikehyksen aikaleimoineen tiivistiedostoon, jonka benchmarks/replay.py
+# toistaa paikalliselle palvelimelle samoilla yhteyksillä ja ajoituksilla.
+#
+# Tiedosto alkaa otsakkeella <tunniste><versio><aloitushetki µs (u64)>, jonka
+# jälkeen tulee tietueita:
+#   <tyyppi><yhteys varint><aika edellisestä tietueesta µs varint>[<pituus varint><data>]
+# Yhteydet numeroidaan tallennuksen alusta, rivit tallennetaan ilman
+# rivinvaihtoa ja kehykset ilman pituusetuliitettä.
+#
+# Lukijasäikeet vain lisäävät tietueen jonoon; kirjoittajasäie tyhjentää
+# jonon CAPTURE_INTERVAL sekunnin välein, joten tallennus ei lisää lukituksia
+# eikä levykirjoituksia pyyntöjen käsittelyyn. Salasanat, istuntotunnisteet ja
+# linkkien salaisuudet korvataan ennen tallennusta.
+
+TRACE_MAGIC = b'IRCT'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('=4sBQ')  # tunniste, versio, aloitushetki (µs epochista)
+CAPTURE_INTERVAL = 0.2
+CAPTURE_MAX_PENDING = 1000000
+
+# Tietueiden tyypit
+OPEN = 1
+LINE = 2   # JSON-rivi
+FRAME = 3  # Binääriprotokollan kehys
+CLOSE = 4
+
+REDACTED_FIELDS = frozenset(('password', 'session_id', 'secret'))
+REDACTED = 'redacted'
+
+
+class TraceError(Exception):
+    pass
+
+
+# Palauttaa rivin tallennettavassa muodossa
+# Tunnuksia sisältävä pyyntö koodataan uudelleen korvatuin arvoin.
+# Jäsentymättömästä rivistä ei tiedetä, mitä se sisältää, joten se kirjataan
+# tyhjänä, jos siinä esiintyy jonkin tunnuskentän nimi.
+def redact_line(line, data):
+    if data is None:
+        if any(field.encode() in line for field in REDACTED_FIELDS):
+            return b''
+        return line
+    if REDACTED_FIELDS.isdisjoint(data):
+        return line
+    return json.dumps({key: REDACTED if key in REDACTED_FIELDS else value
+                       for key, value in data.items()}).encode()
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, time.time_ns() // 1000))
+        self.items = deque()
+        self.ids = {}
+        self.numbers = itertools.count(1)
+        self.last = time.monotonic_ns() // 1000
+        self.records = 0
+        self.dropped = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _put(self, kind, number, data=None):
+        if len(self.items) >= CAPTURE_MAX_PENDING:
+            self.dropped += 1
+            return
+        self.items.append((kind, number, time.monotonic_ns() // 1000, data))
+
+    def open(self, conn):
+        number = self.ids[conn] = next(self.numbers)
+        self._put(OPEN, number)
+
+    # Kirjaa JSON-rivin; data on jäsennetty pyyntö tai None
+    def line(self, conn, line, data):
+        number = self.ids.get(conn)
+        if number is not None:
+            self._put(LINE, number, redact_line(line, data))
+
+    # Kirjaa binäärikehyksen; data on purettu kehys (None define-kehykselle)
+    # Tunnuksia sisältävä kehys jätetään pois
+    def frame(self, conn, body, data):
+        number = self.ids.get(conn)
+        if number is not None and (data is None or REDACTED_FIELDS.isdisjoint(data)):
+            self._put(FRAME, number, body)
+
+    def close(self, conn):
+        number = self.ids.pop(conn, None)
+        if number is not None:
+            self._put(CLOSE, number)
+
+    def _run(self):
+        while not self.stopped.wait(CAPTURE_INTERVAL):
+            self._write()
+
+    # Kirjoittaa jonossa olevat tietueet
+    # Eri säikeiden aikaleimat voivat olla jonossa hieman sekaisin, joten
+    # aikaero rajataan nollaan
+    def _write(self):
+        out = bytearray()
+        items = self.items
+        last = self.last
+        while items:
+            kind, number, stamp, data = items.popleft()
+            out.append(kind)
+            write_varint(out, number)
+            write_varint(out, max(0, stamp - last))
+            last = max(last, stamp)
+            if data is not None:
+                write_varint(out, len(data))
+                out += data
+            self.records += 1
+        self.last = last
+        if out:
+            self.file.write(out)
+            self.file.flush()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self._write()
+        self.file.close()
+
+
+# Lukee tallenteen
+# Palauttaa aloitushetken (µs epochista) ja listan tietueista
+# (tyyppi, yhteys, aika tallennuksen alusta sekunteina, data tai None)
+def read_trace(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < TRACE_HEADER.size:
+        raise TraceError("Tallenne on liian lyhyt")
+    magic, version, started = TRACE_HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise TraceError(f"Tuntematon tallennemuoto: {magic!r} versio {version}")
+    records = []
+    pos = TRACE_HEADER.size
+    end = len(data)
+    clock = 0
+    while pos < end:
+        kind = data[pos]
+        number, pos = read_varint(data, pos + 1, end)
+        delta, pos = read_varint(data, pos, end) if number is not None else (None, pos)
+        if delta is None:
+            break
+        clock += delta
+        payload = None
+        if kind in (LINE, FRAME):
+            length, pos = read_varint(data, pos, end)
+            if length is None or pos + length > end:
+                break
+            payload = data[pos:pos + length]
+            pos += length
+        elif kind not in (OPEN, CLOSE):
+            raise TraceError(f"Tuntematon tietue {kind} kohdassa {pos}")
+        records.append((kind, number, clock / 1e6, payload))
+    return started, records
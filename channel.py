@@ -0,0 +1,297 @@
+import re
+import sys
+import threading
+from collections import deque
+
+from archive import ChannelArchive, archive_writer
+
+# Kanavat ja niiden viestihistoria
+# Jokaisella kanavalla on jäsenjoukko ja rengaspuskuri viimeisimmistä,
+# valmiiksi koodatuista viesteistä. Puskuri on rajattu sekä viestien määrän
+# että muistin mukaan. Halutessa viestit kirjoitetaan myös levylle
+# segmenttitiedostoihin (archive.py), joista vanhempaa historiaa luetaan
+# mmapilla ja joista voi hakea sanoilla ja lähettäjillä.
+#
+# Jäsenyyksiä muutetaan kanavan lukon alla. Lähetykset eivät iteroi
+# muuttuvaa joukkoa, vaan muuttumatonta kopiota, joka rakennetaan uudelleen
+# vasta jäsenyyden muututtua. Viestin numerointi, lähetys ja tallennus
+# tehdään myös kanavan lukon alla, jotta kaikki näkevät viestit samassa
+# järjestyksessä kuin historia.
+#
+# Palvelin luo kanavan ensimmäisellä liittymisellä ja poistaa sen, kun
+# viimeinen jäsen on lähtenyt (oletuskanavia lukuun ottamatta). Kanavien
+# määrää ja yhteyden kanavia rajataan, ja kanavan nimi tarkistetaan.
+
+# Pysyvät kanavat, joita ei poisteta tyhjinäkään
+DEFAULT_CHANNELS = ["#general", "#random", "#help"]
+DEFAULT_SCROLLBACK_MESSAGES = 200
+DEFAULT_SCROLLBACK_BYTES = 256 * 1024
+DEFAULT_REPLAY_MESSAGES = 20
+DEQUE_SLOT_BYTES = 8
+DEFAULT_MAX_CHANNELS = 1000
+DEFAULT_MAX_JOINED = 50
+MAX_CHANNEL_NAME = 32
+CHANNEL_NAME = re.compile(r'#[\w-]{1,%d}' % MAX_CHANNEL_NAME)
+# Tyhjän kanavan arvioitu koko: olio, lukot, jäsenjoukko ja tyhjä deque
+CHANNEL_BYTES = 1024
+
+
+# Kanavan nimessä on #-etuliite ja enintään MAX_CHANNEL_NAME kirjainta,
+# numeroa, alaviivaa tai viivaa
+def valid_channel_name(name):
+    return CHANNEL_NAME.fullmatch(name) is not None
+
+
+# Kaikkien kanavien yhteiset historia-asetukset
+# Palvelin muuttaa näitä käynnistysparametrien mukaan
+class ScrollbackSettings:
+    def __init__(self):
+        self.max_messages = DEFAULT_SCROLLBACK_MESSAGES
+        self.max_bytes = DEFAULT_SCROLLBACK_BYTES
+        self.replay = DEFAULT_REPLAY_MESSAGES
+        self.log_dir = None
+
+
+scrollback_settings = ScrollbackSettings()
+
+
+# Muistissa pidettävä rengaspuskuri
+# Muistiarvio sisältää bytes-olioiden koon ja deque-paikan
+class Scrollback:
+    def __init__(self, settings):
+        self.settings = settings
+        self.messages = deque()
+        self.memory = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def append(self, payload):
+        self.messages.append(payload)
+        self.memory += sys.getsizeof(payload) + DEQUE_SLOT_BYTES
+        while self.messages and (len(self.messages) > self.settings.max_messages
+                                 or self.memory > self.settings.max_bytes):
+            dropped = self.messages.popleft()
+            self.memory -= sys.getsizeof(dropped) + DEQUE_SLOT_BYTES
+
+    # Palauttaa enintään count viimeisintä viestiä vanhimmasta uusimpaan
+    def recent(self, count):
+        if count >= len(self.messages):
+            return list(self.messages)
+        return [self.messages[i] for i in range(len(self.messages) - count, len(self.messages))]
+
+
+# Jäsenjoukko, jonka lähetykset iteroivat muuttumatonta kopiota
+# Kopio rakennetaan laiskasti ensimmäisellä lähetyksellä muutoksen jälkeen,
+# joten tasaisessa tilassa lähetys ei kopioi mitään.
+class MemberSet:
+    __slots__ = ('items', 'frozen', 'lock')
+
+    def __init__(self):
+        self.items = set()
+        self.frozen = ()
+        self.lock = threading.Lock()
+
+    # Lisää jäsenen, palauttaa False jos se oli jo joukossa
+    def add(self, item):
+        with self.lock:
+            if item in self.items:
+                return False
+            self.items.add(item)
+            self.frozen = None
+            return True
+
+    # Poistaa jäsenen, palauttaa False jos sitä ei ollut joukossa
+    def discard(self, item):
+        with self.lock:
+            if item not in self.items:
+                return False
+            self.items.discard(item)
+            self.frozen = None
+            return True
+
+    # Palauttaa jäsenet tuplena, joka ei muutu vaikka joukko muuttuisi
+    def snapshot(self):
+        frozen = self.frozen
+        if frozen is None:
+            with self.lock:
+                if self.frozen is None:
+                    self.frozen = tuple(self.items)
+                frozen = self.frozen
+        return frozen
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+
+# Kanava: jäsenet ja historia
+# Jäsenmäärä pidetään omassa laskurissaan ja nimilista muodostetaan vasta
+# kysyttäessä, jonka jälkeen se säilytetään seuraavaan jäsenmuutokseen asti.
+# Linkitettyjen solmujen käyttäjät ovat remote-sanakirjassa (nimi -> solmu);
+# ne näkyvät jäsenmäärässä ja nimilistassa, mutta viestit välittää linkki.
+class Channel:
+    def __init__(self, name, settings=scrollback_settings):
+        self.name = name
+        self.members = MemberSet()
+        self.lock = threading.RLock()
+        self.usernames = {}
+        self.remote = {}
+        self.count = 0
+        self.names = None
+        self.seq = 0
+        self.settings = settings
+        self.scrollback = Scrollback(settings)
+        self.archive = None
+
+    # Lisää jäsenen, palauttaa False jos yhteys oli jo kanavalla
+    def add(self, conn, username):
+        with self.lock:
+            if not self.members.add(conn):
+                return False
+            self.usernames[conn] = username
+            self.count += 1
+            self.names = None
+            return True
+
+    # Poistaa jäsenen, palauttaa False jos yhteys ei ollut kanavalla
+    def remove(self, conn):
+        with self.lock:
+            if not self.members.discard(conn):
+                return False
+            self.usernames.pop(conn, None)
+            self.count -= 1
+            self.names = None
+            return True
+
+    def add_remote(self, username, node):
+        with self.lock:
+            if username in self.remote:
+                return False
+            self.remote[username] = node
+            self.count += 1
+            self.names = None
+            return True
+
+    def remove_remote(self, username):
+        with self.lock:
+            if self.remote.pop(username, None) is None:
+                return False
+            self.count -= 1
+            self.names = None
+            return True
+
+    # Palauttaa kanavan käyttäjänimet aakkosjärjestyksessä
+    def who(self):
+        names = self.names
+        if names is None:
+            with self.lock:
+                names = self.names = sorted([*self.usernames.values(), *self.remote])
+        return names
+
+    # Antaa seuraavan historiaan tallennettavan viestin järjestysnumeron
+    # Numerot ovat peräkkäisiä, joten viimeiset seq - n viestiä ovat ne,
+    # jotka numeron n nähnyt asiakas on menettänyt. Kutsutaan kanavan lukon
+    # alla yhdessä lähetyksen ja record-kutsun kanssa.
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    # Tallentaa valmiiksi koodatun viestin historiaan
+    # Levylle kirjoittaminen ja indeksointi tehdään kirjoittajasäikeessä
+    def record(self, payload):
+        with self.lock:
+            self.scrollback.append(payload)
+            if self.settings.log_dir:
+                archive_writer.submit(self._archive(), payload)
+
+    def _archive(self):
+        if self.archive is None:
+            self.archive = ChannelArchive(self.settings.log_dir, self.name)
+        return self.archive
+
+    # Palauttaa edellisen prosessin historian palvelimen vaihdon jälkeen
+    # Viestit ovat jo levylokissa, joten ne lisätään vain muistiin
+    def restore(self, seq, payloads):
+        with self.lock:
+            self.seq = seq
+            for payload in payloads:
+                self.scrollback.append(payload)
+
+    # Palauttaa viestit, joiden järjestysnumero on suurempi kuin seq
+    # Palauttaa myös, montako viestiä puuttuu, koska ne eivät ole enää tallessa,
+    # ja viimeisimmän palautetun järjestysnumeron
+    def since(self, seq, limit):
+        with self.lock:
+            missed = self.seq - seq
+            if missed <= 0:
+                return [], 0, self.seq
+            lines = self.history(min(missed, limit))
+            return lines, missed - len(lines), self.seq
+
+    # Tarvitaanko count viimeisimmän viestin lukemiseen levylokia
+    def on_disk(self, count):
+        return count > len(self.scrollback) and bool(self.settings.log_dir)
+
+    # Palauttaa count viimeisintä viestiä, muistista tai tarvittaessa levyltä
+    def history(self, count):
+        with self.lock:
+            if count <= len(self.scrollback) or not self.settings.log_dir:
+                return self.scrollback.recent(count)
+            archive = self._archive()
+        archive_writer.flush()
+        return archive.tail(count)
+
+    # Palauttaa enintään limit uusinta lokin riviä, joissa kaikki termit
+    # esiintyvät, uusimmasta vanhimpaan. None, jos levylokia ei ole käytössä.
+    def search(self, terms, limit):
+        if not self.settings.log_dir:
+            return None
+        with self.lock:
+            archive = self._archive()
+        archive_writer.flush()
+        return archive.search(terms, limit)
+
+    def close(self):
+        if self.archive:
+            archive_writer.flush()
+            self.archive.close()
+            self.archive = None
+
+    # Sulkee poistettavan kanavan levylokin
+    # Sulkeminen kulkee kirjoittajasäikeen jonossa, joten jonossa olevat rivit
+    # kirjoitetaan ensin eikä kutsuja jää odottamaan levyä
+    def release(self):
+        with self.lock:
+            if self.archive is not None:
+                archive_writer.close(self.archive)
+                self.archive = None
+
+    # Arvioi kanavan muistinkäytön tavuina: jäsentaulut, nimilista, historia
+    # ja avoimen lokisegmentin hakuindeksi. Yhteydet ja käyttäjänimet ovat
+    # muun palvelimen kanssa yhteisiä, joten niistä lasketaan vain taulut.
+    def memory(self):
+        with self.lock:
+            size = (CHANNEL_BYTES + sys.getsizeof(self.members.items) + sys.getsizeof(self.members.frozen or ())
+                    + sys.getsizeof(self.usernames) + sys.getsizeof(self.remote) + self.scrollback.memory)
+            if self.names is not None:
+                size += sys.getsizeof(self.names)
+            if self.archive is not None:
+                size += self.archive.memory
+        return size
+
+    def stats(self):
+        return {
+            'members': self.count,
+            'memory': self.memory(),
+            'scrollback_messages': len(self.scrollback),
+            'scrollback_memory': self.scrollback.memory,
+            'scrollback_limit_messages': self.settings.max_messages,
+            'scrollback_limit_bytes': self.settings.max_bytes,
+            'disk_segments': self.archive.segments if self.archive else 0
+        }
@@ -1,12 +1,18 @@
 import socket
 import threading
+import itertools
 import json
 import re
 import sys
 import msvcrt
-import os
+import time
 from collections import defaultdict
 
+from compress import Inflater
+from framing import LineFramer
+from wire import Peer, WireError
+from render import Renderer
+
 # ===== Verkkoasetukset =====
 HOST = "10.232.2.226"  # Tähän menee oman, serverin tai localhost ipv4 
 PORT = 6668
@@ -14,19 +20,36 @@ PORT = 6668
 # Debugaus työkalu
 DEBUG = False
 
+# Pyydetäänkö kirjautuessa tiivistä binääriprotokollaa (vanha palvelin jatkaa JSONilla)
+BINARY_PROTOCOL = True
+
+# Pyydetäänkö palvelimelta pakattua (zlib) liikennettä
+COMPRESSION = True
+
 # Globaaleja muuttujia
 current_username = None  # Nykyinen käyttäjänimi
 current_color_code = 15  # Nykyinen värikoodi
 current_channel = None   # Nykyinen kanava
 user_channels = set()    # Käyttäjän kanavat
-
-# Eventtien tapahtumien tarkistaminen
-registration_event = threading.Event()  # Rekisteröinnin odotustapahtuma
-login_event = threading.Event()         # Kirjautumisen odotustapahtuma
-login_response = None                  # Kirjautumisvastaus
-login_lock = threading.Lock()          # Kirjautumisen lukko
-registration_response = None           # Rekisteröintivastaus
-registration_lock = threading.Lock()   # Rekisteröinnin lukko
+wire_peer = None         # Binääriprotokollan tila, None kun käytössä on JSON
+inflater = None          # Pakatun liikenteen purkaja, None kun pakkaus ei ole käytössä
+session_id = None        # Istunnon tunniste katkenneen yhteyden jatkamiseen
+last_seqs = {}           # Viimeisin nähty viestin järjestysnumero kanavittain
+
+# Katkennut yhteys yritetään jatkaa samalla istunnolla näin monta kertaa
+RESUME_ATTEMPTS = 5
+RESUME_DELAY = 2.0
+
+# Läsnäolokoosteessa näytettävät nimet suuntaa kohden, loput vain lukumääränä
+PRESENCE_NAMES = 8
+
+# Vastausta odottavat pyynnöt tunnisteen mukaan
+# Palvelin palauttaa pyynnön id:n vastauksessa, joten useita pyyntöjä voi
+# lähettää peräkkäin odottamatta, eikä myöhästynyt vastaus sekoitu uuteen yritykseen
+REQUEST_TIMEOUT = 30.0                 # Vastaamattomat pyynnöt unohdetaan tämän jälkeen
+pending_requests = {}                  # Tunniste -> PendingRequest
+pending_lock = threading.Lock()        # Odottavien pyyntöjen lukko
+request_ids = itertools.count(1)       # Seuraava pyynnön tunniste
 
 # ===== Tekstin muotoilu =====
 
@@ -43,6 +66,22 @@ def format_system_msg(message):
     """Muotoilee järjestelmäviestejä"""
     return f"\033[90m[•] {message}\033[0m"
 
+def format_presence(channel, joined, left):
+    """Muotoilee läsnäolokoosteen yhdelle riville, pitkät listat lyhennetään"""
+    parts = []
+    for sign, names in (('+', joined), ('-', left)):
+        shown = ' '.join(f"{sign}{name}" for name in names[:PRESENCE_NAMES])
+        if len(names) > PRESENCE_NAMES:
+            shown += f" {sign}{len(names) - PRESENCE_NAMES} more"
+        if shown:
+            parts.append(shown)
+    return format_system_msg(f"{channel or 'Server'}: {'  '.join(parts)}")
+
+def format_search_result(result):
+    """Muotoilee lokihaun osuman"""
+    color_code = result.get('color', 15)
+    return f"\033[38;5;{color_code}m#{result.get('seq')} {result.get('from')}>\033[0m {result.get('message')}"
+
 def format_server_msg(message):
     """Muotoilee palvelinviestejä"""
     return f"\033[1;33m[Server]\033[0m {message}"
@@ -72,118 +111,261 @@ def debug_print(message):
     if DEBUG:
         print(f"DEBUG: {message}")
 
-def clear_current_line():
-    """Tyhjentää nykyisen rivin terminaalissa"""
-    try:
-        columns = os.get_terminal_size().columns
-    except (AttributeError, OSError):
-        columns = 80  
-        
-    sys.stdout.write('\r' + ' ' * (columns - 1) + '\r')
-    sys.stdout.flush()
-
 def print_system_message(message):
     """Tulostaa järjestelmäviestin häiritsemättä syötekenttää"""
-    clear_current_line()
-    print(f"\r\033[1;36mSystem:\033[0m {message}")
-    if current_username:
-        display_prompt()
+    renderer.write(f"\033[1;36mSystem:\033[0m {message}")
+
+def prompt_text():
+    """Palauttaa syötekentän nykyisen tilanteen mukaan, tyhjä ennen kirjautumista"""
+    if not current_username:
+        return ''
+    if current_channel:
+        return f"\033[1;38;5;{current_color_code}m{current_username} [{current_channel}]>\033[0m "
+    return f"\033[1;38;5;{current_color_code}m{current_username} >\033[0m "
 
 def display_prompt():
     """Näyttää syötekentän nykyisen tilanteen mukaan"""
-    if current_channel:
-        prompt = f"\033[1;38;5;{current_color_code}m{current_username} [{current_channel}]>\033[0m "
-    else:
-        prompt = f"\033[1;38;5;{current_color_code}m{current_username} >\033[0m "
-    sys.stdout.write(prompt)
+    sys.stdout.write(prompt_text())
     sys.stdout.flush()
 
-def receive_messages(client_socket):
+def read_responses(framer):
+    """Palauttaa puskurissa olevat palvelimen viestit sanakirjoina
+
+    Jos palvelin hyväksyy binääriprotokollan kesken erän, loput rivit
+    palautetaan puskuriin ja luetaan kehyksinä. Jos se hyväksyy pakkauksen,
+    loput tavut ovat pakattuja lohkoja ja ne puretaan ensin.
+    """
+    compressed = inflater is not None
+    if wire_peer:
+        for frame in framer.frames():
+            try:
+                response = wire_peer.decode(frame)
+            except WireError:
+                print_system_message("Invalid message from server")
+                continue
+            if response is not None:
+                yield response
+        return
+    lines = framer.lines()
+    for index, line in enumerate(lines):
+        if DEBUG:
+            print(f"DEBUG: Raw data received: {line.decode(errors='replace')}")
+        try:
+            response = json.loads(line.decode())
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print_system_message("Invalid message from server")
+            continue
+        yield response
+        switched = inflater is not None and not compressed
+        if wire_peer or switched:
+            rest = b''.join(rest + b'\n' for rest in lines[index + 1:])
+            if switched:
+                framer.feed(inflater.feed(rest + framer.take()))
+            else:
+                framer.unread(rest)
+            yield from read_responses(framer)
+            return
+
+class PendingRequest:
+    """Vastausta odottava pyyntö"""
+
+    def __init__(self, action):
+        self.action = action
+        self.sent = time.monotonic()
+        self.event = threading.Event()
+        self.response = None
+
+    def wait(self, timeout):
+        """Odottaa vastausta, palauttaa None jos sitä ei tullut ajoissa"""
+        if not self.event.wait(timeout):
+            return None
+        return self.response
+
+def complete_request(response):
+    """Yhdistää vastauksen odottavaan pyyntöön, palauttaa pyynnön tai None"""
+    request_id = response.get('id')
+    if request_id is None:
+        return None
+    with pending_lock:
+        pending = pending_requests.pop(request_id, None)
+    if pending:
+        pending.response = response
+        pending.event.set()
+    return pending
+
+def switch_protocol(response):
+    """Ottaa binääriprotokollan ja pakkauksen käyttöön, jos palvelin hyväksyi ne"""
+    global wire_peer, inflater
+    if response.get('status') != 'success':
+        return
+    if response.get('protocol') == 'binary':
+        wire_peer = Peer()
+    if response.get('compress') == 'zlib':
+        inflater = Inflater()
+
+def resume_session():
+    """Yhdistää katkenneen yhteyden uudelleen ja pyytää jatkamaan istuntoa
+
+    Palauttaa uuden socketin tai None, jos istuntoa ei ole tai yhteys ei palaa.
+    Palvelin lähettää vastauksen perään yhteyden aikana menetetyt viestit.
+    """
+    global client_socket, wire_peer, inflater
+    if not session_id:
+        return None
+    print_system_message("Connection lost, reconnecting...")
+    for _ in range(RESUME_ATTEMPTS):
+        time.sleep(RESUME_DELAY)
+        try:
+            sock = socket.create_connection((HOST, PORT), timeout=5)
+        except OSError:
+            continue
+        sock.settimeout(None)
+        client_socket = sock
+        wire_peer = None
+        inflater = None
+        resume_data = {
+            'action': 'resume',
+            'username': current_username,
+            'session_id': session_id,
+            'last_seq': dict(last_seqs)
+        }
+        if BINARY_PROTOCOL:
+            resume_data['protocol'] = 'binary'
+        if COMPRESSION:
+            resume_data['compress'] = 'zlib'
+        if send_request(sock, resume_data):
+            return sock
+    return None
+
+def receive_messages(sock):
     """Vastaanottaa viestejä palvelimelta"""
-    global registration_response, login_response, current_username, current_color_code, current_channel, user_channels
+    global current_username, current_color_code, current_channel, user_channels, session_id
     
-    buffer = ""
+    framer = LineFramer()
     while True:
         try:
-            data = client_socket.recv(1024).decode()
-            if not data:
-                print("\nServer disconnected. Press Enter to exit...")
-                sys.exit()
+            received = inflater.recv_into(sock, framer) if inflater else framer.recv_into(sock)
+            if not received:
+                sock = resume_session()
+                if sock is None:
+                    print("\nServer disconnected. Press Enter to exit...")
+                    sys.exit()
+                framer = LineFramer()
+                continue
                 
-            buffer += data
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
+            for response in read_responses(framer):
                 if DEBUG:
-                    print(f"DEBUG: Raw data received: {line}")
-                try:
-                    response = json.loads(line)
-                    if DEBUG:
-                        print(f"DEBUG: Parsed response: {response}")
-                    debug_print(f"Received: {response}")
-                    
-                    # Käsittelee rekisteröintivastauksen
-                    if response.get('action') == 'register':
-                        with registration_lock:
-                            registration_response = response
-                            registration_event.set()
-                    
-                    # Käsittelee kirjautumisvastauksen
-                    elif response.get('action') == 'login':
-                        with login_lock:
-                            login_response = response
-                            login_event.set()
-                    
-                    # Käsittelee virheviestit
-                    elif response.get('status') == 'error':
-                        print_system_message(f"Error: {response.get('message')}")
-                    
-                    # Käsittelee järjestelmäviestit
-                    elif response.get('action') == 'system':
-                        print_system_message(response.get('message'))
+                    print(f"DEBUG: Parsed response: {response}")
+                debug_print(f"Received: {response}")
+                
+                # Protokolla vaihdetaan ennen kuin odottava pyyntö herätetään,
+                # jotta pääsäikeen seuraava komento lähtee jo uudessa muodossa
+                if response.get('action') in ('register', 'login', 'resume'):
+                    switch_protocol(response)
+                pending = complete_request(response)
+                
+                # Rekisteröinti- ja kirjautumisvastaukset palautetaan odottavalle pyynnölle,
+                # myöhästynyt vastaus vanhaan yritykseen ohitetaan
+                if response.get('action') in ('register', 'login'):
+                    if pending is None:
+                        debug_print(f"Ignored late response: {response}")
+                
+                # Käsittelee istunnon jatkamisen vastauksen
+                elif response.get('action') == 'resume':
+                    if response.get('status') != 'success':
+                        session_id = None
+                        print(f"\nCould not resume session: {response.get('message')}. Press Enter to exit...")
+                        sys.exit()
+                    user_channels = set(response.get('channels', []))
+                    if current_channel not in user_channels:
+                        current_channel = next(iter(user_channels), None)
+                    print_system_message("Reconnected, session resumed")
+                
+                # Vastaa palvelimen pingiin, muuten hiljainen yhteys katkaistaan
+                elif response.get('action') == 'ping':
+                    send_json(sock, {'action': 'pong'})
+                
+                # Käsittelee virheviestit
+                elif response.get('status') == 'error':
+                    print_system_message(f"Error: {response.get('message')}")
+                
+                # Käsittelee järjestelmäviestit
+                elif response.get('action') == 'system':
+                    print_system_message(response.get('message'))
+                
+                # Käsittelee kanavaviestejä
+                elif response.get('action') == 'message':
+                    from_user = response.get('from')
+                    message = response.get('message')
+                    color_code = response.get('color', 15)
+                    channel = response.get('channel')
+                    if channel and response.get('seq'):
+                        last_seqs[channel] = response['seq']
                     
-                    # Käsittelee kanavaviestejä
-                    elif response.get('action') == 'message':
-                        from_user = response.get('from')
-                        message = response.get('message')
-                        color_code = response.get('color', 15)
-                        channel = response.get('channel')
-                        
-                        # Muotoilee viestin näyttämisen
-                        if channel:
-                            prefix = f"\033[1;38;5;{color_code}m{from_user} [{channel}]>\033[0m"
-                        else:
-                            prefix = f"\033[1;38;5;{color_code}m{from_user} >\033[0m"
-                        
-                        clear_current_line()
-                        print(f"\r{prefix} {message}")
-                        display_prompt()
+                    # Muotoilee viestin näyttämisen
+                    if channel:
+                        prefix = f"\033[1;38;5;{color_code}m{from_user} [{channel}]>\033[0m"
+                    else:
+                        prefix = f"\033[1;38;5;{color_code}m{from_user} >\033[0m"
                     
-                    # Käsittelee yksityisviestit
-                    elif response.get('action') == 'private_message':
-                        from_user = response.get('from')
-                        message = response.get('message')
-                        color_code = response.get('color', 15)
-                        
-                        clear_current_line()
-                        print(f"\r\033[1;35mPM from {from_user}>\033[0m {message}")
-                        display_prompt()
+                    renderer.write(f"{prefix} {message}")
+                
+                # Käsittelee lokihaun tulokset, uusin osuma viimeisenä
+                elif response.get('action') == 'search':
+                    results = response.get('results', [])
+                    print_system_message(
+                        f"Search '{response.get('query')}' in {response.get('channel')}: {len(results)} results"
+                    )
+                    for result in reversed(results):
+                        renderer.write(format_search_result(result))
+                
+                # Käsittelee yksityisviestit
+                elif response.get('action') == 'private_message':
+                    from_user = response.get('from')
+                    message = response.get('message')
+                    color_code = response.get('color', 15)
                     
-                    # Käsittelee kanavapäivitykset (liittyminen/poistuminen)
-                    elif response.get('action') == 'channel_update':
-                        channel = response.get('channel')
-                        if response.get('type') == 'join':
-                            user_channels.add(channel)
-                            if not current_channel:
-                                current_channel = channel
-                        elif response.get('type') == 'leave':
-                            user_channels.discard(channel)
-                            if current_channel == channel:
-                                current_channel = next(iter(user_channels), None)[0] if user_channels else None
-                        display_prompt()
-                        
-                except json.JSONDecodeError:
-                    print_system_message("Invalid message from server")
+                    renderer.write(f"\033[1;35mPM from {from_user}>\033[0m {message}")
+                
+                # Käsittelee läsnäolokoosteet, omaa liittymistä ei näytetä
+                elif response.get('action') == 'presence':
+                    joined = [name for name in response.get('joined', []) if name != current_username]
+                    left = [name for name in response.get('left', []) if name != current_username]
+                    if joined or left:
+                        renderer.write(format_presence(response.get('channel'), joined, left))
+                
+                # Käsittelee kanavapäivitykset (liittyminen/poistuminen)
+                elif response.get('action') == 'channel_update':
+                    channel = response.get('channel')
+                    if response.get('type') == 'join':
+                        user_channels.add(channel)
+                        current_channel = channel
+                    elif response.get('type') == 'leave':
+                        user_channels.discard(channel)
+                        if current_channel == channel:
+                            current_channel = next(iter(user_channels), None)
+                    renderer.refresh()
+                
+                # Käsittelee kanavalistan (/list)
+                elif response.get('action') == 'channel_list':
+                    listing = ', '.join(
+                        f"{entry['name']} ({entry['members']})" for entry in response.get('channels', [])
+                    )
+                    print_system_message(f"Channels: {listing}")
+                
+                # Käsittelee kanavan käyttäjälistan (/who)
+                elif response.get('action') == 'who':
+                    users = response.get('users', [])
+                    print_system_message(
+                        f"{response.get('channel')} ({len(users)}): {', '.join(users)}"
+                    )
                     
+        except OSError as e:
+            sock = resume_session()
+            if sock is None:
+                print(f"\nConnection error: {e}")
+                sys.exit()
+            framer = LineFramer()
         except Exception as e:
             print(f"\nConnection error: {e}")
             sys.exit()
@@ -196,7 +378,9 @@ except ConnectionRefusedError:
     print("Error: Could not connect to server.")
     exit(1)
 
-# Käynnistä viestien vastaanottosäie
+# Käynnistä piirtosäie ja viestien vastaanottosäie
+renderer = Renderer(sys.stdout, prompt_text)
+renderer.start()
 thread = threading.Thread(target=receive_messages, args=(client_socket,))
 thread.daemon = True
 thread.start()
@@ -274,10 +458,12 @@ def get_hidden_password(prompt):
 def send_json(sock, data):
     """Lähettää JSON-datan turvallisesti määritetylle socketille"""
     try:
-        payload = json.dumps(data) + '\n'
         if DEBUG:
-            print(f"DEBUG: Sending to server: {payload}")
-        sock.sendall(payload.encode())
+            print(f"DEBUG: Sending to server: {data}")
+        if wire_peer:
+            sock.sendall(wire_peer.encode(data))
+        else:
+            sock.sendall((json.dumps(data) + '\n').encode())
         debug_print(f"Sent to {sock.getpeername()}: {data}")
         return True
     except (ConnectionResetError, BrokenPipeError):
@@ -287,9 +473,29 @@ def send_json(sock, data):
         debug_print(f"Send error: {e}")
         return False
 
+def send_request(sock, data):
+    """Lähettää pyynnön tunnisteella ja kirjaa sen vastausta odottavaksi
+
+    Palauttaa PendingRequestin tai None, jos lähetys epäonnistui.
+    """
+    request_id = next(request_ids)
+    data['id'] = request_id
+    pending = PendingRequest(data.get('action'))
+    now = time.monotonic()
+    with pending_lock:
+        # Kaikkiin pyyntöihin ei tule vastausta, joten vanhat unohdetaan
+        for stale in [key for key, value in pending_requests.items() if now - value.sent > REQUEST_TIMEOUT]:
+            del pending_requests[stale]
+        pending_requests[request_id] = pending
+    if not send_json(sock, data):
+        with pending_lock:
+            pending_requests.pop(request_id, None)
+        return None
+    return pending
+
 def register():
     """Käsittelee käyttäjän rekisteröinnin"""
-    global registration_response
+    global session_id
     while True:
         username = get_valid_username()
         password = get_hidden_password("Choose a password: ")
@@ -301,22 +507,22 @@ def register():
             'password': password,
             'color': color_code
         }
+        if BINARY_PROTOCOL:
+            register_data['protocol'] = 'binary'
+        if COMPRESSION:
+            register_data['compress'] = 'zlib'
         
-        if not send_json(client_socket, register_data):
+        pending = send_request(client_socket, register_data)
+        if not pending:
             return None
 
-        registration_event.wait(5)
-        
-        with registration_lock:
-            response = registration_response
-            registration_event.clear()
-            registration_response = None
-
+        response = pending.wait(5)
         if not response:
             print("Registration timed out.")
             return None
             
         if response.get('status') == 'success':
+            session_id = response.get('session_id')
             return response.get('username'), response.get('color', 15)
         else:
             print(f"\nError: {response.get('message')}")
@@ -325,29 +531,30 @@ def register():
 
 def login():
     """Käsittelee käyttäjän kirjautumisen kanavavalinnan kanssa"""
-    global login_response
+    global session_id
     attempts = 0
     
     while attempts < 3:
         username = input("\nUsername: ").strip()
         password = get_hidden_password("Password: ")
 
-        if not send_json(client_socket, {
+        login_data = {
             'action': 'login',
             'username': username,
             'password': password
-        }):
+        }
+        if BINARY_PROTOCOL:
+            login_data['protocol'] = 'binary'
+        if COMPRESSION:
+            login_data['compress'] = 'zlib'
+        pending = send_request(client_socket, login_data)
+        if not pending:
             attempts += 1
             continue
             
-        login_event.wait(5)
-        
-        with login_lock:
-            if DEBUG:
-                print(f"DEBUG: Login response received: {login_response}")
-            response = login_response
-            login_event.clear()
-            login_response = None
+        response = pending.wait(5)
+        if DEBUG:
+            print(f"DEBUG: Login response received: {response}")
 
         if not response:
             print("Login timed out.")
@@ -370,7 +577,7 @@ def login():
                         channel_num = int(choice)
                         if 1 <= channel_num <= len(available_channels):
                             selected_channel = available_channels[channel_num-1]
-                            send_json(client_socket, {
+                            send_request(client_socket, {
                                 'action': 'command',
                                 'message': f'/join {selected_channel}'
                             })
@@ -379,6 +586,7 @@ def login():
                     except ValueError:
                         print("Invalid input. Please enter a number.")
 
+            session_id = response.get('session_id')
             return response.get('username'), response.get('color', 15)
         else:
             print(f"\nError: {response.get('message')}")
@@ -391,7 +599,7 @@ def login():
 
 def handle_command(command):
     """Käsittelee asiakaspuolen komennot"""
-    global current_channel
+    global current_channel, session_id
     
     parts = command.split()
     cmd = parts[0].lower()
@@ -400,7 +608,7 @@ def handle_command(command):
         channel = parts[1]
         if not channel.startswith('#'):
             channel = '#' + channel
-        send_json(client_socket, {
+        send_request(client_socket, {
             'action': 'command',
             'message': f'/join {channel}'
         })
@@ -410,18 +618,18 @@ def handle_command(command):
             channel = parts[1]
             if not channel.startswith('#'):
                 channel = '#' + channel
-            send_json(client_socket, {
+            send_request(client_socket, {
                 'action': 'command',
                 'message': f'/leave {channel}'
             })
         else:
-            send_json(client_socket, {
+            send_request(client_socket, {
                 'action': 'command',
-                'message': '/leave'
+                'message': f'/leave {current_channel}' if current_channel else '/leave'
             })
             
     elif cmd == '/list':
-        send_json(client_socket, {
+        send_request(client_socket, {
             'action': 'command',
             'message': '/list'
         })
@@ -430,26 +638,54 @@ def handle_command(command):
         channel = parts[1]
         if not channel.startswith('#'):
             channel = '#' + channel
-        send_json(client_socket, {
+        send_request(client_socket, {
             'action': 'command',
             'message': f'/who {channel}'
         })
         
+    elif cmd == '/history':
+        message = '/history'
+        if len(parts) > 1:
+            channel = parts[1]
+            if not channel.startswith('#'):
+                channel = '#' + channel
+            message = ' '.join([message, channel] + parts[2:3])
+        send_request(client_socket, {
+            'action': 'command',
+            'message': message
+        })
+        
+    elif cmd == '/search' and len(parts) > 1:
+        channel = current_channel
+        terms = parts[1:]
+        if parts[1].startswith('#'):
+            channel, terms = parts[1], parts[2:]
+        if not channel or not terms:
+            print_system_message("Usage: /search [channel] <words> (from:<user> matches the sender)")
+        else:
+            send_request(client_socket, {
+                'action': 'command',
+                'message': ' '.join(['/search', channel] + terms)
+            })
+        
     elif cmd == '/pm' and len(parts) > 2:
         target = parts[1]
         message = ' '.join(parts[2:])
         send_json(client_socket, {
-            'action': 'message',
-            'message': f'/pm {target} {message}'
+            'action': 'private_message',
+            'to': target,
+            'message': message
         })
         
     elif cmd == '/help':
         help_text = """
 Available commands:
-/join <channel> - Join a channel
+/join <channel> - Join a channel or switch to one you are on
 /leave [channel] - Leave current or specified channel
 /list - List all channels
 /who <channel> - List users in a channel
+/history [channel] [count] - Show recent messages of a channel
+/search [channel] <words> - Search the channel log (from:<user> matches the sender)
 /pm <user> <message> - Send private message
 /help - Show this help
 /exit - Quit the program
@@ -457,6 +693,7 @@ Available commands:
         print_system_message(help_text.strip())
         
     elif cmd == '/exit':
+        session_id = None
         client_socket.close()
         print("\nGoodbye!")
         sys.exit(0)
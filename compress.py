@@ -0,0 +1,146 @@
+import threading
+import zlib
+
+from framing import LineFramer
+from wire import WireError, read_varint, write_varint
+
+# Pakattu siirto palvelimelta asiakkaalle
+# Asiakas voi pyytää kirjautumisen, rekisteröinnin tai istunnon jatkamisen
+# yhteydessä pakkausta ('compress': 'zlib'). Vastaus lähetetään vielä
+# pakkaamattomana, sen jälkeen kaikki palvelimen lähettämä data kulkee lohkoina:
+#   <pituus varint><virta varint><liput><raw deflate -data>
+# Jokainen virta on jatkuva deflate-virta, joka tyhjennetään Z_SYNC_FLUSHilla
+# jokaisen lohkon lopussa, joten vastaanottaja voi purkaa lohkon heti ja
+# aiemmat viestit toimivat sanakirjana seuraaville. Virta 0 on yhteyden oma.
+# Muut virrat ovat kanavan (tai koko palvelimen) jaettuja lähetysvirtoja:
+# lähetys pakataan niihin kerran ja samat tavut menevät kaikille samassa
+# tilassa oleville vastaanottajille, yhteyskohtainen on vain lohkon otsikko.
+# Asiakkaalta palvelimelle liikenne pysyy pakkaamattomana.
+
+DEFAULT_COMPRESS_LEVEL = 6
+MAX_CHUNK = 1024 * 1024
+WBITS = -15  # Raw deflate ilman zlib-otsikkoa ja tarkistussummaa
+
+PRIVATE = 0
+# Lohkon liput
+RESET = 1    # Virta alkaa tästä lohkosta, vastaanottaja aloittaa uuden purkajan
+DISCARD = 2  # Pura mutta ohita (lähettäjä ei saa omaa viestiään, virran on silti pysyttävä tahdissa)
+
+
+def chunk(stream_id, flags, data):
+    head = bytearray()
+    write_varint(head, stream_id)
+    head.append(flags)
+    out = bytearray()
+    write_varint(out, len(head) + len(data))
+    out += head
+    out += data
+    return bytes(out)
+
+
+# Kanavan tai koko palvelimen jaettu lähetysvirta
+# Pakkaus ja lohkojen jonoon lisääminen tehdään lukon alla, jotta jokainen
+# vastaanottaja saa virran lohkot samassa järjestyksessä kuin ne pakattiin.
+# count kertoo pakattujen lohkojen määrän; vastaanottaja on virran kanssa
+# tahdissa, jos se on saanut niistä jokaisen.
+class SharedStream:
+    def __init__(self, stream_id, level=DEFAULT_COMPRESS_LEVEL):
+        self.id = stream_id
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS)
+        self.count = 0
+        self.data = b''
+        self.chunks = {}
+        self.lock = threading.Lock()
+
+    # Pakkaa datan virran seuraavaksi lohkoksi
+    # reset tyhjentää ensin historian (Z_FULL_FLUSH), jolloin lohkon voi purkaa
+    # myös tyhjästä aloittava vastaanottaja; tahdissa olevat jatkavat normaalisti
+    def compress(self, payload, reset=False):
+        data = self.compressor.flush(zlib.Z_FULL_FLUSH) if reset else b''
+        self.data = data + self.compressor.compress(payload) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.chunks = {}
+        self.count += 1
+
+    # Palauttaa viimeksi pakatun lohkon annetuilla lipuilla
+    # Lippuyhdistelmiä on vain muutama, joten jokainen lohko rakennetaan kerran
+    def chunk(self, flags):
+        out = self.chunks.get(flags)
+        if out is None:
+            out = self.chunks[flags] = chunk(self.id, flags, self.data)
+        return out
+
+
+# Yhteyskohtainen pakkaustila
+# encode pakkaa yhteyden omaan virtaan, ja yhteys kutsuu sitä lähtevän jonon
+# lukon alla, joten virran lohkot ovat jonossa pakkausjärjestyksessä.
+# seen pitää kirjaa, montako lohkoa kustakin jaetusta virrasta yhteys on saanut.
+class Compressor:
+    def __init__(self, level=DEFAULT_COMPRESS_LEVEL):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS)
+        self.started = False
+        self.seen = {}
+        self.plain = 0
+        self.packed = 0
+
+    def encode(self, payload):
+        data = self.compressor.compress(payload) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        out = chunk(PRIVATE, 0 if self.started else RESET, data)
+        self.started = True
+        self.plain += len(payload)
+        self.packed += len(out)
+        return out
+
+    # Onko yhteys saanut jaetun virran jokaisen lohkon
+    def in_sync(self, stream):
+        return self.seen.get(stream.id) == stream.count
+
+    # Palauttaa yhteydelle jaetun virran juuri pakatun lohkon
+    # Kutsutaan virran lukon alla heti compressin jälkeen
+    def shared(self, stream, plain, fresh, discard=False):
+        out = stream.chunk((RESET if fresh else 0) | (DISCARD if discard else 0))
+        self.seen[stream.id] = stream.count
+        if not discard:
+            self.plain += plain
+        self.packed += len(out)
+        return out
+
+
+# Asiakkaan purkaja
+# Puskuroi socketista luetut lohkot, purkaa ne virroittain ja syöttää
+# puretut tavut tavalliselle rivi- tai kehyspuskurille
+class Inflater:
+    def __init__(self):
+        self.chunks = LineFramer(max_line=MAX_CHUNK)
+        self.streams = {}
+
+    # Lukee socketista ja siirtää puretut tavut framerille
+    # Palauttaa luettujen tavujen määrän, 0 tarkoittaa suljettua yhteyttä
+    def recv_into(self, sock, framer):
+        count = self.chunks.recv_into(sock)
+        framer.feed(self.inflate())
+        return count
+
+    # Purkaa valmiin tavujonon (esim. vastauksen perässä jo luetut lohkot)
+    def feed(self, data):
+        self.chunks.feed(data)
+        return self.inflate()
+
+    def inflate(self):
+        out = bytearray()
+        for body in self.chunks.frames():
+            stream_id, pos = read_varint(body, 0, len(body))
+            if stream_id is None or pos >= len(body):
+                raise WireError("Virheellinen pakattu lohko")
+            flags = body[pos]
+            if flags & RESET:
+                self.streams[stream_id] = zlib.decompressobj(WBITS)
+            decompressor = self.streams.get(stream_id)
+            if decompressor is None:
+                raise WireError(f"Tuntematon pakattu virta {stream_id}")
+            try:
+                data = decompressor.decompress(body[pos + 1:])
+            except zlib.error as e:
+                raise WireError(f"Pakatun lohkon purku epäonnistui: {e}") from e
+            if not flags & DISCARD:
+                out += data
+        return bytes(out)
@@ -0,0 +1,344 @@
+import json
+import socket
+import threading
+import time
+from collections import deque
+
+# Mitä tehdään, kun asiakkaan lähtevä jono on täynnä:
+# drop_oldest - vanhin jonossa oleva viesti pudotetaan uuden tieltä
+# disconnect  - hidas asiakas katkaistaan
+# lag         - asiakas merkitään jälkeenjääneeksi ja uudet viestit ohitetaan,
+#               kunnes jono on purkautunut puoleen; sitten asiakkaalle kerrotaan
+#               montako viestiä jäi saamatta
+OVERFLOW_POLICIES = ('drop_oldest', 'disconnect', 'lag')
+DEFAULT_QUEUE_SIZE = 1024
+DEFAULT_OVERFLOW_POLICY = 'drop_oldest'
+WRITE_BATCH = 64
+DETACH_TIMEOUT = 5.0
+
+
+# Nostaa avoimien tiedostojen rajan
+# Tuhannet yhteydet tarvitsevat yhtä monta tiedostokahvaa (ei käytössä Windowsilla)
+def raise_fd_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# Yhteyskohtainen rajattu lähtevien viestien jono
+# Jokainen yhteys tyhjentää oman jononsa, joten yksi hidas lukija ei
+# hidasta lähettäjää eikä muita kanavan jäseniä
+class OutboundQueue:
+    def __init__(self, limit=DEFAULT_QUEUE_SIZE, policy=DEFAULT_OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Tuntematon ylivuotokäytäntö: {policy}")
+        self.items = deque()
+        self.limit = limit
+        self.policy = policy
+        self.lagging = False
+        self.lag_dropped = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.sent = 0
+        self.encoder = None
+        self.notice_encoder = None
+
+    # Ottaa lähtevän datan koodauksen (pakkauksen) käyttöön
+    # Pakattua virtaa ei voi katkaista kesken, joten täysi jono katkaisee
+    # yhteyden viestien pudottamisen sijaan; asiakas jatkaa istuntoa uudelleen
+    def set_encoder(self, encoder):
+        self.encoder = encoder
+        self.policy = 'disconnect'
+
+    # Ottaa palvelimen omien ilmoitusten koodauksen käyttöön
+    # Binääriprotokollaan siirtynyt yhteys saa jälkeenjäämisilmoituksen
+    # kehyksenä, jottei JSON-rivi sotke kehysten rajoja
+    def set_notice_encoder(self, encode):
+        self.notice_encoder = encode
+
+    # Lisää viestin jonoon ylivuotokäytännön mukaisesti
+    # Palauttaa False, jos yhteys pitää katkaista
+    def push(self, payload):
+        if self.lagging:
+            self.dropped += 1
+            self.lag_dropped += 1
+            return True
+        if len(self.items) >= self.limit:
+            self.dropped += 1
+            if self.policy == 'drop_oldest':
+                self.items.popleft()
+            elif self.policy == 'lag':
+                self.lagging = True
+                self.lag_dropped = 1
+                return True
+            else:
+                return False
+        self.items.append(payload)
+        if len(self.items) > self.max_depth:
+            self.max_depth = len(self.items)
+        return True
+
+    # Ottaa seuraavan lähetettävän viestin jonosta
+    # Jälkeenjäänyt asiakas saa ilmoituksen, kun jono on purkautunut puoleen
+    def pop(self):
+        payload = self.items.popleft()
+        if self.lagging and len(self.items) <= self.limit // 2:
+            self.lagging = False
+            self.items.append(self.lag_notice(self.lag_dropped))
+            self.lag_dropped = 0
+        self.sent += 1
+        return payload
+
+    def lag_notice(self, dropped):
+        data = {
+            'action': 'system',
+            'message': f'Yhteytesi ei pysynyt perässä, {dropped} viestiä jäi saamatta'
+        }
+        if self.notice_encoder is not None:
+            return self.notice_encoder(data)
+        return (json.dumps(data) + '\n').encode()
+
+    def stats(self):
+        return {
+            'depth': len(self.items),
+            'max_depth': self.max_depth,
+            'limit': self.limit,
+            'policy': self.policy,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'lagging': self.lagging
+        }
+
+
+# Yrittää lähettää suljettavan yhteyden viimeiset tavut blokkaamatta
+def send_leftover(sock, payload):
+    if not payload:
+        return
+    try:
+        sock.setblocking(False)
+        sock.send(payload)
+    except OSError:
+        pass
+
+
+# Säieytimen yhteys
+# Lukeminen tapahtuu yhteyden omassa säikeessä, kirjoittaminen erillisessä
+# kirjoittajasäikeessä, joka tyhjentää lähtevää jonoa
+class ThreadConnection(OutboundQueue):
+    def __init__(self, sock, addr, limit=DEFAULT_QUEUE_SIZE, policy=DEFAULT_OVERFLOW_POLICY):
+        super().__init__(limit, policy)
+        self.sock = sock
+        self.addr = addr
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.opened = self.last_seen = time.monotonic()
+        self.ping_sent = 0.0
+        self.closed = False
+        self.writing = False
+        self.cond = threading.Condition()
+        self.writer = threading.Thread(target=self._drain, daemon=True)
+        self.writer.start()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    # Odottaa luettavaa dataa lukematta sitä
+    # Palvelimen vaihdon aikana lukemattomat tavut jäävät ytimen puskuriin
+    def wait_readable(self):
+        self.sock.recv(1, socket.MSG_PEEK)
+
+    def recv_into(self, buffer):
+        count = self.sock.recv_into(buffer)
+        self.bytes_in += count
+        self.last_seen = time.monotonic()
+        return count
+
+    def stats(self):
+        return dict(super().stats(), bytes_in=self.bytes_in, bytes_out=self.bytes_out)
+
+    # raw: valmiiksi koodattu data, joka ohittaa encoderin (jaetun virran lohko)
+    def sendall(self, payload, raw=False):
+        with self.cond:
+            if self.closed:
+                raise BrokenPipeError("Yhteys on suljettu")
+            if self.encoder is not None and not raw:
+                payload = self.encoder(payload)
+            if not self.push(payload):
+                self.abort()
+                return
+            self.cond.notify()
+
+    def _drain(self):
+        while True:
+            with self.cond:
+                while not self.items and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                # Useampi jonossa odottava viesti lähetetään yhdellä kutsulla
+                batch = [self.pop() for _ in range(min(len(self.items), WRITE_BATCH))]
+                payload = b''.join(batch)
+                self.writing = True
+            try:
+                self.sock.sendall(payload)
+                self.bytes_out += len(payload)
+            except OSError:
+                self.abort()
+                return
+            finally:
+                with self.cond:
+                    self.writing = False
+                    self.cond.notify_all()
+
+    # Katkaisee yhteyden niin, että lukijasäie saa EOF:n ja siivoaa tilan
+    def abort(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # Lopettaa lukemisen niin, että jonossa oleva vastaus ehtii vielä lähteä
+    def stop_reading(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+
+    # Irrottaa socketin palvelimen vaihtoa varten sulkematta sitä
+    # Kirjoittaja lopetetaan ja lähettämättä jääneet tavut palautetaan. Palauttaa
+    # None, jos kirjoittaja on jumissa kesken lähetyksen, jolloin yhteyttä ei voi siirtää.
+    def detach(self, timeout=DETACH_TIMEOUT):
+        with self.cond:
+            if not self.cond.wait_for(lambda: not self.writing, timeout):
+                return None
+            self.closed = True
+            pending = b''.join(self.items)
+            self.items.clear()
+            self.cond.notify()
+        return pending
+
+    # Sulkee yhteyden. Jonoon jääneet viestit (esim. virheilmoitus ennen
+    # katkaisua) yritetään vielä lähettää blokkaamatta, jos kirjoittaja on vapaana.
+    def close(self):
+        with self.cond:
+            self.closed = True
+            leftover = b'' if self.writing else b''.join(self.items)
+            self.items.clear()
+            self.cond.notify()
+        send_leftover(self.sock, leftover)
+        self.sock.close()
+
+
+# Tapahtumasilmukan yhteys
+# Ei-blokkaava socket-kääre, jonka sendall kirjoittaa suoraan sockettiin ja
+# jonottaa lähettämättä jääneen datan. Tapahtumasilmukka tyhjentää jonon kun
+# socket on taas kirjoitettavissa.
+class AsyncConnection(OutboundQueue):
+    def __init__(self, sock, addr, loop, limit=DEFAULT_QUEUE_SIZE, policy=DEFAULT_OVERFLOW_POLICY):
+        super().__init__(limit, policy)
+        self.sock = sock
+        self.addr = addr
+        self.loop = loop
+        self.inflight = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.opened = self.last_seen = time.monotonic()
+        self.ping_sent = 0.0
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    async def recv_into(self, buffer):
+        count = await self.loop.sock_recv_into(self.sock, buffer)
+        self.bytes_in += count
+        self.last_seen = time.monotonic()
+        return count
+
+    def stats(self):
+        return dict(super().stats(), bytes_in=self.bytes_in, bytes_out=self.bytes_out)
+
+    def sendall(self, payload, raw=False):
+        if self.closed:
+            raise BrokenPipeError("Yhteys on suljettu")
+        if self.encoder is not None and not raw:
+            payload = self.encoder(payload)
+        if self.inflight is not None:
+            if not self.push(payload):
+                self.abort()
+            return
+        try:
+            sent = self.sock.send(payload)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self.abort()
+            raise
+        self.sent += 1
+        self.bytes_out += sent
+        if sent < len(payload):
+            self.inflight = memoryview(payload)[sent:]
+            self.loop.add_writer(self.sock, self._flush)
+
+    def _flush(self):
+        while True:
+            if self.inflight is None:
+                if not self.items:
+                    self.loop.remove_writer(self.sock)
+                    return
+                self.inflight = memoryview(self.pop())
+            try:
+                sent = self.sock.send(self.inflight)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self.loop.remove_writer(self.sock)
+                self.abort()
+                return
+            self.bytes_out += sent
+            if sent < len(self.inflight):
+                self.inflight = self.inflight[sent:]
+                return
+            self.inflight = None
+
+    # Katkaisee yhteyden niin, että lukijakorutiini saa EOF:n ja siivoaa tilan
+    def abort(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def stop_reading(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+
+    # Irrottaa socketin palvelimen vaihtoa varten sulkematta sitä
+    # Palauttaa lähettämättä jääneet tavut, myös kesken jääneen viestin lopun
+    def detach(self):
+        self.closed = True
+        pending = b''
+        if self.inflight is not None:
+            self.loop.remove_writer(self.sock)
+            pending = bytes(self.inflight) + b''.join(self.items)
+        self.inflight = None
+        self.items.clear()
+        return pending
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        leftover = b''
+        if self.inflight is not None:
+            self.loop.remove_writer(self.sock)
+            leftover = bytes(self.inflight) + b''.join(self.items)
+        self.inflight = None
+        self.items.clear()
+        send_leftover(self.sock, leftover)
+        self.sock.close()
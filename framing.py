@@ -0,0 +1,141 @@
+# Rivipohjainen kehystys vastaanottopuolelle
+# Sekä palvelin että asiakas lukevat rivinvaihdolla erotettuja JSON-viestejä.
+# LineFramer lukee suoraan omaan bytearray-puskuriinsa (recv_into), etsii
+# rivinvaihtoa vain siitä kohdasta, johon edellinen haku jäi, eikä kopioi
+# puskurin loppua jokaisen rivin jälkeen. Binääriprotokollaan siirtyneen
+# yhteyden pituusetuliitteiset kehykset luetaan samasta puskurista frames()-metodilla.
+
+READ_SIZE = 64 * 1024
+MAX_LINE_LENGTH = 64 * 1024
+
+
+# Rivi ylitti sallitun enimmäispituuden
+class LineTooLong(ValueError):
+    pass
+
+
+class LineFramer:
+    def __init__(self, max_line=MAX_LINE_LENGTH, read_size=READ_SIZE):
+        self.max_line = max_line
+        self.read_size = read_size
+        self.buf = bytearray(read_size * 2)
+        self.view = memoryview(self.buf)
+        self.start = 0  # Ensimmäinen käsittelemätön tavu
+        self.end = 0    # Puskurissa olevan datan loppu
+        self.scan = 0   # Kohta, josta rivinvaihdon haku jatkuu
+
+    # Palauttaa kirjoitettavan alueen puskurin lopusta
+    # Käsitelty data siirretään tarvittaessa alkuun, ja puskuria kasvatetaan
+    # vain jos keskeneräinen rivi ei muuten mahdu
+    def writable(self, size=None):
+        size = size or self.read_size
+        if len(self.buf) - self.end < size:
+            pending = self.end - self.start
+            if self.start:
+                self.buf[:pending] = self.buf[self.start:self.end]
+                self.scan -= self.start
+                self.start = 0
+                self.end = pending
+            if len(self.buf) - self.end < size:
+                grown = bytearray(max(len(self.buf) * 2, pending + size))
+                grown[:pending] = self.view[:pending]
+                self.buf = grown
+                self.view = memoryview(grown)
+        return self.view[self.end:self.end + size]
+
+    # Merkitsee writable()-alueelle luetut tavut puskuriin kuuluviksi
+    def commit(self, count):
+        self.end += count
+
+    # Lukee blokkaavasta socketista suoraan puskuriin
+    # Palauttaa luettujen tavujen määrän, 0 tarkoittaa suljettua yhteyttä
+    def recv_into(self, sock):
+        count = sock.recv_into(self.writable())
+        self.commit(count)
+        return count
+
+    # Lisää valmiin tavujonon puskuriin (esim. testeissä tai toisesta lähteestä)
+    def feed(self, data):
+        self.writable(len(data))[:len(data)] = data
+        self.commit(len(data))
+
+    # Palauttaa puskurissa olevat kokonaiset rivit tavuina ilman rivinvaihtoa
+    # Kaikki valmiit rivit pilkotaan yhdellä split-kutsulla. Heittää
+    # LineTooLong, jos jokin rivi on kasvanut liian pitkäksi.
+    def lines(self):
+        last = self.buf.rfind(b'\n', self.scan, self.end)
+        if last < 0:
+            self.scan = self.end
+            if self.end - self.start > self.max_line:
+                raise LineTooLong(f"Rivi on yli {self.max_line} tavua")
+            return []
+        lines = bytes(self.view[self.start:last]).split(b'\n')
+        if last - self.start > self.max_line and max(map(len, lines)) > self.max_line:
+            raise LineTooLong(f"Rivi on yli {self.max_line} tavua")
+        if last + 1 == self.end:
+            self.start = self.end = self.scan = 0
+        else:
+            self.start = last + 1
+            self.scan = self.end
+            if self.end - self.start > self.max_line:
+                raise LineTooLong(f"Rivi on yli {self.max_line} tavua")
+        return lines
+
+    # Palauttaa puskurissa olevat kokonaiset pituusetuliitteiset kehykset
+    # (varint-pituus ja runko), rungot tavuina ilman etuliitettä
+    def frames(self):
+        frames = []
+        buf = self.buf
+        pos = self.start
+        end = self.end
+        while pos < end:
+            length = buf[pos]
+            body = pos + 1
+            if length >= 0x80:
+                length, body = read_length(buf, pos, end)
+                if length is None:
+                    break
+            if length > self.max_line:
+                raise LineTooLong(f"Kehys on yli {self.max_line} tavua")
+            if body + length > end:
+                break
+            frames.append(bytes(self.view[body:body + length]))
+            pos = body + length
+        if pos == end:
+            self.start = self.end = self.scan = 0
+        else:
+            self.start = self.scan = pos
+        return frames
+
+    # Palauttaa luetut mutta käsittelemättömät tavut (esim. kesken jäänyt rivi)
+    def pending(self):
+        return bytes(self.view[self.start:self.end])
+
+    # Palauttaa käsittelemättömät tavut ja tyhjentää puskurin
+    # Käytetään, kun loput luetusta datasta pitää tulkita toisin (pakatut lohkot)
+    def take(self):
+        data = self.pending()
+        self.start = self.end = self.scan = 0
+        return data
+
+    # Palauttaa jo luetut tavut puskurin alkuun
+    # Käytetään, kun yhteys vaihtaa protokollaa kesken luetun erän
+    def unread(self, data):
+        if not data:
+            return
+        self.feed(data + self.take())
+
+
+# Lukee varint-pituuden kohdasta pos, palauttaa (pituus, rungon alku)
+# Palauttaa (None, pos), jos pituus jatkuu puskurin lopun yli
+def read_length(buf, pos, end):
+    value = 0
+    shift = 0
+    while pos < end:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+    return None, pos
@@ -0,0 +1,164 @@
+import json
+import os
+import socket
+import struct
+import threading
+
+# Palvelimen vaihto ilman katkosta
+# Käynnissä oleva palvelin kuuntelee UNIX-socketia (--handoff-socket). Uusi
+# prosessi yhdistää siihen (--takeover) ja saa ensimmäisenä kuuntelevan
+# socketin SCM_RIGHTS-viestinä, joten uudet yhteydet jonottavat ytimen
+# jonossa koko vaihdon ajan eikä yhtäkään hylätä. Perässä tulevat kanavien
+# ja istuntojen tila sekä halutessa avoimet asiakasyhteydet, joiden
+# lukemattomat tavut ovat yhä ytimen puskurissa.
+#
+# Viestit ovat pituusetuliitteistä JSONia; kahvat kulkevat viestin
+# ensimmäisten tavujen mukana.
+#   uusi -> vanha: {'action': 'handoff', 'clients': bool}
+#   vanha -> uusi: listen (+ kuunteleva socket), state, clients (+ kahvat)..., done
+#   uusi -> vanha: ok, jonka jälkeen vanha prosessi lopettaa
+
+MAX_FDS = 250  # Linuxilla yhdessä viestissä saa olla enintään 253 kahvaa
+HEADER = struct.Struct('!I')
+
+
+# Vaihto epäonnistui tai vastapuoli katkaisi yhteyden kesken
+class HandoffError(Exception):
+    pass
+
+
+def send_message(sock, data, fds=()):
+    payload = json.dumps(data).encode()
+    frame = HEADER.pack(len(payload)) + payload
+    if fds:
+        sent = socket.send_fds(sock, [frame], list(fds))
+        frame = frame[sent:]
+    sock.sendall(frame)
+
+
+def recv_exact(sock, count):
+    data = bytearray()
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise HandoffError("Vaihtoyhteys katkesi kesken viestin")
+        data += chunk
+    return bytes(data)
+
+
+# Palauttaa (viesti, kahvat)
+def recv_message(sock):
+    head = b''
+    fds = []
+    while len(head) < HEADER.size:
+        chunk, received, _, _ = socket.recv_fds(sock, HEADER.size - len(head), MAX_FDS)
+        if not chunk:
+            raise HandoffError("Vaihtoyhteys katkesi")
+        head += chunk
+        fds.extend(received)
+    length, = HEADER.unpack(head)
+    return json.loads(recv_exact(sock, length)), fds
+
+
+# Kuuntelee vaihtopyyntöjä; vanha, jäänyt socket-tiedosto poistetaan
+def listen_unix(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(1)
+    return sock
+
+
+# Pyytää käynnissä olevaa palvelinta luovuttamaan kuuntelevan socketin
+# Palauttaa (vaihtoyhteys, kuunteleva socket); tila luetaan receive_state-kutsulla
+def request_takeover(path, clients):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    send_message(sock, {'action': 'handoff', 'clients': clients})
+    message, fds = recv_message(sock)
+    if message.get('type') != 'listen' or len(fds) != 1:
+        raise HandoffError("Vanha palvelin ei luovuttanut kuuntelevaa socketia")
+    return sock, socket.socket(fileno=fds[0])
+
+
+# Lukee tilan ja siirrettävät yhteydet done-viestiin asti
+# Palauttaa (tila, [(yhteyden tiedot, kahva), ...])
+def receive_state(sock):
+    state = None
+    clients = []
+    while True:
+        message, fds = recv_message(sock)
+        kind = message.get('type')
+        if kind == 'state':
+            state = message
+        elif kind == 'clients':
+            if len(fds) != len(message['clients']):
+                raise HandoffError("Yhteyksien kahvoja puuttuu")
+            clients.extend(zip(message['clients'], fds))
+        elif kind == 'done':
+            if state is None:
+                raise HandoffError("Vanha palvelin ei lähettänyt tilaa")
+            return state, clients
+        else:
+            raise HandoffError(f"Tuntematon vaihtoviesti: {kind}")
+
+
+# Lukijoiden pysäytys vaihdon ajaksi
+# Lukija on varattu, kun se on lukenut tavuja eikä ole vielä käsitellyt
+# niitä loppuun. Tila siirretään vasta, kun yksikään lukija ei ole varattu,
+# joten jokainen pyyntö käsitellään joko kokonaan vanhassa tai kokonaan
+# uudessa prosessissa. Säieytimessä __enter__ odottaa vaihdon ajan;
+# asyncio-ydin käyttää acquirea ja odottaa itse, koska se ei saa blokata.
+class ReadGate:
+    def __init__(self, paused=False):
+        self.cond = threading.Condition()
+        self.busy = 0
+        self.paused = paused
+
+    def __enter__(self):
+        with self.cond:
+            while self.paused:
+                self.cond.wait()
+            self.busy += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def acquire(self):
+        with self.cond:
+            self.busy += 1
+
+    # Palauttaa True, jos lukijat ovat pysäytettyinä ja viimeinen vapautui
+    def release(self):
+        with self.cond:
+            self.busy -= 1
+            if not self.busy:
+                self.cond.notify_all()
+            return self.paused and not self.busy
+
+    # Pysäyttää uudet lukijat, palauttaa True jos yksikään ei ole varattu
+    def pause(self):
+        with self.cond:
+            self.paused = True
+            self.cond.notify_all()
+            return not self.busy
+
+    # Odottaa delay sekuntia porttia pitäen, tai kunnes lukijat pysäytetään
+    # Vuonhallinnan viivästämä lukija ei näin pidätä palvelimen vaihtoa
+    def sleep(self, delay):
+        with self.cond:
+            self.cond.wait_for(lambda: self.paused, delay)
+
+    def wait_idle(self):
+        with self.cond:
+            while self.busy:
+                self.cond.wait()
+
+    def resume(self):
+        with self.cond:
+            self.paused = False
+            self.cond.notify_all()
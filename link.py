@@ -0,0 +1,64 @@
+from collections import deque
+
+# Palvelinten väliset linkit
+# Useampi server.py-solmu voidaan yhdistää toisiinsa, jolloin kanavat,
+# liittymiset ja yksityisviestit näkyvät kaikissa solmuissa. Linkki on
+# tavallinen TCP-yhteys palvelimen porttiin; ensimmäinen rivi on
+# {'action': 'link', 'node': ..., 'secret': ..., 'nodes': [...]}.
+#
+# Solmut muodostavat puun kuten IRC-verkoissa: linkki hylätään, jos
+# vastapuolen tuntemissa solmuissa on yksikin jo verkossamme oleva solmu.
+# Näin tapahtumat voidaan välittää kaikille linkeille paitsi sille, josta ne
+# tulivat, eikä mikään kierrä ympyrää. Varmuuden vuoksi jokaisella
+# tapahtumalla on tunniste, ja jo nähdyt tunnisteet ohitetaan.
+#
+# Kun linkki katkeaa (netsplit), kaikki sen takana olleet käyttäjät ja
+# solmut poistetaan ja muille linkeille kerrotaan samasta.
+
+LINK_RETRY = 5.0         # Uudelleenyhdistämisen väli sekunteina
+LINK_QUEUE_SIZE = 65536  # Linkin lähtevä jono, ylivuoto katkaisee linkin
+SEEN_EVENTS = 10000      # Muistettavien tapahtumatunnisteiden määrä
+
+
+# Rajattu joukko viimeksi nähtyjä tapahtumatunnisteita
+class SeenEvents:
+    def __init__(self, limit=SEEN_EVENTS):
+        self.order = deque()
+        self.ids = set()
+        self.limit = limit
+
+    # Palauttaa True, jos tunniste on uusi
+    def add(self, event_id):
+        if event_id in self.ids:
+            return False
+        self.ids.add(event_id)
+        self.order.append(event_id)
+        if len(self.order) > self.limit:
+            self.ids.discard(self.order.popleft())
+        return True
+
+
+# Linkin vastapuoli ja solmut, joihin pääsee sen kautta
+class LinkPeer:
+    def __init__(self, node, nodes):
+        self.node = node
+        self.nodes = set(nodes)
+
+
+# Toisessa solmussa oleva käyttäjä
+# link on yhteys, jonka kautta käyttäjä on tavoitettavissa
+class RemoteUser:
+    __slots__ = ('username', 'node', 'link', 'color', 'channels')
+
+    def __init__(self, username, node, link, color):
+        self.username = username
+        self.node = node
+        self.link = link
+        self.color = color
+        self.channels = set()
+
+
+# Jäsentää linkin osoitteen muodossa host:port
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
@@ -0,0 +1,120 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Salasanojen hajautus ja tarkistus
+# Uudet salasanat tallennetaan suolattuna PBKDF2-SHA256-muodossa
+#   pbkdf2_sha256$<kierrokset>$<suola hex>$<tiiviste hex>
+# Vanhat users.json-tiedoston salasanat ovat suolaamattomia SHA-256-heksoja.
+# Ne hyväksytään edelleen, ja onnistuneen kirjautumisen yhteydessä ne
+# hajautetaan uudelleen nykyisellä kierrosmäärällä.
+
+KDF_NAME = 'pbkdf2_sha256'
+DEFAULT_ITERATIONS = 200000
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_MAX_PENDING = 1000
+SALT_BYTES = 16
+
+
+# Hajautusjono on täynnä, pyyntö hylätään heti
+class HashPoolBusy(Exception):
+    pass
+
+
+# Vanha suolaamaton SHA-256-hajautus
+def legacy_hash(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+# Luo suolatun PBKDF2-hajautusarvon
+def hash_password(password, iterations=DEFAULT_ITERATIONS):
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{KDF_NAME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+# Tarkistaa salasanan tallennettua arvoa vasten
+# Palauttaa (oikein, uusi_hajautus). Uusi hajautus on muu kuin None, jos
+# tallennettu arvo on vanhaa muotoa tai liian pienellä kierrosmäärällä.
+def verify_password(password, stored, iterations=DEFAULT_ITERATIONS):
+    if not stored.startswith(KDF_NAME + '$'):
+        ok = hmac.compare_digest(legacy_hash(password), stored)
+        return ok, (hash_password(password, iterations) if ok else None)
+    try:
+        _, rounds, salt, expected = stored.split('$')
+        rounds = int(rounds)
+        salt = bytes.fromhex(salt)
+    except ValueError:
+        return False, None
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, rounds)
+    ok = hmac.compare_digest(digest.hex(), expected)
+    if ok and rounds < iterations:
+        return ok, hash_password(password, iterations)
+    return ok, None
+
+
+# Rajattu hajautustyöpooli
+# Hajautus ajetaan erillisissä säikeissä (hashlib vapauttaa GIL:n PBKDF2:n
+# ajaksi), joten kirjautumisryöppy ei pysäytä viestien käsittelyä. Samanaikaisten
+# laskentojen määrä on rajattu workers-arvolla ja jonossa odottavien määrä
+# max_pending-arvolla. Jokaisen työn jonotusaika kirjataan tilastoihin.
+class HashPool:
+    def __init__(self, workers=DEFAULT_WORKERS, iterations=DEFAULT_ITERATIONS,
+                 max_pending=DEFAULT_MAX_PENDING):
+        self.iterations = iterations
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash')
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.jobs = 0
+        self.rejected = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    def _run(self, submitted, func, args):
+        waited = time.perf_counter() - submitted
+        with self.lock:
+            self.jobs += 1
+            self.queue_time_total += waited
+            if waited > self.queue_time_max:
+                self.queue_time_max = waited
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def submit(self, func, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashPoolBusy()
+            self.pending += 1
+        return self.executor.submit(self._run, time.perf_counter(), func, args)
+
+    # Palauttaa Futuren, jonka tulos on uusi hajautusarvo
+    def hash(self, password):
+        return self.submit(hash_password, password, self.iterations)
+
+    # Palauttaa Futuren, jonka tulos on verify_password-funktion pari
+    def verify(self, password, stored):
+        return self.submit(verify_password, password, stored, self.iterations)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'iterations': self.iterations,
+                'pending': self.pending,
+                'jobs': self.jobs,
+                'rejected': self.rejected,
+                'queue_time_avg': self.queue_time_total / self.jobs if self.jobs else 0.0,
+                'queue_time_max': self.queue_time_max
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,43 @@
+import threading
+
+# Läsnäolotapahtumien kokoaminen
+# Palvelimelle ja kanaville liittymiset ja poistumiset kerätään lyhyen
+# jakson ajan ja lähetetään yhtenä koosteena kohdetta (palvelin tai kanava)
+# kohden. Saman jakson aikana poistunut ja palannut käyttäjä kumoutuu,
+# joten verkkokatkon jälkeinen joukkoyhdistäminen ei tuota viestejä lainkaan.
+
+DEFAULT_PRESENCE_INTERVAL = 0.5
+DEFAULT_PRESENCE_MAX_MEMBERS = 1000
+
+
+class PresenceBatch:
+    def __init__(self):
+        self.scopes = {}
+        self.lock = threading.Lock()
+
+    # scope on kanavan nimi tai None koko palvelimelle
+    def join(self, scope, username):
+        self._change(scope, username, 1)
+
+    def leave(self, scope, username):
+        self._change(scope, username, -1)
+
+    def _change(self, scope, username, delta):
+        with self.lock:
+            changes = self.scopes.setdefault(scope, {})
+            if changes.get(username) == -delta:
+                del changes[username]
+            else:
+                changes[username] = delta
+
+    # Palauttaa kerätyt tapahtumat (scope, liittyneet, poistuneet) ja aloittaa uuden jakson
+    def drain(self):
+        with self.lock:
+            scopes, self.scopes = self.scopes, {}
+        batches = []
+        for scope, changes in scopes.items():
+            joined = [username for username, delta in changes.items() if delta > 0]
+            left = [username for username, delta in changes.items() if delta < 0]
+            if joined or left:
+                batches.append((scope, joined, left))
+        return batches
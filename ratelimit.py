@@ -0,0 +1,50 @@
+import time
+
+# Vuonhallinta token bucketeilla
+# Jokainen viesti vie yhden merkin. Merkkejä kertyy rate sekunnissa enintään
+# burst kappaletta, joten lyhyt purske menee läpi heti mutta tasainen tulva
+# rajoittuu nopeuteen rate. Yhteyden oman bucketin merkit saa ottaa
+# velaksi: yhteyden seuraava viesti odottaa, kunnes velka on kuitattu.
+# Jaetut (kanavan ja palvelimen) bucketit eivät mene velaksi, jottei yhden
+# tulvijan kasvattama velka viivästä tai pudota muiden viestejä; niitä
+# käsitellään kutsujan lukon alla.
+
+DEFAULT_CONN_RATE = 10.0      # Viestiä sekunnissa yhteyttä kohden
+DEFAULT_CONN_BURST = 20
+DEFAULT_CHANNEL_RATE = 0.0    # 0 = ei rajaa
+DEFAULT_CHANNEL_BURST = 200
+DEFAULT_GLOBAL_RATE = 0.0
+DEFAULT_GLOBAL_BURST = 1000
+DEFAULT_MAX_DELAY = 5.0       # Tätä pidempää viivettä vaativa viesti pudotetaan
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp', 'debt')
+
+    def __init__(self, rate, burst, debt=True):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.debt = debt
+
+    # Palauttaa, montako sekuntia seuraavan merkin saamiseen menee
+    def delay(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+        if not self.debt and self.tokens < 0:
+            self.tokens = 0.0
+
+
+# Luo bucketin, tai palauttaa None jos raja ei ole käytössä
+# Jaettu bucket (shared) ei mene velaksi
+def make_bucket(rate, burst, shared=False):
+    if rate <= 0:
+        return None
+    return TokenBucket(rate, max(1, burst), not shared)
@@ -0,0 +1,87 @@
+import os
+import signal
+import threading
+import time
+
+# Asiakkaan ruudunpäivitys
+# Vastaanottosäie ei kirjoita terminaaliin itse, vaan lisää rivit jonoon.
+# Piirtosäie kirjoittaa kaikki yhden ruudun aikana saapuneet rivit yhdellä
+# kirjoituksella: syöterivin tyhjennys, rivit ja syöterivi kerran perään.
+# Yksittäinen viesti piirretään heti, vasta purskeessa rivit kasautuvat.
+
+FRAME_INTERVAL = 1 / 60  # Ruutujen vähimmäisväli sekunteina
+RESIZE_POLL = 1.0        # Leveyden tarkistusväli, jos käyttöjärjestelmä ei kerro koon muutoksesta
+DEFAULT_COLUMNS = 80
+
+
+class Renderer:
+    """Kokoaa ruudulle tulevat rivit ja piirtää ne kerran ruutua kohden"""
+
+    def __init__(self, out, prompt, frame_interval=FRAME_INTERVAL):
+        self.out = out
+        self.prompt = prompt
+        self.frame_interval = frame_interval
+        self.lines = []
+        self.redraw = False
+        self.cond = threading.Condition()
+        self.columns = None
+        self.measured = 0.0
+        self.resize_signal = False
+        # SIGWINCH kertoo koon muutoksesta (ei Windowsilla, jossa leveys tarkistetaan ajoittain)
+        if hasattr(signal, 'SIGWINCH') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGWINCH, self.resized)
+            self.resize_signal = True
+
+    def resized(self, signum=None, frame=None):
+        """Unohtaa välimuistissa olevan terminaalin leveyden"""
+        self.columns = None
+
+    def width(self):
+        """Palauttaa terminaalin leveyden välimuistista"""
+        if self.columns is None or (not self.resize_signal
+                                    and time.monotonic() - self.measured > RESIZE_POLL):
+            try:
+                self.columns = os.get_terminal_size().columns
+            except (AttributeError, OSError, ValueError):
+                self.columns = DEFAULT_COLUMNS
+            self.measured = time.monotonic()
+        return self.columns
+
+    def write(self, line):
+        """Lisää rivin seuraavaan ruutuun"""
+        with self.cond:
+            self.lines.append(line)
+            self.cond.notify()
+
+    def refresh(self):
+        """Pyytää piirtämään syöterivin uudelleen ilman uusia rivejä"""
+        with self.cond:
+            self.redraw = True
+            self.cond.notify()
+
+    def render(self, lines):
+        """Piirtää rivit ja syöterivin yhdellä kirjoituksella"""
+        parts = ['\r', ' ' * (self.width() - 1), '\r']
+        for line in lines:
+            parts.append(line)
+            parts.append('\n')
+        parts.append(self.prompt())
+        self.out.write(''.join(parts))
+        self.out.flush()
+
+    def run(self):
+        """Piirtosäikeen silmukka"""
+        while True:
+            with self.cond:
+                while not self.lines and not self.redraw:
+                    self.cond.wait()
+                lines, self.lines = self.lines, []
+                self.redraw = False
+            self.render(lines)
+            # Seuraavan ruudun aikana saapuvat rivit piirretään yhdessä
+            time.sleep(self.frame_interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
@@ -1,104 +1,426 @@
+import argparse
+import asyncio
+import base64
+import concurrent.futures
+import hmac
+import itertools
 import json
 import os
+import select
 import socket
+import sys
 import threading
-from collections import defaultdict
-import hashlib
+from collections import OrderedDict
+from contextlib import nullcontext
 import time
 
+from passwords import (HashPool, HashPoolBusy, DEFAULT_ITERATIONS, DEFAULT_WORKERS,
+                       DEFAULT_MAX_PENDING)
+from userstore import USER_STORES, open_user_store
+from framing import LineFramer, LineTooLong
+from connection import (AsyncConnection, ThreadConnection, OVERFLOW_POLICIES, raise_fd_limit,
+                        DEFAULT_QUEUE_SIZE, DEFAULT_OVERFLOW_POLICY)
+from metrics import Counter, Histogram, Exposition, start_http_server
+from wire import Interner, Peer, WireError, CHANNEL, USER, TABLE_LIMIT, encode as encode_wire
+from link import (LinkPeer, RemoteUser, SeenEvents, parse_address, LINK_RETRY,
+                  LINK_QUEUE_SIZE)
+from timers import TimerWheel
+from handoff import (HandoffError, ReadGate, MAX_FDS, listen_unix, recv_message, request_takeover,
+                     receive_state, send_message)
+from compress import Compressor, SharedStream, DEFAULT_COMPRESS_LEVEL
+from presence import PresenceBatch, DEFAULT_PRESENCE_INTERVAL, DEFAULT_PRESENCE_MAX_MEMBERS
+from ratelimit import (make_bucket, DEFAULT_CONN_RATE, DEFAULT_CONN_BURST, DEFAULT_CHANNEL_RATE,
+                       DEFAULT_CHANNEL_BURST, DEFAULT_GLOBAL_RATE, DEFAULT_GLOBAL_BURST,
+                       DEFAULT_MAX_DELAY)
+from archive import query_terms
+from capture import CaptureWriter
+from channel import (Channel, MemberSet, scrollback_settings, valid_channel_name, DEFAULT_SCROLLBACK_MESSAGES,
+                     DEFAULT_SCROLLBACK_BYTES, DEFAULT_REPLAY_MESSAGES, DEFAULT_MAX_CHANNELS,
+                     DEFAULT_MAX_JOINED, MAX_CHANNEL_NAME, DEFAULT_CHANNELS)
+
 HOST = '10.232.2.226'
 PORT = 6668
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-server.bind((HOST, PORT))
-server.listen()
-
-channels = defaultdict(set)
-client_channels = defaultdict(set)
-all_clients = set()
+# Jaettu tila ja sen omistajuus:
+# - channels: kanavat luodaan ja poistetaan channels_lockin alla, ja myös
+#   liittyminen tehdään sen alla, jotta tyhjän kanavan poisto ei osu luonnin
+#   ja liittymisen väliin; jäsenyydet ja historia ovat kanavan oman lukon
+#   takana (channel.py)
+# - all_clients: MemberSet, jonka lähetykset iteroivat muuttumatonta kopiota
+# - authenticated_users, user_connections, client_colors: muutetaan vain
+#   state_lockin alla attach_user/detach_user-funktioissa; yksittäiset
+#   haut eivät tarvitse lukkoa, koko taulun läpikäynti ottaa kopion lukon alla
+# - client_channels[conn]: vain yhteyden oma lukija muuttaa omaa joukkoaan;
+#   tavallinen sanakirja, joten pelkkä luku ei luo kirjautumattomalle tyhjää
+# - active_sessions, detached_sessions: session_lock
+# - presence: PresenceBatchin oma lukko, koosteet lähettää yksi ajastin
+# - client_framers[conn]: vain yhteyden oma lukija, palvelimen vaihto lukee
+#   sen lukijoiden ollessa pysäytettyinä (handoff_gate)
+# - binary_peers[conn], compressors[conn], conn_buckets[conn]: lisää ja
+#   poistaa vain yhteyden oma lukija (tai palvelimen vaihto ennen lukijan
+#   käynnistymistä); muut säikeet tekevät niihin vain yksittäisiä hakuja
+#   tai ottavat kopion (mittarit)
+# - Peer: sent-taulu merkitään ja kehykset jonotetaan Peer.lockin alla
+#   (send_frames), received-taulua muuttaa vain yhteyden oma lukija
+# - wire_interner: Internerin oma lukko
+# - compressors[conn]: yhteyden oma virta pakataan lähtevän jonon lukon alla,
+#   jaetut virrat (shared_streams) oman lukkonsa alla; uudet virrat luodaan
+#   shared_streams_lockin alla
+# - channel_buckets, global_bucket: flood_lock; yhteyden oman bucketin
+#   käyttää vain sen lukija
+channels = {}
+channels_lock = threading.Lock()
+client_channels = {}
+all_clients = MemberSet()
+state_lock = threading.Lock()
 session_lock = threading.Lock()
 authenticated_users = {}
+user_connections = {}
 client_colors = {}
 active_sessions = {}
-users = {}
-DEFAULT_CHANNELS = ["#general", "#random", "#help"]
+detached_sessions = OrderedDict()
+binary_peers = {}
+wire_interner = Interner()
+compressors = {}
+shared_streams = {}
+shared_streams_lock = threading.Lock()
+stream_ids = itertools.count(1)
+links = {}
+pending_links = set()
+remote_users = {}
+seen_events = SeenEvents()
+event_counter = itertools.count(1)
+conn_buckets = {}
+channel_buckets = {}
+global_bucket = None
+flood_lock = threading.Lock()
+timers = TimerWheel()
+presence = PresenceBatch()
+client_framers = {}
+handoff_gate = None
+accept_gate = None
+pending_handoff = None
+user_store = None
+hash_pool = None
+capture = None
 for channel in DEFAULT_CHANNELS:
-    channels[channel] = set()
+    channels[channel] = Channel(channel)
+
+# Mittarit: pyyntöjen kesto toiminnoittain, lähetysten kesto ja suljettujen
+# yhteyksien tavumäärät (avoimien yhteyksien tavut luetaan yhteyksistä)
+METRIC_ACTIONS = ('register', 'login', 'message', 'private_message', 'command', 'other')
+request_times = {action: Histogram() for action in METRIC_ACTIONS}
+broadcast_times = Histogram()
+broadcast_recipients = Counter()
+closed_bytes_in = Counter()
+closed_bytes_out = Counter()
+reaped_connections = {'preauth': Counter(), 'timeout': Counter()}
+flood_throttled = Counter()
+flood_dropped = Counter()
+presence_digests = Counter()
+presence_suppressed = Counter()
+closed_plain_bytes = Counter()
+closed_packed_bytes = Counter()
+channels_created = Counter()
+channels_collected = Counter()
 
 DEBUG_MODE = False
 USERS_FILE = 'users.json'
+USERS_DB_FILE = 'users.db'
+OUTBOUND_QUEUE_SIZE = DEFAULT_QUEUE_SIZE
+OVERFLOW_POLICY = DEFAULT_OVERFLOW_POLICY
+MAX_HISTORY_REQUEST = 1000
+SEARCH_RESULTS = 20
+MAX_CHANNELS = DEFAULT_MAX_CHANNELS
+MAX_JOINED = DEFAULT_MAX_JOINED
+RESUME_TTL = 300.0
+CONN_RATE = DEFAULT_CONN_RATE
+CONN_BURST = DEFAULT_CONN_BURST
+CHANNEL_RATE = DEFAULT_CHANNEL_RATE
+CHANNEL_BURST = DEFAULT_CHANNEL_BURST
+FLOOD_MAX_DELAY = DEFAULT_MAX_DELAY
+PREAUTH_TIMEOUT = 30.0
+PING_INTERVAL = 60.0
+PONG_TIMEOUT = 30.0
+PRESENCE_INTERVAL = DEFAULT_PRESENCE_INTERVAL
+PRESENCE_MAX_MEMBERS = DEFAULT_PRESENCE_MAX_MEMBERS
+COMPRESS_LEVEL = DEFAULT_COMPRESS_LEVEL
+NODE_NAME = f"{HOST}:{PORT}"
+LINK_SECRET = None
+HANDOFF_SOCKET = None
+HANDOFF_POLL = 0.05
 
-# Lataa käyttäjätiedot tiedostosta
-# Lataa käyttäjät JSON-tiedostosta, jos se existsi
-def load_users():
-    if not os.path.exists(USERS_FILE):
-        return {}
-    try:
-        with open(USERS_FILE, 'r') as f:
-            if os.path.getsize(USERS_FILE) == 0:
-                return {}
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
-        # Virhe käyttäjien lataamisessa: {e} - Aloitetaan tyhjällä tietokannalla
-        print(f"Virhe käyttäjien lataamisessa: {e} - Aloitetaan tyhjällä tietokannalla")
-        return {}
-
-users = load_users()
-if not isinstance(users, dict):
-    # Virheellinen käyttäjädatan muoto - Nollataan tyhjäksi tietokannaksi
-    print("Virheellinen käyttäjädatan muoto - Nollataan tyhjäksi tietokannaksi")
-    users = {}
-
-# Tallentaa käyttäjätiedot tiedostoon
-# Tallentaa käyttäjädatan JSON-muodossa tiedostoon
-def save_users():
-    try:
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users, f, indent=2)
-    except Exception as e:
-        # Käyttäjädatan tallentaminen epäonnistui: {e}
-        print(f"Käyttäjädatan tallentaminen epäonnistui: {e}")
-
-# Luo salasanan hajautusarvon
-# Muuntaa salasanan SHA-256-hajautusarvoksi
-def hash_password(pw):
-    return hashlib.sha256(pw.encode()).hexdigest()
+# Koodaa JSON-datan lähetettäväksi
+# Palauttaa valmiin rivin tavuina, jotta saman viestin voi lähettää usealle asiakkaalle
+def encode_json(data):
+    return (json.dumps(data) + '\n').encode()
 
-# Lähettää JSON-datan asiakkaalle
-# Koodaa ja lähettää JSON-muotoisen datan asiakkaan yhteyden kautta
-def send_json(conn, data):
+# Lähettää valmiiksi koodatun rivin asiakkaalle
+def send_raw(conn, payload):
     try:
-        conn.sendall((json.dumps(data) + '\n').encode())
+        conn.sendall(payload)
     except:
         pass
 
+# Lähettää JSON-datan asiakkaalle
+# Koodaa ja lähettää JSON-muotoisen datan asiakkaan yhteyden kautta.
+# Binääriprotokollaan siirtyneelle yhteydelle data lähetetään kehyksenä.
+def send_json(conn, data):
+    peer = binary_peers.get(conn)
+    if peer is None:
+        send_raw(conn, encode_json(data))
+    else:
+        send_frames(conn, peer, [encode_wire(data, wire_interner)])
+
+# Lähettää binääriyhteydelle kehykset niiden tarvitsemine define-kehyksineen
+# Numerot merkitään kerrotuiksi ja kehykset lisätään jonoon saman lukon
+# alla, jottei toinen säie ehdi lähettää numeroa käyttävää kehystä ennen
+# sen määrittelyä
+def send_frames(conn, peer, encoded):
+    with peer.lock:
+        send_raw(conn, b''.join(peer.frame(item) for item in encoded))
+
 # Lähettää viestin kaikille kanavan tai palvelimen asiakkaille
-# Lähettää viestin määritetylle kanavalle tai kaikille asiakkaille, poislukien lähettäjä
-def broadcast_message(sender_conn, message, channel=None):
-    username = authenticated_users.get(sender_conn, "Tuntematon")
-    color = client_colors.get(sender_conn, 15)
-    recipients = channels[channel] if channel else all_clients
-    for client in recipients:
-        if client != sender_conn:
-            send_json(client, {
-                'action': 'message',
-                'from': username,
-                'color': color,
-                'message': message,
-                'channel': channel
-            })
+# Lähettää viestin määritetylle kanavalle tai kaikille asiakkaille, poislukien lähettäjä.
+# Palauttaa koodatun viestin, jotta sen voi tallentaa kanavan historiaan.
+def broadcast_message(sender_conn, message, channel=None, seq=None):
+    return deliver_message(authenticated_users.get(sender_conn, "Tuntematon"),
+                           client_colors.get(sender_conn, 15), message, channel, sender_conn, seq)
+
+# Lähettää viestin tämän solmun asiakkaille
+# Viesti koodataan kerran ja samat tavut lähetetään jokaiselle vastaanottajalle.
+# sender_conn jätetään pois vastaanottajista; linkin kautta tulleilla se on None.
+# Historiaan tallennettavilla viesteillä on kanavan järjestysnumero seq.
+def deliver_message(username, color, message, channel=None, sender_conn=None, seq=None):
+    if channel:
+        target = channels.get(channel)
+        targets = target.members.snapshot() if target is not None else ()
+    else:
+        targets = all_clients.snapshot()
+    data = {
+        'action': 'message',
+        'from': username,
+        'color': color,
+        'message': message,
+        'channel': channel
+    }
+    if seq is not None:
+        data['seq'] = seq
+    return fan_out(data, targets, sender_conn, channel)
+
+# Lähettää saman datan joukolle yhteyksiä
+# Data koodataan kerran ja samat tavut lähetetään jokaiselle vastaanottajalle.
+# scope on kanava, jonka jäsenille data menee, tai None koko palvelimelle;
+# pakkausta käyttävät vastaanottajat saavat sen kohteen jaetusta virrasta.
+# Palauttaa JSON-muotoisen koodauksen.
+def fan_out(data, targets, sender_conn=None, scope=None):
+    payload = encode_json(data)
+    binary = None
+    broadcast_recipients.inc(len(targets))
+    start = time.perf_counter()
+    if not binary_peers and not compressors:
+        for client in targets:
+            if client != sender_conn:
+                send_raw(client, payload)
+        broadcast_times.observe(time.perf_counter() - start)
+        return payload
+    packed = {}
+    for client in targets:
+        peer = binary_peers.get(client)
+        compressor = compressors.get(client)
+        if compressor is not None:
+            packed.setdefault(peer is not None, []).append((client, compressor, peer))
+        elif client == sender_conn:
+            continue
+        elif peer is None:
+            send_raw(client, payload)
+        else:
+            # Binäärikehys koodataan myös vain kerran, yhteyskohtaisia ovat
+            # ainoastaan puuttuvien nimien define-kehykset
+            if binary is None:
+                binary = encode_wire(data, wire_interner)
+            send_frames(client, peer, (binary,))
+    for is_binary, members in packed.items():
+        if is_binary:
+            if binary is None:
+                binary = encode_wire(data, wire_interner)
+            fan_out_compressed(binary[0], members, sender_conn, scope, binary)
+        else:
+            fan_out_compressed(payload, members, sender_conn, scope)
+    broadcast_times.observe(time.perf_counter() - start)
+    return payload
+
+# Hakee kohteen ja protokollan jaetun pakkausvirran tai luo sen
+def shared_stream(scope, binary):
+    key = (scope, binary)
+    stream = shared_streams.get(key)
+    if stream is None:
+        with shared_streams_lock:
+            stream = shared_streams.get(key)
+            if stream is None:
+                stream = shared_streams[key] = SharedStream(next(stream_ids), COMPRESS_LEVEL)
+    return stream
+
+# Lähettää datan pakkausta käyttäville vastaanottajille
+# Data pakataan kerran kohteen jaettuun virtaan. Jos joku vastaanottajista ei
+# ole saanut virran kaikkia lohkoja (liittyi juuri kanavalle tai palasi),
+# virran historia tyhjennetään ja hän aloittaa purkamisen tästä lohkosta.
+# Lähettäjä saa lohkon ohitettavana, jotta sen virta pysyy tahdissa.
+# Binääriyhteyksien define-kehykset kulkevat yhteyden omassa virrassa.
+def fan_out_compressed(payload, members, sender_conn, scope, binary=None):
+    stream = shared_stream(scope, binary is not None)
+    if binary is not None:
+        for client, _, peer in members:
+            if client != sender_conn:
+                with peer.lock:
+                    defines = peer.defines(binary)
+                    if defines:
+                        send_raw(client, defines)
+    with stream.lock:
+        fresh = {client for client, compressor, _ in members if not compressor.in_sync(stream)}
+        stream.compress(payload, reset=bool(fresh))
+        for client, compressor, _ in members:
+            out = compressor.shared(stream, len(payload), client in fresh, client == sender_conn)
+            try:
+                client.sendall(out, raw=True)
+            except OSError:
+                pass
+
+# Hakee kanavan tai luo sen, kutsutaan channels_lockin alla
+def open_channel(name):
+    channel = channels.get(name)
+    if channel is None:
+        channel = channels[name] = Channel(name)
+        channels_created.inc()
+    return channel
+
+# Poistaa tyhjän kanavan
+# Oletuskanavat ovat pysyviä, eikä kanavaa poisteta, jos irrotettu istunto
+# voi vielä palata sille. Tarkistus ja poisto tehdään channels_lockin alla,
+# joten samaan aikaan liittyvä joko ehtii kanavalle ensin tai luo uuden.
+def release_channel(name):
+    if name in DEFAULT_CHANNELS:
+        return
+    with channels_lock:
+        channel = channels.get(name)
+        if channel is None or channel.count or session_awaits(name):
+            return
+        del channels[name]
+        # Lokin sulkeminen jonoon ennen kuin uusi samanniminen kanava voi kirjoittaa
+        channel.release()
+    with flood_lock:
+        channel_buckets.pop(name, None)
+    wire_interner.forget(CHANNEL, name)
+    with shared_streams_lock:
+        shared_streams.pop((name, False), None)
+        shared_streams.pop((name, True), None)
+    channels_collected.inc()
+
+def release_channels(names):
+    for name in names:
+        release_channel(name)
+
+# Lisää kanavalle puuttuvan #-etuliitteen
+def normalize_channel(name):
+    return name if name.startswith('#') else '#' + name
+
+# Tarkistaa kanavan nimen ja yhteyden kanavien määrän ennen liittymistä
+# Palauttaa virheilmoituksen tai None, jos liittyminen on sallittu
+def join_refusal(conn, name):
+    joined = client_channels.get(conn, ())
+    if name in joined:
+        return None
+    if not valid_channel_name(name):
+        return (f'Virheellinen kanavan nimi {name}: enintään {MAX_CHANNEL_NAME} '
+                'kirjainta, numeroa, alaviivaa tai viivaa')
+    if len(joined) >= MAX_JOINED:
+        return f'Voit olla enintään {MAX_JOINED} kanavalla, poistu ensin jostain: /leave #kanava'
+    return None
+
+# Liittää yhteyden kanavalle ja luo kanavan tarvittaessa
+# Päivittää sekä kanavan jäsenet että yhteyden kanavat. Palauttaa kanavan
+# ja tiedon siitä, oliko yhteys jo ennestään kanavalla. limit rajaa kanavien
+# määrän MAX_CHANNELSiin, jolloin uutta kanavaa ei luoda ja palautetaan
+# (None, False); istunnon jatko ja palvelimen vaihto liittävät ilman rajaa.
+def join_channel(conn, name, limit=False):
+    with channels_lock:
+        if limit and name not in channels and len(channels) >= MAX_CHANNELS:
+            return None, False
+        channel = open_channel(name)
+        added = channel.add(conn, authenticated_users.get(conn, "Tuntematon"))
+    client_channels.setdefault(conn, set()).add(name)
+    return channel, added
+
+# Poistaa yhteyden kanavalta, palauttaa False jos yhteys ei ollut kanavalla
+# Viimeisen jäsenen lähtiessä kanava poistetaan
+def leave_channel(conn, name):
+    joined = client_channels.get(conn)
+    if joined is not None:
+        joined.discard(name)
+    channel = channels.get(name)
+    if channel is None or not channel.remove(conn):
+        return False
+    if not channel.count:
+        release_channel(name)
+    return True
+
+# Lähettää kanavan viimeisimmät viestit yhdellä kirjoituksella
+# Viestit ovat jo valmiiksi koodattuja rivejä, joten ne vain liitetään yhteen.
+# request_id liitetään otsikkoriviin, kun historia on vastaus /history-pyyntöön.
+# lines on valmiiksi luettu historia (ks. archive_job)
+def send_history(conn, channel, count, request_id=None, lines=None):
+    history = channel.history(count) if lines is None else lines
+    if not history:
+        return
+    header = {
+        'action': 'system',
+        'message': f'Kanavan {channel.name} viimeiset {len(history)} viestiä:'
+    }
+    if request_id is not None:
+        header['id'] = request_id
+    send_lines(conn, header, history)
+
+# Lähettää kanavan viestit, jotka asiakas menetti yhteyden ollessa poikki
+# last_seq on viimeisin asiakkaan näkemä kanavan järjestysnumero
+# prefetched on archive_jobin valmiiksi lukema channel.since-tulos; sen
+# jälkeen saapuneet viestit ovat vielä muistissa ja liitetään perään
+def send_backfill(conn, channel, last_seq, prefetched=None):
+    if prefetched is None:
+        lines, lost, _ = channel.since(last_seq, MAX_HISTORY_REQUEST)
+    else:
+        lines, lost, seq = prefetched
+        lines = lines + channel.since(seq, MAX_HISTORY_REQUEST)[0]
+        if len(lines) > MAX_HISTORY_REQUEST:
+            lost += len(lines) - MAX_HISTORY_REQUEST
+            lines = lines[-MAX_HISTORY_REQUEST:]
+    if not lines:
+        return
+    message = f'Kanavalla {channel.name} lähetettiin {len(lines)} viestiä yhteyden ollessa poikki'
+    if lost:
+        message += f', {lost} vanhinta ei ole enää tallessa'
+    send_lines(conn, {'action': 'system', 'message': message}, lines)
+
+# Lähettää otsikkorivin ja valmiiksi koodatut historiarivit yhdellä kirjoituksella
+def send_lines(conn, header, lines):
+    peer = binary_peers.get(conn)
+    if peer is None:
+        send_raw(conn, encode_json(header) + b''.join(lines))
+    else:
+        # Historia on tallennettu JSON-riveinä, binääriasiakkaalle ne koodataan uudelleen
+        send_frames(conn, peer, [encode_wire(header, wire_interner)]
+                    + [encode_wire(json.loads(line), wire_interner) for line in lines])
+
+# Palauttaa kanavien jäsen- ja historiatilastot
+def channel_stats():
+    return {name: channel.stats() for name, channel in list(channels.items())}
 
 # Lähettää yksityisviestin tietylle käyttäjälle
-# Lähettää viestin vain kohdekäyttäjälle, jos käyttäjä löytyy
+# Lähettää viestin vain kohdekäyttäjälle, jos käyttäjä löytyy.
+# Kohde haetaan user_connections-hakemistosta, ei käymällä läpi kaikkia yhteyksiä.
 def send_private_message(sender_conn, target_username, message):
     sender_username = authenticated_users.get(sender_conn, "Tuntematon")
     sender_color = client_colors.get(sender_conn, 15)
-    target_conn = None
-    for conn, username in authenticated_users.items():
-        if username == target_username:
-            target_conn = conn
-            break
+    target_conn = user_connections.get(target_username)
     if target_conn:
         send_json(target_conn, {
             'action': 'private_message',
@@ -107,33 +429,49 @@ def send_private_message(sender_conn, target_username, message):
             'message': message
         })
         return True
+    remote = remote_users.get(target_username)
+    if remote:
+        send_json(remote.link, {
+            'action': 'link_pm',
+            'to': target_username,
+            'from': sender_username,
+            'color': sender_color,
+            'message': message
+        })
+        return True
     return False
 
 # Käsittelee käyttäjän kirjautumisen
-# Tarkistaa käyttäjätunnuksen ja salasanan, luo istunnon onnistuneen kirjautumisen jälkeen
-def handle_login(data, conn):
+# Tarkistaa käyttäjätunnuksen ja salasanan, luo istunnon onnistuneen kirjautumisen jälkeen.
+# Salasana on jo tarkistettu hajautuspoolissa, credentials on verify_password-funktion
+# palauttama pari tai None, jos käyttäjää ei löytynyt.
+def handle_login(data, conn, credentials):
     username = data.get('username', '').strip()
-    password = data.get('password', '').strip()
     with session_lock:
-        if username in active_sessions:
+        if username in active_sessions or username in remote_users:
             return {
                 'action': 'login',
                 'status': 'error',
                 'message': 'Tili on jo kirjautuneena'
             }
-    user_data = users.get(username)
-    if not user_data or user_data['password'] != hash_password(password):
+    user_data = user_store.get(username)
+    password_ok, upgraded_hash = credentials or (False, None)
+    if not user_data or not password_ok:
         return {
             'action': 'login',
             'status': 'error',
             'message': 'Virheelliset tunnukset'
         }
-    session_id = os.urandom(16).hex()
-    with session_lock:
-        active_sessions[username] = {
-            'session_id': session_id,
-            'socket': conn,
-            'timestamp': time.time()
+    if upgraded_hash:
+        # Vanha tai kevyempi hajautus päivitetään nykyiseen muotoon
+        user_store.update(username, dict(user_data, password=upgraded_hash))
+    session_id = open_session(username, conn)
+    if session_id is None:
+        # Toinen yhteys ehti kirjautua samalla tunnuksella salasanatyön aikana
+        return {
+            'action': 'login',
+            'status': 'error',
+            'message': 'Tili on jo kirjautuneena'
         }
     return {
         'action': 'login',
@@ -145,151 +483,1642 @@ def handle_login(data, conn):
         'available_channels': list(channels.keys())
     }
 
+# Luo kirjautuneelle käyttäjälle istunnon
+# Istunnon tunnisteella katkennut yhteys voidaan jatkaa ilman salasanaa.
+# Palauttaa None, jos käyttäjällä on jo aktiivinen istunto.
+def open_session(username, conn):
+    session_id = os.urandom(16).hex()
+    with session_lock:
+        if username in active_sessions:
+            return None
+        detached_sessions.pop(username, None)
+        active_sessions[username] = {
+            'session_id': session_id,
+            'socket': conn,
+            'timestamp': time.time()
+        }
+    return session_id
+
+# Liittää käyttäjän yhteyteen kirjautumisen, rekisteröinnin tai jatkamisen jälkeen
+def attach_user(conn, username, color):
+    with state_lock:
+        authenticated_users[conn] = username
+        user_connections[username] = conn
+        client_colors[conn] = color
+
+# Poistaa yhteyden käyttäjätiedot
+def detach_user(conn, username):
+    with state_lock:
+        if user_connections.get(username) is conn:
+            del user_connections[username]
+        authenticated_users.pop(conn, None)
+        client_colors.pop(conn, None)
+
+# Palauttaa kopion kirjautuneista yhteyksistä ja käyttäjänimistä
+def user_snapshot():
+    with state_lock:
+        return list(authenticated_users.items())
+
+# Säilyttää katkenneen yhteyden istunnon ja kanavat RESUME_TTL sekuntia
+# Palauttaa samalla vanhentuneiden istuntojen kanavat (ks. expire_sessions)
+def detach_session(conn, username, joined):
+    with session_lock:
+        session = active_sessions.pop(username, None)
+        if session is None:
+            return set()
+        detached_sessions[username] = {
+            'session_id': session['session_id'],
+            'color': client_colors.get(conn, 15),
+            'channels': joined,
+            'detached': time.monotonic()
+        }
+        return expire_sessions()
+
+# Poistaa vanhentuneet irrotetut istunnot (vanhimmat ovat alussa)
+# Kutsutaan session_lock pidettynä. Palauttaa poistettujen istuntojen
+# kanavat, jotka kutsuja antaa lukon jälkeen release_channels-funktiolle.
+def expire_sessions():
+    deadline = time.monotonic() - RESUME_TTL
+    expired = set()
+    while detached_sessions:
+        username, session = next(iter(detached_sessions.items()))
+        if session['detached'] > deadline:
+            break
+        del detached_sessions[username]
+        wire_interner.forget(USER, username)
+        expired |= session['channels']
+    return expired
+
+# Voiko jokin irrotettu istunto vielä palata kanavalle
+# Viimeisenä lähtenyt on yleensä uusin irrotettu istunto, joten haku alkaa lopusta
+def session_awaits(name):
+    with session_lock:
+        return any(name in session['channels'] for session in reversed(detached_sessions.values()))
+
+# Ottaa irrotetun istunnon käyttöön uudelle yhteydelle
+# Palauttaa istunnon tiedot tai None, jos tunniste on väärä tai vanhentunut
+# Vanhentuneiden istuntojen kanavat poistetaan, jos ne jäivät tyhjiksi;
+# jatkettavan istunnon kanavat jätetään, koska se liittyy niille heti.
+def resume_session(conn, username, session_id):
+    with session_lock:
+        expired = expire_sessions()
+        session = detached_sessions.get(username)
+        if (session is None or username in remote_users
+                or not hmac.compare_digest(session['session_id'].encode(), session_id.encode())):
+            session = None
+        else:
+            del detached_sessions[username]
+            active_sessions[username] = {
+                'session_id': session_id,
+                'socket': conn,
+                'timestamp': time.time()
+            }
+            expired -= session['channels']
+    release_channels(expired)
+    return session
+
+# Jäsentää protokollarivin
+# Palauttaa sanakirjan tai None, jos rivi ei ollut kelvollista JSONia
+def parse_line(conn, addr, line):
+    if DEBUG_MODE:
+        # DEBUG: Raaka data osoitteesta {addr}: {line}
+        print(f"DEBUG: Raaka data osoitteesta {addr}: {line.decode(errors='replace')}")
+    try:
+        data = json.loads(line.decode())
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        data = None
+    if capture is not None:
+        capture.line(conn, line, data if isinstance(data, dict) else None)
+    if not isinstance(data, dict):
+        send_json(conn, {'status': 'error', 'message': 'Virheellinen JSON'})
+        return None
+    if DEBUG_MODE:
+        # DEBUG: Jäsennelty data osoitteesta {addr}: {data}
+        print(f"DEBUG: Jäsennelty data osoitteesta {addr}: {data}")
+    return data
+
+# Purkaa binääriprotokollan kehyksen
+# Palauttaa sanakirjan tai None, jos kehys oli define-kehys tai virheellinen
+def parse_frame(conn, addr, peer, frame):
+    try:
+        data = peer.decode(frame)
+    except WireError:
+        # Jäsentymättömästä kehyksestä ei tiedetä, sisältääkö se tunnuksia,
+        # joten sitä ei tallenneta
+        send_json(conn, {'status': 'error', 'message': 'Virheellinen kehys'})
+        return None
+    if capture is not None:
+        capture.frame(conn, frame, data)
+    if DEBUG_MODE and data is not None:
+        # DEBUG: Jäsennelty data osoitteesta {addr}: {data}
+        print(f"DEBUG: Jäsennelty data osoitteesta {addr}: {data}")
+    return data
+
+# Palauttaa puskurissa olevat pyynnöt yhteyden protokollan mukaan
+# Jos yhteys siirtyy binääriprotokollaan kesken erän (kirjautumisvastauksen
+# jälkeen), loput jo pilkotut rivit palautetaan puskuriin ja luetaan kehyksinä.
+# Generaattori etenee vasta, kun edellinen pyyntö on käsitelty.
+def read_requests(conn, addr, framer):
+    peer = binary_peers.get(conn)
+    if peer is not None:
+        for frame in framer.frames():
+            data = parse_frame(conn, addr, peer, frame)
+            if data is not None:
+                yield data
+        return
+    lines = framer.lines()
+    for index, line in enumerate(lines):
+        data = parse_line(conn, addr, line)
+        if data is not None:
+            yield data
+        if conn in binary_peers:
+            framer.unread(b''.join(rest + b'\n' for rest in lines[index + 1:]))
+            yield from read_requests(conn, addr, framer)
+            return
+
+# Lähettää vastauksen pyyntöön
+# Pyynnön valinnainen tunniste (id) palautetaan vastauksessa, jotta asiakas voi
+# lähettää useita pyyntöjä odottamatta välissä ja yhdistää vastaukset oikeisiin
+def respond(conn, request, response):
+    request_id = request.get('id')
+    if request_id is not None:
+        response['id'] = request_id
+    send_json(conn, response)
+
+# Ottaa binääriprotokollan ja pakkauksen käyttöön, jos asiakas pyysi niitä
+# Vastaus lähetetään vielä pakkaamattomana JSONina, seuraavat viestit
+# kehyksinä ja/tai pakattuina lohkoina
+def negotiate_protocol(conn, data, response):
+    binary = data.get('protocol') == 'binary'
+    compress = data.get('compress') == 'zlib' and COMPRESS_LEVEL > 0
+    if binary:
+        response['protocol'] = 'binary'
+    if compress:
+        response['compress'] = 'zlib'
+    respond(conn, data, response)
+    if binary:
+        peer = binary_peers[conn] = Peer(wire_interner, TABLE_LIMIT)
+        conn.set_notice_encoder(peer.encode)
+    if compress:
+        compressor = compressors[conn] = Compressor(COMPRESS_LEVEL)
+        conn.set_encoder(compressor.encode)
+
+# Aloittaa kirjautumisen tai rekisteröinnin salasanatyön hajautuspoolissa
+# Palauttaa Futuren tai None, jos pyyntö ei tarvitse salasanatyötä.
+# Heittää HashPoolBusy, jos poolin jono on täynnä.
+def start_credential_job(data):
+    action = data.get('action')
+    if action not in ('login', 'register'):
+        return None
+    username = data.get('username', '').strip()
+    password = data.get('password', '').strip()
+    if action == 'login':
+        with session_lock:
+            if username in active_sessions:
+                return None
+        user_data = user_store.get(username)
+        if user_data:
+            return hash_pool.verify(password, user_data['password'])
+    elif username not in user_store:
+        return hash_pool.hash(password)
+    return None
+
+# Vastaa kirjautumiseen tai rekisteröintiin, kun hajautuspooli on ruuhkautunut
+def reject_busy(conn, data):
+    respond(conn, data, {
+        'action': data.get('action'),
+        'status': 'error',
+        'message': 'Palvelin on ruuhkautunut, yritä hetken kuluttua uudelleen'
+    })
+
+# Laskee, kauanko viestiä on viivytettävä ennen lähettämistä
+# Viestin on mahduttava yhteyden, kanavan ja koko palvelimen bucketteihin.
+# Viive toteutetaan lopettamalla yhteyden lukeminen siksi aikaa, jolloin
+# tulvija hidastuu TCP:n vuonhallinnan kautta eikä muiden vuoro viivästy.
+# Palauttaa None, jos viive olisi yli FLOOD_MAX_DELAY ja viesti pudotettiin.
+def flood_delay(conn, data):
+    action = data.get('action')
+    if action not in ('message', 'private_message') or conn not in authenticated_users:
+        return 0.0
+    buckets = []
+    bucket = conn_buckets.get(conn)
+    if bucket is None and CONN_RATE > 0:
+        bucket = conn_buckets[conn] = make_bucket(CONN_RATE, CONN_BURST)
+    if bucket is not None:
+        buckets.append(bucket)
+    channel = data.get('channel')
+    limit_channel = action == 'message' and CHANNEL_RATE > 0 and channel in channels
+    shared = limit_channel or global_bucket is not None
+    if not buckets and not shared:
+        return 0.0
+    # Kanavan ja palvelimen bucketit ovat kaikkien lukijoiden yhteisiä
+    with flood_lock if shared else nullcontext():
+        if limit_channel:
+            bucket = channel_buckets.get(channel)
+            if bucket is None:
+                bucket = channel_buckets[channel] = make_bucket(CHANNEL_RATE, CHANNEL_BURST, shared=True)
+            buckets.append(bucket)
+        if global_bucket is not None:
+            buckets.append(global_bucket)
+        now = time.monotonic()
+        delay = max(bucket.delay(now) for bucket in buckets)
+        if delay <= FLOOD_MAX_DELAY:
+            for bucket in buckets:
+                bucket.take()
+    if delay > FLOOD_MAX_DELAY:
+        flood_dropped.inc()
+        respond(conn, data, {
+            'action': 'system',
+            'message': 'Lähetät viestejä liian nopeasti, viesti hylättiin'
+        })
+        return None
+    if delay:
+        flood_throttled.inc()
+    return delay
+
+# Viivästää tulvivan yhteyden lukijaa säieytimessä
+# Lukija pitää lukuporttia varattuna, mutta odotus katkeaa heti, kun
+# palvelimen vaihto pysäyttää lukijat; jo luetut pyynnöt käsitellään silloin
+# viipymättä, jottei mikään jää kesken vaihdossa.
+def throttle(delay):
+    if handoff_gate is None:
+        time.sleep(delay)
+    else:
+        handoff_gate.sleep(delay)
+
+# Sama asyncio-ytimessä: odotus katkeaa, kun palvelimen vaihto on pyydetty
+async def throttle_async(delay):
+    deadline = time.monotonic() + delay
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or handoff_gate is not None and handoff_gate.paused:
+            return
+        await asyncio.sleep(min(remaining, HANDOFF_POLL) if handoff_gate is not None else remaining)
+
+# Käsittelee yhden jäsennetyn pyynnön säieytimessä
+# Salasanatyö odotetaan tässä säikeessä, laskenta tapahtuu hajautuspoolissa
+def handle_line(conn, addr, data):
+    delay = flood_delay(conn, data)
+    if delay is None:
+        return
+    if delay:
+        throttle(delay)
+    try:
+        job = start_credential_job(data)
+    except HashPoolBusy:
+        reject_busy(conn, data)
+        return
+    process_request(conn, addr, data, job.result() if job else None)
+
+# Palauttaa funktion, joka lukee pyynnön tarvitsemat kanavalokin rivit, tai
+# None, jos pyyntö ei lue levyä
+# Levylokin luku ja sitä edeltävä kirjoittajan jonon tyhjennys blokkaavat,
+# joten asyncio-ydin ajaa funktion säiepoolissa ja antaa tuloksen
+# process_requestille, samaan tapaan kuin salasanatyön tuloksen. Muistissa
+# olevan historian pyynnön käsittely lukee itse.
+def archive_job(conn, data):
+    action = data.get('action')
+    if action == 'resume':
+        return backfill_job(data)
+    if action != 'message' or conn not in authenticated_users:
+        return None
+    cmd = data.get('message', '').strip().lower()
+    if cmd == '/history' or cmd.startswith('/history '):
+        name, count = history_request(conn, cmd)
+        channel = channels.get(name)
+        if channel is not None and channel.on_disk(count):
+            return lambda: channel.history(count)
+    elif cmd.startswith('/search '):
+        channel, terms = search_request(cmd)
+        if channel is not None and terms and channel.settings.log_dir:
+            return lambda: channel.search(terms, SEARCH_RESULTS)
+    return None
+
+# Istunnon jatkon kanavat, joiden menetetyt viestit ovat vain levylokissa
+def backfill_job(data):
+    username = str(data.get('username', ''))
+    session_id = str(data.get('session_id', ''))
+    with session_lock:
+        session = detached_sessions.get(username)
+        if session is None or not hmac.compare_digest(session['session_id'].encode(), session_id.encode()):
+            return None
+        names = list(session['channels'])
+    last_seq = data.get('last_seq')
+    if not isinstance(last_seq, dict):
+        last_seq = {}
+    reads = []
+    for name in names:
+        channel = channels.get(name)
+        seen = last_seq.get(name)
+        seen = seen if isinstance(seen, int) else 0
+        if channel is not None and channel.on_disk(min(channel.seq - seen, MAX_HISTORY_REQUEST)):
+            reads.append((name, channel, seen))
+    if not reads:
+        return None
+    return lambda: {name: channel.since(seen, MAX_HISTORY_REQUEST) for name, channel, seen in reads}
+
+# Suorittaa pyynnön ja kirjaa sen keston toiminnon histogrammiin
+# Kirjautumisen ja rekisteröinnin salasanatyö ei sisälly kestoon, sen
+# jonotus näkyy hajautuspoolin mittareissa
+def process_request(conn, addr, data, credentials=None, archived=None):
+    histogram = request_times.get(data.get('action')) or request_times['other']
+    start = time.perf_counter()
+    handle_request(conn, addr, data, credentials, archived)
+    histogram.observe(time.perf_counter() - start)
+
+# Suorittaa pyynnön toiminnon (register, login, message, command)
+# credentials on start_credential_job-työn tulos kirjautumiselle ja rekisteröinnille,
+# archived archive_jobin lukemat lokirivit (None, jos niitä ei luettu valmiiksi)
+def handle_request(conn, addr, data, credentials=None, archived=None):
+    action = data.get('action')
+    if action == 'ping':
+        respond(conn, data, {'action': 'pong'})
+        return
+    if action == 'pong':
+        # Mikä tahansa luettu data päivittää yhteyden last_seen-ajan
+        return
+    if action in LINK_HANDLERS or conn in links or conn in pending_links:
+        handle_link(conn, data)
+        return
+    if action == 'register':
+        username = data.get('username', '').strip()
+        color = data.get('color', 15)
+        if credentials is None or username in remote_users or not user_store.add(username, {
+            'password': credentials,
+            'color': color
+        }):
+            respond(conn, data, {
+                'action': 'register',
+                'status': 'error',
+                'message': 'Käyttäjätunnus on jo varattu'
+            })
+            return
+        attach_user(conn, username, color)
+        negotiate_protocol(conn, data, {
+            'action': 'register',
+            'status': 'success',
+            'message': f'Rekisteröityminen valmis! Tervetuloa {username}!',
+            'session_id': open_session(username, conn),
+            'username': username,
+            'color': color,
+            'available_channels': list(channels.keys())
+        })
+        presence.join(None, username)
+        propagate_user(conn)
+
+    elif action == 'login':
+        response = handle_login(data, conn, credentials)
+        if response['status'] == 'success':
+            username = response['username']
+            attach_user(conn, username, response['color'])
+            negotiate_protocol(conn, data, response)
+            presence.join(None, username)
+            propagate_user(conn)
+        else:
+            respond(conn, data, response)
+
+    elif action == 'resume':
+        username = str(data.get('username', ''))
+        session = None
+        if conn not in authenticated_users:
+            session = resume_session(conn, username, str(data.get('session_id', '')))
+        if session is None:
+            respond(conn, data, {
+                'action': 'resume',
+                'status': 'error',
+                'message': 'Istuntoa ei voi jatkaa, kirjaudu uudelleen'
+            })
+            return
+        attach_user(conn, username, session['color'])
+        # Saman koontijakson aikana katkennut ja palannut käyttäjä ei näy kanavilla lainkaan
+        for channel in session['channels']:
+            if join_channel(conn, channel)[1]:
+                presence.join(channel, username)
+        negotiate_protocol(conn, data, {
+            'action': 'resume',
+            'status': 'success',
+            'username': username,
+            'color': session['color'],
+            'channels': sorted(session['channels'])
+        })
+        last_seq = data.get('last_seq')
+        if not isinstance(last_seq, dict):
+            last_seq = {}
+        for channel in session['channels']:
+            seen = last_seq.get(channel)
+            send_backfill(conn, channels[channel], seen if isinstance(seen, int) else 0,
+                          archived.get(channel) if archived else None)
+        presence.join(None, username)
+        propagate_user(conn)
+
+    elif action == 'message':
+        if conn not in authenticated_users:
+            respond(conn, data, {'status': 'error', 'message': 'Ei autentikoitu'})
+            return
+        message = data.get('message', '').strip()
+        channel = data.get('channel', None)
+        if not channel or channel not in channels or conn not in channels[channel].members:
+            respond(conn, data, {
+                'action': 'system',
+                'message': 'Sinun täytyy liittyä kanavalle lähettääksesi viestejä'
+            })
+            return
+        if message:
+            target = channels[channel]
+            # Numerointi, lähetys ja tallennus kanavan lukon alla, jotta
+            # jokainen jäsen saa viestit historian järjestyksessä
+            with target.lock:
+                target.record(broadcast_message(conn, message, channel, target.next_seq()))
+            propagate({
+                'action': 'link_message',
+                'from': authenticated_users[conn],
+                'color': client_colors.get(conn, 15),
+                'message': message,
+                'channel': channel
+            })
+
+    elif action == 'private_message':
+        if conn not in authenticated_users:
+            respond(conn, data, {'status': 'error', 'message': 'Ei autentikoitu'})
+            return
+        target = data.get('to', '').strip()
+        message = data.get('message', '').strip()
+        if not message:
+            return
+        if not send_private_message(conn, target, message):
+            respond(conn, data, {
+                'action': 'system',
+                'message': f'Käyttäjä {target} ei ole paikalla'
+            })
+
+    elif action == 'command':
+        if conn not in authenticated_users:
+            respond(conn, data, {'status': 'error', 'message': 'Ei autentikoitu'})
+            return
+        cmd = data.get('message', '').strip().lower()
+        username = authenticated_users[conn]
+        if cmd.startswith('/join '):
+            channel = normalize_channel(cmd[6:].strip())
+            refusal = join_refusal(conn, channel)
+            if refusal is None:
+                joined, added = join_channel(conn, channel, limit=True)
+                if joined is None:
+                    refusal = f'Palvelimella on jo {MAX_CHANNELS} kanavaa, uutta kanavaa ei voi luoda'
+            if refusal is not None:
+                respond(conn, data, {'action': 'system', 'message': refusal})
+                return
+            if added:
+                presence.join(channel, username)
+                propagate({'action': 'link_join', 'username': username, 'channel': channel})
+            respond(conn, data, {
+                'action': 'channel_update',
+                'type': 'join',
+                'channel': channel
+            })
+            if added:
+                send_history(conn, joined, scrollback_settings.replay)
+        elif cmd == '/leave' or cmd.startswith('/leave '):
+            channel = cmd[7:].strip()
+            if channel:
+                channel = normalize_channel(channel)
+            elif len(client_channels.get(conn, ())) == 1:
+                channel = next(iter(client_channels[conn]))
+            elif client_channels.get(conn):
+                respond(conn, data, {
+                    'action': 'system',
+                    'message': 'Olet usealla kanavalla, anna kanava: /leave #kanava'
+                })
+                return
+            if channel and leave_channel(conn, channel):
+                presence.leave(channel, username)
+                propagate({'action': 'link_part', 'username': username, 'channel': channel})
+                respond(conn, data, {
+                    'action': 'channel_update',
+                    'type': 'leave',
+                    'channel': channel
+                })
+            else:
+                respond(conn, data, {
+                    'action': 'system',
+                    'message': f'Et ole kanavalla {channel}' if channel else 'Et ole millään kanavalla'
+                })
+        elif cmd == '/list':
+            respond(conn, data, {
+                'action': 'channel_list',
+                'channels': [
+                    {'name': name, 'members': channel.count}
+                    for name, channel in list(channels.items())
+                ]
+            })
+        elif cmd.startswith('/who '):
+            channel = channels.get(normalize_channel(cmd[5:].strip()))
+            if channel is None:
+                respond(conn, data, {
+                    'action': 'system',
+                    'message': 'Kanavaa ei löytynyt'
+                })
+                return
+            respond(conn, data, {
+                'action': 'who',
+                'channel': channel.name,
+                'users': channel.who()
+            })
+        elif cmd == '/history' or cmd.startswith('/history '):
+            channel, count = history_request(conn, cmd)
+            if channel not in channels:
+                respond(conn, data, {
+                    'action': 'system',
+                    'message': 'Kanavaa ei löytynyt'
+                })
+                return
+            send_history(conn, channels[channel], count, data.get('id'), archived)
+        elif cmd.startswith('/search '):
+            channel, terms = search_request(cmd)
+            if channel is None:
+                respond(conn, data, {'action': 'system', 'message': 'Kanavaa ei löytynyt'})
+            elif not terms:
+                respond(conn, data, {'action': 'system', 'message': 'Anna hakusana: /search #kanava sana [from:nimi]'})
+            else:
+                send_search(conn, data, channel, terms, archived)
+
+# Jäsentää /history-komennon, palauttaa kanavan nimen ja viestien määrän
+def history_request(conn, cmd):
+    parts = cmd.split()
+    channel = normalize_channel(parts[1]) if len(parts) > 1 else next(iter(client_channels.get(conn, ())), None)
+    try:
+        count = int(parts[2]) if len(parts) > 2 else scrollback_settings.replay
+    except ValueError:
+        count = scrollback_settings.replay
+    return channel, max(1, min(count, MAX_HISTORY_REQUEST))
+
+# Jäsentää /search-komennon, palauttaa kanavan (None, jos sitä ei ole) ja hakutermit
+def search_request(cmd):
+    parts = cmd[8:].split(None, 1)
+    channel = channels.get(normalize_channel(parts[0]))
+    terms = query_terms(parts[1]) if len(parts) > 1 else []
+    return channel, terms
+
+# Vastaa kanavan lokihakuun uusimmilla osumilla
+# Haku käyttää kanavan levylokin indeksiä, joten lokia ei lueta läpi
+# lines on archive_jobin valmiiksi hakemat osumat
+def send_search(conn, data, channel, terms, lines=None):
+    if lines is None:
+        lines = channel.search(terms, SEARCH_RESULTS)
+    if lines is None:
+        respond(conn, data, {
+            'action': 'system',
+            'message': 'Haku vaatii kanavien levylokit (--scrollback-dir)'
+        })
+        return
+    results = []
+    for line in lines:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        results.append({key: message.get(key) for key in ('from', 'color', 'message', 'seq')})
+    respond(conn, data, {
+        'action': 'search',
+        'channel': channel.name,
+        'query': ' '.join(terms),
+        'results': results
+    })
+
+# Palauttaa tämän solmun ja kaikkien linkkien takana olevien solmujen nimet
+def known_nodes():
+    nodes = {NODE_NAME}
+    for peer in list(links.values()):
+        nodes |= peer.nodes
+    return nodes
+
+# Linkin ensimmäinen rivi: oma nimi, jaettu salaisuus ja tunnetut solmut
+def link_hello():
+    return {
+        'action': 'link',
+        'node': NODE_NAME,
+        'secret': LINK_SECRET or '',
+        'nodes': sorted(known_nodes())
+    }
+
+# Lähettää tapahtuman kaikille linkeille paitsi sille, josta se tuli
+# Tämän solmun omille tapahtumille annetaan verkon laajuisesti yksilöllinen tunniste
+def propagate(data, exclude=None):
+    if not links:
+        return
+    if 'eid' not in data:
+        data['eid'] = f"{NODE_NAME}:{next(event_counter)}"
+        seen_events.add(data['eid'])
+    payload = encode_json(data)
+    for link in list(links):
+        if link is not exclude:
+            send_raw(link, payload)
+
+# Kertoo muille solmuille kirjautuneesta käyttäjästä
+# notice erottaa uuden kirjautumisen linkin alun käyttäjäluettelosta
+def propagate_user(conn):
+    propagate({
+        'action': 'link_user',
+        'username': authenticated_users[conn],
+        'color': client_colors.get(conn, 15),
+        'node': NODE_NAME,
+        'channels': sorted(client_channels.get(conn, ())),
+        'notice': True
+    })
+
+# Lähettää ilmoituksen kaikille tämän solmun asiakkaille
+def notify_all(message):
+    fan_out({'action': 'system', 'message': message}, all_clients.snapshot())
+
+# Ottaa hyväksytyn linkin käyttöön
+# Linkki ei ole asiakas: se poistetaan lähetysten vastaanottajista, sen jono
+# on suurempi ja ylivuoto katkaisee linkin, jotta tapahtumia ei katoa hiljaa.
+# Uudelle naapurille lähetetään kaikki tunnetut käyttäjät kanavineen.
+def register_link(conn, node, nodes):
+    all_clients.discard(conn)
+    conn.limit = LINK_QUEUE_SIZE
+    conn.policy = 'disconnect'
+    propagate({'action': 'link_nodes', 'added': sorted(nodes), 'removed': []})
+    burst = []
+    for client, username in user_snapshot():
+        burst.append({
+            'action': 'link_user',
+            'username': username,
+            'color': client_colors.get(client, 15),
+            'node': NODE_NAME,
+            'channels': sorted(client_channels.get(client, ()))
+        })
+    for user in list(remote_users.values()):
+        burst.append({
+            'action': 'link_user',
+            'username': user.username,
+            'color': user.color,
+            'node': user.node,
+            'channels': sorted(user.channels)
+        })
+    for data in burst:
+        data['eid'] = f"{NODE_NAME}:{next(event_counter)}"
+    links[conn] = LinkPeer(node, nodes)
+    send_raw(conn, b''.join(encode_json(data) for data in burst))
+    notify_all(f"Solmu {node} liittyi verkkoon")
+    print(f"Linkki solmuun {node} muodostettu")
+
+# Käsittelee linkin kättelyn tai linkin kautta tulleen tapahtuman
+# Tapahtuma käsitellään paikallisesti ja välitetään muille linkeille;
+# yksityisviestit reititetään vain kohdekäyttäjän suuntaan.
+def handle_link(conn, data):
+    action = data.get('action')
+    if action == 'link':
+        handle_link_handshake(conn, data)
+        return
+    if conn not in links:
+        if conn not in pending_links:
+            send_json(conn, {'status': 'error', 'message': 'Linkkiä ei ole muodostettu'})
+        return
+    handler = LINK_HANDLERS.get(action)
+    if handler is None:
+        return
+    event_id = data.get('eid')
+    if event_id is not None and not seen_events.add(event_id):
+        return
+    handler(conn, data)
+    if action != 'link_pm':
+        propagate(data, exclude=conn)
+
+# Tarkistaa linkin kättelyn
+# Saapuva linkki vaatii oikean salaisuuden, ja molemmat päät hylkäävät
+# linkin, jonka takana on jo verkossa oleva solmu (silmukka).
+def handle_link_handshake(conn, data):
+    node = data.get('node')
+    nodes = set(data.get('nodes') or ())
+    if conn in pending_links:
+        pending_links.discard(conn)
+        if data.get('status') != 'success' or not node:
+            print(f"Linkki hylättiin: {data.get('message')}")
+            conn.abort()
+            return
+        if nodes & known_nodes():
+            print(f"Linkki solmuun {node} hylättiin: silmukka")
+            conn.abort()
+            return
+        register_link(conn, node, nodes)
+        return
+    if conn in links or conn in authenticated_users:
+        return
+    secret = str(data.get('secret', ''))
+    if not LINK_SECRET or not hmac.compare_digest(secret.encode(), LINK_SECRET.encode()):
+        reason = 'Väärä linkin salaisuus'
+    elif not node or node not in nodes:
+        reason = 'Virheellinen linkkipyyntö'
+    elif nodes & known_nodes():
+        reason = 'Solmu on jo verkossa'
+    else:
+        send_json(conn, {
+            'action': 'link',
+            'status': 'success',
+            'node': NODE_NAME,
+            'nodes': sorted(known_nodes())
+        })
+        register_link(conn, node, nodes)
+        return
+    print(f"Linkki solmusta {node} hylättiin: {reason}")
+    send_json(conn, {'action': 'link', 'status': 'error', 'message': reason})
+    conn.stop_reading()
+
+# Lisää toisen solmun käyttäjän kanavalle ja luo kanavan tarvittaessa
+# Kanavien määrää ei rajata: käyttäjän kanavat on hyväksynyt hänen oma solmunsa
+def join_remote(name, username, node):
+    with channels_lock:
+        return open_channel(name).add_remote(username, node)
+
+# Poistaa toisen solmun käyttäjän kanavalta, tyhjä kanava poistetaan
+def leave_remote(name, username):
+    channel = channels.get(name)
+    if channel is None or not channel.remove_remote(username):
+        return False
+    if not channel.count:
+        release_channel(name)
+    return True
+
+# Toisessa solmussa kirjautunut käyttäjä, myös linkin alun käyttäjäluettelo
+# Paikallinen käyttäjä voittaa nimikonfliktin
+def link_user(conn, data):
+    username = data.get('username')
+    if not username or username in user_connections:
+        return
+    user = remote_users.get(username)
+    if user is None:
+        user = remote_users[username] = RemoteUser(username, data.get('node'), conn, data.get('color', 15))
+    for name in data.get('channels') or ():
+        user.channels.add(name)
+        join_remote(name, username, user.node)
+    if data.get('notice'):
+        presence.join(None, username)
+
+def link_join(conn, data):
+    user = remote_users.get(data.get('username'))
+    name = data.get('channel')
+    if user is None or not name:
+        return
+    user.channels.add(name)
+    if join_remote(name, user.username, user.node):
+        presence.join(name, user.username)
+
+def link_part(conn, data):
+    user = remote_users.get(data.get('username'))
+    name = data.get('channel')
+    if user is None or name not in user.channels:
+        return
+    user.channels.discard(name)
+    if leave_remote(name, user.username):
+        presence.leave(name, user.username)
+
+def link_quit(conn, data):
+    user = remote_users.pop(data.get('username'), None)
+    if user is not None:
+        drop_remote_user(user, data.get('netsplit', False))
+
+def link_message(conn, data):
+    name = data.get('channel')
+    if not name:
+        return
+    # Kanava on olemassa niin kauan kuin lähettäjä on sen jäsen
+    channel = channels.get(name)
+    if channel is None:
+        return
+    with channel.lock:
+        channel.record(deliver_message(data.get('from'), data.get('color', 15), data.get('message', ''), name,
+                                       seq=channel.next_seq()))
+
+def link_pm(conn, data):
+    target = data.get('to')
+    local = user_connections.get(target)
+    if local is not None:
+        send_json(local, {
+            'action': 'private_message',
+            'from': data.get('from'),
+            'color': data.get('color', 15),
+            'message': data.get('message', '')
+        })
+        return
+    user = remote_users.get(target)
+    if user is not None and user.link is not conn:
+        send_json(user.link, data)
+
+def link_nodes(conn, data):
+    peer = links[conn]
+    peer.nodes |= set(data.get('added') or ())
+    peer.nodes -= set(data.get('removed') or ())
+
+LINK_HANDLERS = {
+    'link': None,
+    'link_user': link_user,
+    'link_join': link_join,
+    'link_part': link_part,
+    'link_quit': link_quit,
+    'link_message': link_message,
+    'link_pm': link_pm,
+    'link_nodes': link_nodes
+}
+
+# Poistaa toisen solmun käyttäjän kanavilta
+# Netsplitissä käyttäjiä lähtee kerralla paljon, joten palvelinlaajuinen
+# ilmoitus annetaan yhtenä koosteena käyttäjäkohtaisten sijaan
+def drop_remote_user(user, netsplit=False):
+    for name in user.channels:
+        if leave_remote(name, user.username):
+            presence.leave(name, user.username)
+    if not netsplit:
+        presence.leave(None, user.username)
+
+# Käsittelee katkenneen linkin (netsplit)
+# Linkin takana olleet käyttäjät poistetaan, ja muille linkeille kerrotaan
+# sekä käyttäjistä että solmuista, joihin ei enää pääse
+def handle_netsplit(conn):
+    peer = links.pop(conn)
+    lost = [user for user in list(remote_users.values()) if user.link is conn]
+    for user in lost:
+        del remote_users[user.username]
+        drop_remote_user(user, netsplit=True)
+        propagate({'action': 'link_quit', 'username': user.username, 'netsplit': True})
+    propagate({'action': 'link_nodes', 'added': [], 'removed': sorted(peer.nodes)})
+    notify_all(f"Netsplit: yhteys solmuun {peer.node} katkesi, {len(lost)} käyttäjää poistui")
+    print(f"Linkki solmuun {peer.node} katkesi, {len(lost)} käyttäjää poistui")
+
+# Tarkistaa ajastinpyörästä lauenneen yhteyden
+# Kirjautumaton yhteys katkaistaan PREAUTH_TIMEOUT sekunnin jälkeen.
+# Kirjautunut yhteys tai linkki saa pingin, kun siltä ei ole luettu mitään
+# PING_INTERVAL sekuntiin, ja se katkaistaan, jos vastausta ei tule
+# PONG_TIMEOUT sekunnissa. Katkaisu lopettaa lukemisen, jolloin yhteys
+# siivotaan samassa cleanup_clientissa kuin muutkin suljetut yhteydet.
+def check_connection(conn, now):
+    if conn.closed:
+        return
+    if conn not in authenticated_users and conn not in links:
+        waited = now - conn.opened
+        if waited < PREAUTH_TIMEOUT:
+            timers.schedule(conn, PREAUTH_TIMEOUT - waited)
+            return
+        reaped_connections['preauth'].inc()
+        reap_connection(conn, 'Kirjautuminen ei valmistunut ajoissa')
+        return
+    if conn.ping_sent > conn.last_seen:
+        waited = now - conn.ping_sent
+        if waited < PONG_TIMEOUT:
+            timers.schedule(conn, PONG_TIMEOUT - waited)
+            return
+        reaped_connections['timeout'].inc()
+        reap_connection(conn, 'Yhteys aikakatkaistiin')
+        return
+    idle = now - conn.last_seen
+    if idle < PING_INTERVAL:
+        timers.schedule(conn, PING_INTERVAL - idle)
+        return
+    conn.ping_sent = now
+    send_json(conn, {'action': 'ping'})
+    timers.schedule(conn, PONG_TIMEOUT)
+
+def reap_connection(conn, reason):
+    print(f"Katkaistaan yhteys {conn.addr}: {reason}")
+    send_json(conn, {'status': 'error', 'message': reason})
+    conn.stop_reading()
+
+# Pyörittää ajastinpyörää asyncio-ytimessä
+async def run_timers_async():
+    next_tick = time.monotonic()
+    while True:
+        next_tick += timers.tick
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+        now = time.monotonic()
+        for conn in timers.advance():
+            check_connection(conn, now)
+
+# Lähettää jakson aikana kertyneet läsnäolotapahtumat
+# Jokainen kohde (palvelin tai kanava) saa yhden koosteen, joka koodataan
+# kerran. Kohteille, joissa on yli PRESENCE_MAX_MEMBERS jäsentä, koosteita ei
+# lähetetä lainkaan: niissä liittymisiä ja poistumisia on jatkuvasti, eikä
+# niistä kertominen jokaiselle jäsenelle ole lähetysten arvoista.
+def flush_presence():
+    for scope, joined, left in presence.drain():
+        if scope is None:
+            targets = all_clients.snapshot()
+        else:
+            channel = channels.get(scope)
+            if channel is None:
+                continue
+            targets = channel.members.snapshot()
+        if not targets:
+            continue
+        if len(targets) > PRESENCE_MAX_MEMBERS:
+            presence_suppressed.inc()
+            continue
+        presence_digests.inc()
+        fan_out({'action': 'presence', 'channel': scope, 'joined': joined, 'left': left}, targets,
+                scope=scope)
+
+def run_presence():
+    while True:
+        time.sleep(PRESENCE_INTERVAL)
+        flush_presence()
+
+async def run_presence_async():
+    while True:
+        await asyncio.sleep(PRESENCE_INTERVAL)
+        flush_presence()
+
+# Siivoaa suljetun yhteyden tilan
+# Poistaa yhteyden kanavilta ja istunnoista ja ilmoittaa muille käyttäjille
+def cleanup_client(conn, addr):
+    pending_links.discard(conn)
+    if capture is not None:
+        capture.close(conn)
+    if conn in links:
+        handle_netsplit(conn)
+    username = authenticated_users.get(conn)
+    if username:
+        joined = set(client_channels.get(conn, ()))
+        expired = detach_session(conn, username, joined)
+        for channel in joined:
+            if leave_channel(conn, channel):
+                presence.leave(channel, username)
+        presence.leave(None, username)
+        propagate({'action': 'link_quit', 'username': username})
+        client_channels.pop(conn, None)
+        detach_user(conn, username)
+        if username not in detached_sessions and username not in user_connections:
+            wire_interner.forget(USER, username)
+        release_channels(expired)
+    binary_peers.pop(conn, None)
+    compressor = compressors.pop(conn, None)
+    if compressor is not None:
+        closed_plain_bytes.inc(compressor.plain)
+        closed_packed_bytes.inc(compressor.packed)
+    client_framers.pop(conn, None)
+    conn_buckets.pop(conn, None)
+    timers.cancel(conn)
+    all_clients.discard(conn)
+    closed_bytes_in.inc(conn.bytes_in)
+    closed_bytes_out.inc(conn.bytes_out)
+    conn.close()
+    # Yhteys suljettu: {addr}
+    print(f"Yhteys suljettu: {addr}")
+
 # Käsittelee asiakasyhteyden tapahtumat
 # Hallitsee asiakkaan viestien vastaanoton, käsittelyn ja yhteyden sulkemisen
-def handle_client(conn, addr):
+# Siirretty yhteys jatkaa edellisen prosessin kesken jääneestä framerista.
+def handle_client(conn, addr, framer=None):
     # Uusi yhteys osoitteesta {addr}
     print(f"Uusi yhteys osoitteesta {addr}")
-    all_clients.add(conn)
-    buffer = ""
-    username = None
+    if conn not in pending_links:
+        all_clients.add(conn)
+        if capture is not None:
+            capture.open(conn)
+    timers.schedule(conn, PREAUTH_TIMEOUT)
+    framer = client_framers[conn] = framer or LineFramer()
+    try:
+        while True:
+            # Vaihdon aikana saapuneet tavut jäävät lukematta uudelle prosessille
+            if handoff_gate is not None:
+                conn.wait_readable()
+            with handoff_gate or nullcontext():
+                if not framer.recv_into(conn):
+                    break
+                for data in read_requests(conn, addr, framer):
+                    handle_line(conn, addr, data)
+    except LineTooLong:
+        send_json(conn, {'status': 'error', 'message': 'Liian pitkä viesti'})
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    finally:
+        cleanup_client(conn, addr)
+
+# Käsittelee asiakasyhteyden tapahtumasilmukassa
+# Sama protokolla kuin handle_client, mutta ilman omaa säiettä yhteyttä kohden
+async def handle_client_async(conn, addr, framer=None):
+    # Uusi yhteys osoitteesta {addr}
+    print(f"Uusi yhteys osoitteesta {addr}")
+    if conn not in pending_links:
+        all_clients.add(conn)
+        if capture is not None:
+            capture.open(conn)
+    timers.schedule(conn, PREAUTH_TIMEOUT)
+    framer = client_framers[conn] = framer or LineFramer()
     try:
         while True:
-            data = conn.recv(1024).decode()
-            if not data:
+            if handoff_gate is not None:
+                while handoff_gate.paused:
+                    await asyncio.sleep(HANDOFF_POLL)
+            count = await conn.recv_into(framer.writable())
+            if not count:
                 break
-            buffer += data
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
-                if DEBUG_MODE:
-                    # DEBUG: Raaka data osoitteesta {addr}: {line}
-                    print(f"DEBUG: Raaka data osoitteesta {addr}: {line}")
-                try:
-                    data = json.loads(line)
-                    action = data.get('action')
-                    if DEBUG_MODE:
-                        # DEBUG: Jäsennelty data osoitteesta {addr}: {data}
-                        print(f"DEBUG: Jäsennelty data osoitteesta {addr}: {data}")
-
-                    if action == 'register':
-                        username = data.get('username', '').strip()
-                        password = data.get('password', '').strip()
-                        color = data.get('color', 15)
-                        if username in users:
-                            send_json(conn, {
-                                'action': 'register',
-                                'status': 'error',
-                                'message': 'Käyttäjätunnus on jo varattu'
-                            })
-                            continue
-                        users[username] = {
-                            'password': hash_password(password),
-                            'color': color
-                        }
-                        save_users()
-                        authenticated_users[conn] = username
-                        client_colors[conn] = color
-                        send_json(conn, {
-                            'action': 'register',
-                            'status': 'success',
-                            'message': f'Rekisteröityminen valmis! Tervetuloa {username}!',
-                            'username': username,
-                            'color': color,
-                            'available_channels': list(channels.keys())
-                        })
-                        broadcast_message(conn, f" {username} on rekisteröitynyt ja liittynyt palvelimelle!", None)
-
-                    elif action == 'login':
-                        response = handle_login(data, conn)
-                        if response['status'] == 'success':
-                            username = response['username']
-                            authenticated_users[conn] = username
-                            client_colors[conn] = response['color']
-                            send_json(conn, response)
-                            broadcast_message(conn, f" {username} on liittynyt palvelimelle", None)
-                        else:
-                            send_json(conn, response)
-
-                    elif action == 'message':
-                        if conn not in authenticated_users:
-                            send_json(conn, {'status': 'error', 'message': 'Ei autentikoitu'})
-                            continue
-                        message = data.get('message', '').strip()
-                        channel = data.get('channel', None)
-                        if not channel or channel not in channels or conn not in channels[channel]:
-                            send_json(conn, {
-                                'action': 'system',
-                                'message': 'Sinun täytyy liittyä kanavalle lähettääksesi viestejä'
-                            })
-                            continue
-                        if message:
-                            broadcast_message(conn, message, channel)
-
-                    elif action == 'command':
-                        if conn not in authenticated_users:
-                            send_json(conn, {'status': 'error', 'message': 'Ei autentikoitu'})
-                            continue
-                        cmd = data.get('message', '').strip().lower()
-                        username = authenticated_users[conn]
-                        if cmd.startswith('/join '):
-                            channel = cmd[6:].strip()
-                            if not channel.startswith('#'):
-                                channel = '#' + channel
-                            if client_channels[conn]:
-                                current_channel = next(iter(client_channels[conn]))
-                                channels[current_channel].remove(conn)
-                                client_channels[conn].clear()
-                                broadcast_message(conn, f"🚪 {username} on poistunut kanavalta {current_channel}", current_channel)
-                            channels[channel].add(conn)
-                            client_channels[conn] = {channel}
-                            broadcast_message(conn, f" {username} on liittynyt kanavalle {channel}", channel)
-                            send_json(conn, {
-                                'action': 'channel_update',
-                                'type': 'join',
-                                'channel': channel
-                            })
-                        elif cmd == '/leave':
-                            if client_channels[conn]:
-                                channel = next(iter(client_channels[conn]))
-                                channels[channel].remove(conn)
-                                client_channels[conn].clear()
-                                broadcast_message(conn, f" {username} on poistunut kanavalta {channel}", channel)
-                                send_json(conn, {
-                                    'action': 'channel_update',
-                                    'type': 'leave',
-                                    'channel': channel
-                                })
-                            else:
-                                send_json(conn, {
-                                    'action': 'system',
-                                    'message': 'Et ole millään kanavalla'
-                                })
-
-                except json.JSONDecodeError:
-                    send_json(conn, {'status': 'error', 'message': 'Virheellinen JSON'})
+            framer.commit(count)
+            # Lukija on varattu koko erän ajan; viimeinen vapautuva lukija
+            # käynnistää odottavan palvelimen vaihdon
+            if handoff_gate is not None:
+                handoff_gate.acquire()
+            try:
+                for data in read_requests(conn, addr, framer):
+                    delay = flood_delay(conn, data)
+                    if delay is None:
+                        continue
+                    if delay:
+                        # Yhteyttä ei lueta viiveen aikana, muut yhteydet jatkavat
+                        await throttle_async(delay)
+                    try:
+                        job = start_credential_job(data)
+                    except HashPoolBusy:
+                        reject_busy(conn, data)
+                        continue
+                    # Salasanatyö ja lokin luku levyltä odotetaan pysäyttämättä tapahtumasilmukkaa
+                    credentials = await asyncio.wrap_future(job) if job else None
+                    reader = archive_job(conn, data)
+                    archived = await asyncio.get_running_loop().run_in_executor(None, reader) if reader else None
+                    process_request(conn, addr, data, credentials, archived)
+            finally:
+                if handoff_gate is not None and handoff_gate.release() and pending_handoff is not None:
+                    complete_handoff(*pending_handoff)
+    except LineTooLong:
+        send_json(conn, {'status': 'error', 'message': 'Liian pitkä viesti'})
     except (ConnectionResetError, BrokenPipeError):
         pass
     finally:
-        if username:
-            if client_channels[conn]:
-                channel = next(iter(client_channels[conn]))
-                channels[channel].remove(conn)
-                broadcast_message(conn, f"💤 {username} on poistunut kanavalta {channel}", channel)
-            broadcast_message(conn, f" {username} on katkaissut yhteyden palvelimelle", None)
-            with session_lock:
-                if username in active_sessions:
-                    del active_sessions[username]
-            client_channels.pop(conn, None)
-            authenticated_users.pop(conn, None)
-            client_colors.pop(conn, None)
-        all_clients.discard(conn)
+        cleanup_client(conn, addr)
+
+# Luo kuuntelevan palvelinsocketin
+# Sitoo socketin annettuun osoitteeseen ja aloittaa kuuntelun
+def create_server_socket(host, port):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(socket.SOMAXCONN)
+    return server
+
+# Palauttaa yhteyksien lähtevien jonojen tilastot
+# Avaimena käyttäjänimi tai kirjautumattomalle yhteydelle osoite
+def outbound_stats():
+    return {
+        authenticated_users.get(conn, str(conn.addr)): conn.stats()
+        for conn in all_clients.snapshot()
+    }
+
+# Muotoilee palvelimen mittarit Prometheuksen tekstimuotoon
+# Kutsutaan mittariportin säikeestä, joten jaetuista rakenteista otetaan kopiot
+def metrics_text():
+    connections = all_clients.snapshot()
+    conn_stats = [conn.stats() for conn in connections]
+    channel_list = list(channels.items())
+    out = Exposition()
+    out.histogram('irc_request_seconds', 'Pyyntöjen käsittelyaika toiminnoittain',
+                  [({'action': action}, histogram) for action, histogram in request_times.items()])
+    out.histogram('irc_broadcast_seconds', 'Yhden viestin lähetys kaikille vastaanottajille',
+                  [({}, broadcast_times)])
+    out.add('irc_broadcast_recipients_total', 'counter', 'Lähetysten vastaanottajat yhteensä',
+            [({}, broadcast_recipients.value)])
+    out.add('irc_received_bytes_total', 'counter', 'Asiakkailta vastaanotetut tavut',
+            [({}, closed_bytes_in.value + sum(stats['bytes_in'] for stats in conn_stats))])
+    out.add('irc_sent_bytes_total', 'counter', 'Asiakkaille lähetetyt tavut',
+            [({}, closed_bytes_out.value + sum(stats['bytes_out'] for stats in conn_stats))])
+    out.add('irc_flood_throttled_total', 'counter', 'Vuonhallinnan viivästämät viestit',
+            [({}, flood_throttled.value)])
+    out.add('irc_flood_dropped_total', 'counter', 'Vuonhallinnan pudottamat viestit',
+            [({}, flood_dropped.value)])
+    out.add('irc_presence_digests_total', 'counter', 'Lähetetyt läsnäolokoosteet',
+            [({}, presence_digests.value)])
+    out.add('irc_presence_suppressed_total', 'counter', 'Liian suurille kohteille jätetyt koosteet',
+            [({}, presence_suppressed.value)])
+    out.add('irc_reaped_connections_total', 'counter', 'Aikakatkaistut yhteydet syyn mukaan',
+            [({'reason': reason}, counter.value) for reason, counter in reaped_connections.items()])
+    out.add('irc_connections', 'gauge', 'Avoimet yhteydet', [({}, len(connections))])
+    out.add('irc_authenticated_connections', 'gauge', 'Kirjautuneet yhteydet',
+            [({}, len(authenticated_users))])
+    out.add('irc_binary_connections', 'gauge', 'Binääriprotokollaa käyttävät yhteydet',
+            [({}, len(binary_peers))])
+    out.add('irc_compressed_connections', 'gauge', 'Pakattua siirtoa käyttävät yhteydet',
+            [({}, len(compressors))])
+    packed = list(compressors.values())
+    out.add('irc_compress_plain_bytes_total', 'counter', 'Pakattujen yhteyksien data ennen pakkausta',
+            [({}, closed_plain_bytes.value + sum(compressor.plain for compressor in packed))])
+    out.add('irc_compress_packed_bytes_total', 'counter', 'Pakattujen yhteyksien data pakattuna',
+            [({}, closed_packed_bytes.value + sum(compressor.packed for compressor in packed))])
+    out.add('irc_outbound_queue_depth', 'gauge', 'Lähtevissä jonoissa odottavat viestit',
+            [({}, sum(stats['depth'] for stats in conn_stats))])
+    out.add('irc_outbound_dropped', 'gauge', 'Avoimilta yhteyksiltä pudotetut viestit',
+            [({}, sum(stats['dropped'] for stats in conn_stats))])
+    out.add('irc_links', 'gauge', 'Linkit toisiin solmuihin', [({}, len(links))])
+    out.add('irc_remote_users', 'gauge', 'Muissa solmuissa kirjautuneet käyttäjät',
+            [({}, len(remote_users))])
+    out.add('irc_channels', 'gauge', 'Kanavat', [({}, len(channel_list))])
+    out.add('irc_channels_created_total', 'counter', 'Liittymisen tai linkin luomat kanavat',
+            [({}, channels_created.value)])
+    out.add('irc_channels_collected_total', 'counter', 'Tyhjinä poistetut kanavat',
+            [({}, channels_collected.value)])
+    out.add('irc_channel_members', 'gauge', 'Kanavan jäsenet',
+            [({'channel': name}, channel.count) for name, channel in channel_list])
+    out.add('irc_channel_scrollback_bytes', 'gauge', 'Kanavan muistissa olevan historian arvioitu koko',
+            [({'channel': name}, channel.scrollback.memory) for name, channel in channel_list])
+    out.add('irc_channel_memory_bytes', 'gauge', 'Kanavan arvioitu muistinkäyttö (jäsenet, historia, hakuindeksi)',
+            [({'channel': name}, channel.memory()) for name, channel in channel_list])
+    if hash_pool:
+        pool = hash_pool.stats()
+        out.add('irc_hash_pending', 'gauge', 'Jonossa tai laskennassa olevat salasanatyöt',
+                [({}, pool['pending'])])
+        out.add('irc_hash_jobs_total', 'counter', 'Aloitetut salasanatyöt', [({}, pool['jobs'])])
+        out.add('irc_hash_rejected_total', 'counter', 'Ruuhkan vuoksi hylätyt salasanatyöt',
+                [({}, pool['rejected'])])
+        out.add('irc_hash_queue_seconds_max', 'gauge', 'Pisin salasanatyön jonotusaika',
+                [({}, pool['queue_time_max'])])
+    return out.text()
+
+# Yhteyden tiedot palvelimen vaihtoa varten
+# Palauttaa None, jos yhteyttä ei voi siirtää (kirjoittaja jumissa kesken lähetyksen)
+# Pakatun yhteyden virtojen tilaa ei voi siirtää, joten se jatkaa istuntoa uudelleen yhdistämällä
+def export_client(conn):
+    if conn in compressors:
+        return None
+    outbound = conn.detach()
+    if outbound is None:
+        return None
+    username = authenticated_users.get(conn)
+    session = active_sessions.get(username) if username else None
+    peer = binary_peers.get(conn)
+    framer = client_framers.get(conn)
+    return {
+        'addr': list(conn.addr),
+        'username': username,
+        'color': client_colors.get(conn, 15),
+        'channels': sorted(client_channels.get(conn, ())),
+        'session_id': session['session_id'] if session else None,
+        'binary': peer.state() if peer else None,
+        'pending': base64.b64encode(framer.pending() if framer else b'').decode(),
+        'outbound': base64.b64encode(outbound).decode()
+    }
+
+# Kanavien, istuntojen ja nimitaulujen tila palvelimen vaihtoa varten
+# Siirtämättä jäävien yhteyksien istunnot siirretään irrotettuina, jolloin
+# asiakkaat jatkavat istuntoaan uudessa prosessissa yhdistämällä uudelleen
+def export_state(staying):
+    now = time.monotonic()
+    with session_lock:
+        sessions = {
+            username: {
+                'session_id': session['session_id'],
+                'color': session['color'],
+                'channels': sorted(session['channels']),
+                'age': now - session['detached']
+            }
+            for username, session in detached_sessions.items()
+        }
+        for conn in staying:
+            username = authenticated_users.get(conn)
+            session = active_sessions.get(username)
+            if session is not None:
+                sessions[username] = {
+                    'session_id': session['session_id'],
+                    'color': client_colors.get(conn, 15),
+                    'channels': sorted(client_channels.get(conn, ())),
+                    'age': 0.0
+                }
+    return {
+        'type': 'state',
+        'channels': {
+            name: {
+                'seq': channel.seq,
+                'scrollback': [payload.decode() for payload in channel.scrollback.recent(len(channel.scrollback))]
+            }
+            for name, channel in list(channels.items())
+        },
+        'sessions': sessions,
+        'interner': wire_interner.state()
+    }
+
+# Luovuttaa palvelimen vaihtoyhteyden toisessa päässä olevalle prosessille
+# Kutsutaan lukijoiden ollessa pysäytettyinä: säieytimessä vaihtosäikeestä,
+# asyncio-ytimessä tapahtumasilmukasta, jolloin mikään muu ei etene välissä.
+# Onnistuneen vaihdon jälkeen prosessi lopetetaan. Jos vaihto epäonnistuu
+# ennen kuin yhteyksiä on irrotettu, lukijat jatkavat kuin ennenkin.
+def complete_handoff(peer, listener, migrate, done=None):
+    global pending_handoff
+    pending_handoff = None
+    started = time.perf_counter()
+    moved = []
+    try:
+        for channel in list(channels.values()):
+            channel.close()
+        send_message(peer, {'type': 'listen'}, [listener.fileno()])
+        staying = []
+        for conn in all_clients.snapshot():
+            info = export_client(conn) if migrate else None
+            if info is None:
+                staying.append(conn)
+            else:
+                moved.append((info, conn.fileno()))
+        send_message(peer, export_state(staying))
+        for start in range(0, len(moved), MAX_FDS):
+            batch = moved[start:start + MAX_FDS]
+            send_message(peer, {'type': 'clients', 'clients': [info for info, _ in batch]},
+                         [fd for _, fd in batch])
+        send_message(peer, {'type': 'done'})
+        reply, _ = recv_message(peer)
+        if reply.get('type') != 'ok':
+            raise HandoffError(reply.get('message', 'Uusi prosessi ei ottanut palvelinta käyttöön'))
+    except (OSError, ValueError, HandoffError) as e:
+        print(f"Palvelimen vaihto epäonnistui: {e}")
+        if moved:
+            shutdown_after_handoff(1)
+        handoff_gate.resume()
+        if done is not None:
+            done.set_result(False)
+        return
+    for conn in staying:
+        send_json(conn, {'action': 'system', 'message': 'Palvelin käynnistyy uudelleen, yhteys palautuu hetken kuluttua'})
         conn.close()
-        # Yhteys suljettu: {addr}
-        print(f"Yhteys suljettu: {addr}")
-
-# Palvelin käynnissä osoitteessa {HOST}:{PORT}
-print(f"Palvelin käynnissä osoitteessa {HOST}:{PORT}")
-while True:
-    conn, addr = server.accept()
-    thread = threading.Thread(target=handle_client, args=(conn, addr))
-    thread.start()
\ No newline at end of file
+    print(f"Palvelin luovutettu uudelle prosessille {(time.perf_counter() - started) * 1000:.1f} ms: "
+          f"{len(moved)} yhteyttä siirretty, {len(staying)} jatkaa istuntoa uudelleen yhdistämällä")
+    shutdown_after_handoff(0)
+
+# Lopettaa luovuttaneen prosessin
+# Siirretyt socketit ovat nyt uuden prosessin, joten yhteyksiä ei siivota
+# tavalliseen tapaan (se lähettäisi poistumisilmoituksia niiden kautta)
+def shutdown_after_handoff(status):
+    hash_pool.close()
+    user_store.close()
+    stop_capture()
+    sys.stdout.flush()
+    os._exit(status)
+
+# Kirjoittaa tallenteen loppuun ja sulkee sen
+def stop_capture():
+    if capture is None:
+        return
+    capture.stop()
+    message = f"Tallenne valmis: {capture.records} tietuetta"
+    if capture.dropped:
+        message += f", {capture.dropped} pudotettiin kirjoittajan jäätyä jälkeen"
+    print(message)
+
+# Aloittaa vaihdon asyncio-ytimen tapahtumasilmukassa
+# Jos jokin lukija on kesken erän, vaihdon käynnistää viimeinen vapautuva lukija
+def begin_handoff(peer, listener, migrate, done):
+    global pending_handoff
+    pending_handoff = (peer, listener, migrate, done)
+    if handoff_gate.pause():
+        complete_handoff(*pending_handoff)
+
+# Odottaa vaihtopyyntöjä HANDOFF_SOCKETissa
+# loop on asyncio-ytimen tapahtumasilmukka, säieytimessä None
+def serve_handoff(listener, loop=None):
+    sock = listen_unix(HANDOFF_SOCKET)
+    while True:
+        peer, _ = sock.accept()
+        try:
+            request, _ = recv_message(peer)
+        except (OSError, ValueError, HandoffError):
+            peer.close()
+            continue
+        if request.get('action') != 'handoff':
+            peer.close()
+            continue
+        print("Luovutetaan palvelin uudelle prosessille")
+        migrate = bool(request.get('clients'))
+        if loop is None:
+            accept_gate.pause()
+            accept_gate.wait_idle()
+            handoff_gate.pause()
+            handoff_gate.wait_idle()
+            # Palaa vain, jos vaihto epäonnistui
+            complete_handoff(peer, listener, migrate)
+            accept_gate.resume()
+        else:
+            done = concurrent.futures.Future()
+            loop.call_soon_threadsafe(begin_handoff, peer, listener, migrate, done)
+            done.result()
+        peer.close()
+
+# Palauttaa vanhan prosessin kanavat, irrotetut istunnot ja nimitaulut
+def restore_state(state):
+    wire_interner.restore(state['interner'])
+    for name, saved in state['channels'].items():
+        with channels_lock:
+            channel = open_channel(name)
+        channel.restore(saved['seq'], [line.encode() for line in saved['scrollback']])
+    now = time.monotonic()
+    with session_lock:
+        # Vanhimmat ensin, kuten expire_sessions olettaa
+        for username, saved in sorted(state['sessions'].items(), key=lambda item: -item[1]['age']):
+            detached_sessions[username] = {
+                'session_id': saved['session_id'],
+                'color': saved['color'],
+                'channels': set(saved['channels']),
+                'detached': now - saved['age']
+            }
+
+# Palauttaa siirretyn yhteyden tilan uuteen yhteysolioon
+# Palauttaa framerin, jossa on vanhan prosessin lukema keskeneräinen rivi
+def restore_client(conn, info):
+    username = info['username']
+    if username:
+        attach_user(conn, username, info['color'])
+        if info['session_id']:
+            with session_lock:
+                active_sessions[username] = {
+                    'session_id': info['session_id'],
+                    'socket': conn,
+                    'timestamp': time.time()
+                }
+        for name in info['channels']:
+            join_channel(conn, name)
+    if info['binary'] is not None:
+        peer = binary_peers[conn] = Peer(wire_interner, TABLE_LIMIT)
+        peer.restore(info['binary'])
+        conn.set_notice_encoder(peer.encode)
+    outbound = base64.b64decode(info['outbound'])
+    if outbound:
+        send_raw(conn, outbound)
+    framer = LineFramer()
+    framer.feed(base64.b64decode(info['pending']))
+    return framer
+
+# Ottaa vanhan prosessin tilan ja yhteydet käyttöön
+# Kuunteleva socket on jo käytössä, joten uusia yhteyksiä hyväksytään koko
+# ajan; niiden lukijat odottavat, kunnes tila on palautettu.
+def finish_takeover(sock, state, clients, start_client, started):
+    restore_state(state)
+    for info, fd in clients:
+        start_client(socket.socket(fileno=fd), tuple(info['addr']), info)
+    handoff_gate.resume()
+    send_message(sock, {'type': 'ok'})
+    sock.close()
+    print(f"Palvelimen vaihto valmis {(time.perf_counter() - started) * 1000:.1f} ms: "
+          f"{len(clients)} yhteyttä siirretty")
+
+def takeover_threaded(server, sock, started):
+    try:
+        state, clients = receive_state(sock)
+    except (OSError, ValueError, HandoffError) as e:
+        print(f"Palvelimen vaihto epäonnistui: {e}")
+        shutdown_after_handoff(1)
+    finish_takeover(sock, state, clients, start_connection, started)
+    serve_handoff(server)
+
+async def takeover_async(server, sock, started, tasks):
+    loop = asyncio.get_running_loop()
+    try:
+        state, clients = await loop.run_in_executor(None, receive_state, sock)
+    except (OSError, ValueError, HandoffError) as e:
+        print(f"Palvelimen vaihto epäonnistui: {e}")
+        shutdown_after_handoff(1)
+    finish_takeover(sock, state, clients,
+                    lambda client, addr, info: start_connection_async(loop, tasks, client, addr, info), started)
+    threading.Thread(target=serve_handoff, args=(server, loop), daemon=True).start()
+
+# Käynnistää yhteyden lukijasäikeen; info on vanhalta prosessilta siirretyn yhteyden tila
+def start_connection(sock, addr, info=None):
+    framer = None
+    if info is not None:
+        sock.setblocking(True)
+    conn = ThreadConnection(sock, addr, OUTBOUND_QUEUE_SIZE, OVERFLOW_POLICY)
+    if info is not None:
+        framer = restore_client(conn, info)
+    # Lisätään jo tässä, jotta palvelimen vaihto näkee yhteyden, vaikka sen
+    # säie ei olisi vielä ehtinyt käynnistyä
+    all_clients.add(conn)
+    thread = threading.Thread(target=handle_client, args=(conn, addr, framer))
+    thread.start()
+
+def start_connection_async(loop, tasks, sock, addr, info=None):
+    sock.setblocking(False)
+    conn = AsyncConnection(sock, addr, loop, OUTBOUND_QUEUE_SIZE, OVERFLOW_POLICY)
+    framer = restore_client(conn, info) if info is not None else None
+    task = loop.create_task(handle_client_async(conn, addr, framer))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+
+# Säieydin: yksi lukijasäie jokaista yhteyttä kohden, lähtevät viestit
+# kirjoitetaan yhteyden omassa kirjoittajasäikeessä
+# Palvelimen vaihdon aikana accept_gate on pysäytetty: odottavat yhteydet
+# jäävät kuuntelevan socketin jonoon uuden prosessin hyväksyttäviksi, eikä
+# tämä prosessi ota yhteyksiä, joita se ei enää siirtäisi eikä ohjaisi
+# yhdistämään uudelleen. Siksi acceptia ei kutsuta ennen kuin socketissa
+# on yhteys odottamassa.
+def serve_threaded(server):
+    while True:
+        if accept_gate is not None:
+            select.select([server], [], [])
+        with accept_gate or nullcontext():
+            try:
+                sock, addr = server.accept()
+            except BlockingIOError:
+                # Asyncio-ytimellä käynnistetty seuraaja teki jaetusta kuuntelevasta
+                # socketista ei-blokkaavan, tai se ehti ottaa yhteyden ensin
+                time.sleep(HANDOFF_POLL)
+                continue
+            start_connection(sock, addr)
+
+# Ylläpitää lähtevää linkkiä säieytimessä
+# Katkennut tai hylätty linkki yritetään muodostaa uudelleen LINK_RETRY sekunnin välein
+def maintain_link(address):
+    host, port = parse_address(address)
+    while True:
+        try:
+            sock = socket.create_connection((host, port), timeout=LINK_RETRY)
+            sock.settimeout(None)
+        except OSError:
+            time.sleep(LINK_RETRY)
+            continue
+        conn = ThreadConnection(sock, (host, port), LINK_QUEUE_SIZE, 'disconnect')
+        pending_links.add(conn)
+        send_json(conn, link_hello())
+        handle_client(conn, (host, port))
+        time.sleep(LINK_RETRY)
+
+# Ylläpitää lähtevää linkkiä asyncio-ytimessä
+async def maintain_link_async(address):
+    loop = asyncio.get_running_loop()
+    host, port = parse_address(address)
+    while True:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (host, port)), LINK_RETRY)
+        except (OSError, asyncio.TimeoutError):
+            sock.close()
+            await asyncio.sleep(LINK_RETRY)
+            continue
+        conn = AsyncConnection(sock, (host, port), loop, LINK_QUEUE_SIZE, 'disconnect')
+        pending_links.add(conn)
+        send_json(conn, link_hello())
+        await handle_client_async(conn, (host, port))
+        await asyncio.sleep(LINK_RETRY)
+
+# Asyncio-ydin: kaikki yhteydet yhdessä selector-pohjaisessa tapahtumasilmukassa
+# takeover on (vaihtoyhteys, aloitusaika), kun palvelin otetaan vanhalta prosessilta
+async def serve_asyncio(server, link_addresses=(), takeover=None):
+    loop = asyncio.get_running_loop()
+    server.setblocking(False)
+    tasks = {loop.create_task(run_timers_async()), loop.create_task(run_presence_async())}
+    for address in link_addresses:
+        task = loop.create_task(maintain_link_async(address))
+        tasks.add(task)
+    if takeover is not None:
+        tasks.add(loop.create_task(takeover_async(server, *takeover, tasks)))
+    elif HANDOFF_SOCKET:
+        threading.Thread(target=serve_handoff, args=(server, loop), daemon=True).start()
+    while True:
+        sock, addr = await loop.sock_accept(server)
+        start_connection_async(loop, tasks, sock, addr)
+
+def main():
+    global OUTBOUND_QUEUE_SIZE, OVERFLOW_POLICY, NODE_NAME, LINK_SECRET, RESUME_TTL, user_store, hash_pool
+    global CONN_RATE, CONN_BURST, CHANNEL_RATE, CHANNEL_BURST, FLOOD_MAX_DELAY, global_bucket
+    global PREAUTH_TIMEOUT, PING_INTERVAL, PONG_TIMEOUT, PRESENCE_INTERVAL, PRESENCE_MAX_MEMBERS
+    global HANDOFF_SOCKET, COMPRESS_LEVEL, MAX_CHANNELS, MAX_JOINED, handoff_gate, accept_gate, capture
+    parser = argparse.ArgumentParser(description="IRC-palvelin")
+    parser.add_argument('--host', default=HOST, help="Kuunneltava osoite")
+    parser.add_argument('--port', type=int, default=PORT, help="Kuunneltava portti")
+    parser.add_argument('--core', choices=['thread', 'asyncio'], default='thread',
+                        help="Palvelinydin: säie per yhteys tai asyncio-tapahtumasilmukka")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Lähtevän jonon enimmäispituus viesteinä yhteyttä kohden")
+    parser.add_argument('--overflow-policy', choices=OVERFLOW_POLICIES, default=DEFAULT_OVERFLOW_POLICY,
+                        help="Mitä tehdään, kun hitaan asiakkaan jono täyttyy")
+    parser.add_argument('--user-store', choices=USER_STORES, default='sqlite',
+                        help="Käyttäjätietojen tausta: SQLite-tietokanta tai vanha users.json")
+    parser.add_argument('--hash-workers', type=int, default=DEFAULT_WORKERS,
+                        help="Samanaikaisten salasanalaskentojen enimmäismäärä")
+    parser.add_argument('--hash-queue', type=int, default=DEFAULT_MAX_PENDING,
+                        help="Jonossa odottavien salasanalaskentojen enimmäismäärä")
+    parser.add_argument('--scrollback', type=int, default=DEFAULT_SCROLLBACK_MESSAGES,
+                        help="Muistissa pidettävien viestien enimmäismäärä kanavaa kohden")
+    parser.add_argument('--scrollback-bytes', type=int, default=DEFAULT_SCROLLBACK_BYTES,
+                        help="Kanavan muistissa pidettävän historian enimmäiskoko tavuina")
+    parser.add_argument('--replay', type=int, default=DEFAULT_REPLAY_MESSAGES,
+                        help="Kanavalle liityttäessä lähetettävien historiaviestien määrä")
+    parser.add_argument('--scrollback-dir', default=None,
+                        help="Hakemisto kanavien levylokeille (oletuksena historia vain muistissa)")
+    parser.add_argument('--max-channels', type=int, default=DEFAULT_MAX_CHANNELS,
+                        help="Kanavien enimmäismäärä; tyhjät kanavat poistetaan oletuskanavia lukuun ottamatta")
+    parser.add_argument('--max-joined', type=int, default=DEFAULT_MAX_JOINED,
+                        help="Kuinka monella kanavalla yksi yhteys voi olla yhtä aikaa")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Portti, josta mittarit luetaan osoitteessa http://127.0.0.1:<portti>/metrics")
+    parser.add_argument('--conn-rate', type=float, default=DEFAULT_CONN_RATE,
+                        help="Viestiä sekunnissa yhteyttä kohden (0 = ei rajaa)")
+    parser.add_argument('--conn-burst', type=int, default=DEFAULT_CONN_BURST,
+                        help="Yhteyden sallima purske viesteinä")
+    parser.add_argument('--channel-rate', type=float, default=DEFAULT_CHANNEL_RATE,
+                        help="Viestiä sekunnissa kanavaa kohden (0 = ei rajaa)")
+    parser.add_argument('--channel-burst', type=int, default=DEFAULT_CHANNEL_BURST,
+                        help="Kanavan sallima purske viesteinä")
+    parser.add_argument('--global-rate', type=float, default=DEFAULT_GLOBAL_RATE,
+                        help="Viestiä sekunnissa koko palvelimelle (0 = ei rajaa)")
+    parser.add_argument('--global-burst', type=int, default=DEFAULT_GLOBAL_BURST,
+                        help="Koko palvelimen sallima purske viesteinä")
+    parser.add_argument('--flood-max-delay', type=float, default=DEFAULT_MAX_DELAY,
+                        help="Pisin viive sekunteina, jonka jälkeen viesti pudotetaan")
+    parser.add_argument('--preauth-timeout', type=float, default=PREAUTH_TIMEOUT,
+                        help="Sekunnit, joiden kuluessa uuden yhteyden on kirjauduttava tai rekisteröidyttävä")
+    parser.add_argument('--ping-interval', type=float, default=PING_INTERVAL,
+                        help="Hiljaiselle yhteydelle lähetetään ping näin monen sekunnin jälkeen")
+    parser.add_argument('--pong-timeout', type=float, default=PONG_TIMEOUT,
+                        help="Yhteys katkaistaan, jos pingiin ei vastata näin monessa sekunnissa")
+    parser.add_argument('--presence-interval', type=float, default=DEFAULT_PRESENCE_INTERVAL,
+                        help="Läsnäolotapahtumien koontijakso sekunteina")
+    parser.add_argument('--presence-max-members', type=int, default=DEFAULT_PRESENCE_MAX_MEMBERS,
+                        help="Läsnäolokoosteita ei lähetetä kanavalle tai palvelimelle, jossa on enemmän jäseniä")
+    parser.add_argument('--compress-level', type=int, choices=range(10), default=DEFAULT_COMPRESS_LEVEL,
+                        metavar='0-9', help="Pyydetyn zlib-pakkauksen taso (0 = pakkausta ei tarjota)")
+    parser.add_argument('--resume-ttl', type=float, default=RESUME_TTL,
+                        help="Kuinka monta sekuntia katkenneen yhteyden istuntoa voi jatkaa")
+    parser.add_argument('--node-name', default=None,
+                        help="Solmun nimi palvelinverkossa (oletuksena host:port)")
+    parser.add_argument('--link', action='append', default=[], metavar='HOST:PORT',
+                        help="Muodosta linkki toiseen solmuun (voi antaa useasti)")
+    parser.add_argument('--link-secret', default=None,
+                        help="Linkkien jaettu salaisuus; ilman sitä saapuvia linkkejä ei hyväksytä")
+    parser.add_argument('--handoff-socket', default=None, metavar='POLKU',
+                        help="UNIX-socket, jonka kautta uusi prosessi voi ottaa palvelimen käyttöön ilman katkosta")
+    parser.add_argument('--takeover', action='store_true',
+                        help="Ota kuunteleva socket --handoff-socketissa odottavalta palvelimelta")
+    parser.add_argument('--migrate-clients', action='store_true',
+                        help="Siirrä vaihdossa myös avoimet yhteydet; muuten asiakkaat jatkavat istuntoaan yhdistämällä uudelleen")
+    parser.add_argument('--capture', default=None, metavar='TIEDOSTO',
+                        help="Tallenna asiakkailta saapuva liikenne toistoa varten (benchmarks/replay.py)")
+    parser.add_argument('--kdf-iterations', type=int, default=DEFAULT_ITERATIONS,
+                        help="PBKDF2-kierrokset uusille ja päivitettäville salasanoille")
+    args = parser.parse_args()
+    if args.takeover and not args.handoff_socket:
+        parser.error("--takeover vaatii --handoff-socketin")
+    OUTBOUND_QUEUE_SIZE = args.queue_size
+    OVERFLOW_POLICY = args.overflow_policy
+    scrollback_settings.max_messages = args.scrollback
+    scrollback_settings.max_bytes = args.scrollback_bytes
+    scrollback_settings.replay = args.replay
+    scrollback_settings.log_dir = args.scrollback_dir
+    MAX_CHANNELS = args.max_channels
+    MAX_JOINED = args.max_joined
+    NODE_NAME = args.node_name or f"{args.host}:{args.port}"
+    LINK_SECRET = args.link_secret
+    RESUME_TTL = args.resume_ttl
+    CONN_RATE = args.conn_rate
+    CONN_BURST = args.conn_burst
+    CHANNEL_RATE = args.channel_rate
+    CHANNEL_BURST = args.channel_burst
+    FLOOD_MAX_DELAY = args.flood_max_delay
+    PREAUTH_TIMEOUT = args.preauth_timeout
+    PING_INTERVAL = args.ping_interval
+    PONG_TIMEOUT = args.pong_timeout
+    PRESENCE_INTERVAL = args.presence_interval
+    PRESENCE_MAX_MEMBERS = args.presence_max_members
+    COMPRESS_LEVEL = args.compress_level
+    global_bucket = make_bucket(args.global_rate, args.global_burst, shared=True)
+    HANDOFF_SOCKET = args.handoff_socket
+    if HANDOFF_SOCKET:
+        # Uuden prosessin lukijat odottavat, kunnes vanhan tila on palautettu
+        handoff_gate = ReadGate(paused=args.takeover)
+        accept_gate = ReadGate()
+
+    raise_fd_limit()
+    if args.capture:
+        capture = CaptureWriter(args.capture)
+    user_store = open_user_store(args.user_store, USERS_FILE, USERS_DB_FILE)
+    hash_pool = HashPool(args.hash_workers, args.kdf_iterations, args.hash_queue)
+    takeover = None
+    if args.takeover:
+        started = time.perf_counter()
+        try:
+            sock, server = request_takeover(HANDOFF_SOCKET, args.migrate_clients)
+        except (OSError, ValueError, HandoffError) as e:
+            sys.exit(f"Palvelimen vaihto epäonnistui: {e}")
+        takeover = (sock, started)
+        # Yhteyksiä hyväksytään tästä eteenpäin, vaikka tila on vielä tulossa
+        print(f"Kuunteleva socket saatu vanhalta prosessilta {(time.perf_counter() - started) * 1000:.1f} ms")
+    else:
+        server = create_server_socket(args.host, args.port)
+    if args.metrics_port is not None:
+        start_http_server('127.0.0.1', args.metrics_port, metrics_text)
+    # Palvelin käynnissä osoitteessa {HOST}:{PORT}
+    print(f"Palvelin käynnissä osoitteessa {args.host}:{args.port} ({args.core})")
+    try:
+        if args.core == 'asyncio':
+            asyncio.run(serve_asyncio(server, args.link, takeover))
+        else:
+            server.setblocking(True)
+            if takeover is not None:
+                threading.Thread(target=takeover_threaded, args=(server, *takeover), daemon=True).start()
+            elif HANDOFF_SOCKET:
+                threading.Thread(target=serve_handoff, args=(server,), daemon=True).start()
+            threading.Thread(target=timers.run, args=(check_connection,), daemon=True).start()
+            threading.Thread(target=run_presence, daemon=True).start()
+            for address in args.link:
+                threading.Thread(target=maintain_link, args=(address,), daemon=True).start()
+            serve_threaded(server)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hash_pool.close()
+        user_store.close()
+        for channel in channels.values():
+            channel.close()
+        stop_capture()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import math
+import threading
+import time
+
+# Ajastinpyörä
+# Kaikki yhteyksien aikakatkaisut ovat samassa pyörässä: lokero vastaa yhtä
+# tick-jaksoa ja pyörä etenee lokeron kerrallaan. Yhteys on kerrallaan vain
+# yhdessä lokerossa, joten ajastuksen lisääminen ja poistaminen on O(1) eikä
+# jokaiselle yhteydelle tarvita omaa ajastinta. Liikenne ei siirrä yhteyttä
+# pyörässä: lokeron lauetessa kutsuja tarkistaa yhteyden todellisen tilan ja
+# ajastaa sen tarvittaessa uudelleen.
+
+DEFAULT_TICK = 1.0
+DEFAULT_SLOTS = 512
+
+
+class TimerWheel:
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.position = 0
+        self.where = {}
+        self.lock = threading.Lock()
+
+    # Ajastaa kohteen laukeamaan noin delay sekunnin kuluttua
+    # Pyörän kierrosta pidemmät viiveet laukeavat aikaisemmin ja ajastetaan uudelleen
+    def schedule(self, item, delay):
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self.slots) - 1)
+        with self.lock:
+            old = self.where.get(item)
+            if old is not None:
+                self.slots[old].discard(item)
+            index = (self.position + ticks) % len(self.slots)
+            self.slots[index].add(item)
+            self.where[item] = index
+
+    def cancel(self, item):
+        with self.lock:
+            index = self.where.pop(item, None)
+            if index is not None:
+                self.slots[index].discard(item)
+
+    # Siirtää pyörää yhden lokeron eteenpäin ja palauttaa lauenneet kohteet
+    def advance(self):
+        with self.lock:
+            self.position = (self.position + 1) % len(self.slots)
+            expired = self.slots[self.position]
+            self.slots[self.position] = set()
+            for item in expired:
+                del self.where[item]
+        return expired
+
+    def __len__(self):
+        return len(self.where)
+
+    # Pyörittää pyörää säikeessä ja kutsuu callback(kohde, nyt) lauenneille
+    def run(self, callback):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            now = time.monotonic()
+            for item in self.advance():
+                callback(item, now)
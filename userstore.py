@@ -0,0 +1,241 @@
+import json
+import os
+import sqlite3
+import threading
+
+# Käyttäjätietojen tallennus
+# Palvelin käyttää käyttäjiä vain kolmella tavalla: haku nimellä, olemassaolon
+# tarkistus ja uuden käyttäjän lisäys. Molemmat taustat toteuttavat saman
+# rajapinnan (get, __contains__, add, update, close).
+
+BATCH_INTERVAL = 0.05  # Kuinka kauan kirjoituksia kerätään samaan transaktioon (s)
+BATCH_SIZE = 1000
+
+
+# Vanha JSON-tiedosto
+# Koko tiedosto luetaan muistiin käynnistyksessä ja kirjoitetaan uudelleen
+# jokaisen muutoksen jälkeen. Kirjoitus tehdään väliaikaiseen tiedostoon ja
+# vaihdetaan os.replacella, jotta kaatuminen kesken ei riko tiedostoa.
+class JsonUserStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.users = self.load()
+
+    # Lataa käyttäjät JSON-tiedostosta, jos se on olemassa
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                if os.path.getsize(self.path) == 0:
+                    return {}
+                users = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            # Virhe käyttäjien lataamisessa: {e} - Aloitetaan tyhjällä tietokannalla
+            print(f"Virhe käyttäjien lataamisessa: {e} - Aloitetaan tyhjällä tietokannalla")
+            return {}
+        if not isinstance(users, dict):
+            # Virheellinen käyttäjädatan muoto - Nollataan tyhjäksi tietokannaksi
+            print("Virheellinen käyttäjädatan muoto - Nollataan tyhjäksi tietokannaksi")
+            return {}
+        return users
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.users, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            # Käyttäjädatan tallentaminen epäonnistui: {e}
+            print(f"Käyttäjädatan tallentaminen epäonnistui: {e}")
+
+    def get(self, username):
+        return self.users.get(username)
+
+    def __contains__(self, username):
+        return username in self.users
+
+    def __len__(self):
+        return len(self.users)
+
+    # Lisää käyttäjän, palauttaa False jos nimi on jo varattu
+    def add(self, username, record):
+        with self.lock:
+            if username in self.users:
+                return False
+            self.users[username] = record
+            self.save()
+        return True
+
+    def update(self, username, record):
+        with self.lock:
+            self.users[username] = record
+            self.save()
+
+    def close(self):
+        pass
+
+
+# SQLite-tietokanta WAL-tilassa
+# Hakuja ei tarvitse ladata muistiin käynnistyksessä, vaan ne tehdään
+# pääavaimella suoraan kannasta. Uudet ja muuttuneet käyttäjät kerätään
+# pending-sanakirjaan ja kirjoittajasäie tallentaa ne yhdessä transaktiossa,
+# joten jokainen rekisteröityminen ei maksa omaa levykirjoitustaan.
+class SqliteUserStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.pending = {}
+        self.closed = False
+        self.reader = self.connect()
+        self.reader.executescript('''
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                password TEXT NOT NULL,
+                color INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        ''')
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def get(self, username):
+        with self.lock:
+            record = self.pending.get(username)
+            if record is not None:
+                return record
+            row = self.reader.execute(
+                'SELECT password, color FROM users WHERE username = ?', (username,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'password': row[0], 'color': row[1]}
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def __len__(self):
+        with self.lock:
+            count = self.reader.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+            return count + sum(1 for name in self.pending if not self._stored(name))
+
+    def _stored(self, username):
+        return self.reader.execute(
+            'SELECT 1 FROM users WHERE username = ?', (username,)
+        ).fetchone() is not None
+
+    # Lisää käyttäjän, palauttaa False jos nimi on jo varattu
+    def add(self, username, record):
+        with self.lock:
+            if username in self.pending or self._stored(username):
+                return False
+            self.pending[username] = record
+            self.wakeup.notify()
+        return True
+
+    def update(self, username, record):
+        with self.lock:
+            self.pending[username] = record
+            self.wakeup.notify()
+
+    # Kirjoittajasäie: odottaa muutoksia ja tallentaa ne erissä
+    def _write_loop(self):
+        conn = self.connect()
+        while True:
+            with self.lock:
+                while not self.pending and not self.closed:
+                    self.wakeup.wait()
+                if not self.pending and self.closed:
+                    break
+            if not self.closed:
+                # Annetaan saman hetken rekisteröitymisten kertyä samaan transaktioon
+                with self.lock:
+                    self.wakeup.wait_for(lambda: self.closed or len(self.pending) >= BATCH_SIZE,
+                                         timeout=BATCH_INTERVAL)
+            with self.lock:
+                batch = dict(self.pending)
+            if not self.write_batch(conn, batch) and self.closed:
+                break
+            with self.lock:
+                # Poistetaan vain ne, joita ei ole muutettu kirjoituksen aikana
+                for username, record in batch.items():
+                    if self.pending.get(username) is record:
+                        del self.pending[username]
+        conn.close()
+
+    def write_batch(self, conn, batch):
+        try:
+            conn.execute('BEGIN')
+            conn.executemany(
+                'INSERT OR REPLACE INTO users (username, password, color) VALUES (?, ?, ?)',
+                [(name, rec['password'], rec.get('color', 15)) for name, rec in batch.items()]
+            )
+            conn.execute('COMMIT')
+            return True
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            # Käyttäjädatan tallentaminen epäonnistui: {e}
+            print(f"Käyttäjädatan tallentaminen epäonnistui: {e}")
+            return False
+
+    # Siirtää vanhan users.json-tiedoston käyttäjät kantaan kerran
+    # Tiedosto jätetään paikalleen, siirron tila tallennetaan meta-tauluun
+    def migrate_json(self, json_path):
+        with self.lock:
+            done = self.reader.execute(
+                "SELECT value FROM meta WHERE key = 'migrated_json'"
+            ).fetchone()
+        if done or not os.path.exists(json_path):
+            return 0
+        legacy = JsonUserStore(json_path).users
+        with self.lock:
+            self.reader.execute('BEGIN')
+            self.reader.executemany(
+                'INSERT OR IGNORE INTO users (username, password, color) VALUES (?, ?, ?)',
+                [(name, rec['password'], rec.get('color', 15)) for name, rec in legacy.items()]
+            )
+            self.reader.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_json', ?)",
+                (os.path.abspath(json_path),)
+            )
+            self.reader.execute('COMMIT')
+        return len(legacy)
+
+    # Tallentaa odottavat kirjoitukset ja sulkee kannan
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+        self.writer.join()
+        self.reader.close()
+
+
+USER_STORES = ('sqlite', 'json')
+
+
+# Avaa valitun käyttäjätaustan
+# SQLite-tausta siirtää vanhan JSON-tiedoston käyttäjät ensimmäisellä kerralla
+def open_user_store(backend, json_path, db_path):
+    if backend == 'json':
+        return JsonUserStore(json_path)
+    store = SqliteUserStore(db_path)
+    migrated = store.migrate_json(json_path)
+    if migrated:
+        # Siirrettiin {migrated} käyttäjää tiedostosta {json_path}
+        print(f"Siirrettiin {migrated} käyttäjää tiedostosta {json_path} tietokantaan {db_path}")
+    return store
@@ -0,0 +1,361 @@
+import struct
+import threading
+
+# Tiivis binääriprotokolla
+# Asiakas voi pyytää kirjautumisen tai rekisteröinnin yhteydessä
+# ('protocol': 'binary') siirtymistä rivipohjaisesta JSONista binäärikehyksiin.
+# Vastaus lähetetään vielä JSONina, sen jälkeen molemmat suunnat käyttävät
+# kehyksiä (asiakas odottaa vastausta ennen seuraavaa viestiä, koska pyyntö
+# voi myös epäonnistua tai vanha palvelin jättää sen huomiotta):
+#   <pituus varint><toiminto><kenttien määrä varint>(<avain><arvo>)*
+# Toiminnot ja kenttien avaimet ovat yhden tavun koodeja (tuntemattomat
+# kirjoitetaan merkkijonoina 0xFF-tavun jälkeen). Kanavien ja käyttäjien nimet
+# korvataan numeroilla: lähettäjä kertoo nimen kerran 'define'-kehyksellä ja
+# käyttää sen jälkeen pelkkää numeroa. Kumpikin pää pitää yhteyskohtaista
+# taulua vastapuolen numeroista.
+
+ACTIONS = (None, 'register', 'login', 'message', 'private_message', 'command',
+           'system', 'channel_update', 'channel_list', 'who', 'define', 'ping', 'pong',
+           'presence', 'search')
+KEYS = ('status', 'message', 'from', 'color', 'channel', 'to', 'username',
+        'password', 'session_id', 'type', 'available_channels', 'channels',
+        'users', 'name', 'members', 'protocol', 'kind', 'id', 'retry', 'seq',
+        'joined', 'left', 'results', 'query')
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+KEY_CODES = {key: code for code, key in enumerate(KEYS)}
+INLINE = 0xFF
+
+# Arvojen tyyppitavut
+T_NONE, T_FALSE, T_TRUE, T_INT, T_STR, T_LIST, T_DICT, T_FLOAT, T_CHANNEL, T_USER = range(10)
+
+CHANNEL = 'channel'
+USER = 'user'
+# Kentät, joiden merkkijonoarvo korvataan numerolla
+INTERNED_FIELDS = {'channel': (CHANNEL, T_CHANNEL), 'from': (USER, T_USER),
+                   'to': (USER, T_USER), 'username': (USER, T_USER)}
+REFERENCE_KINDS = {T_CHANNEL: CHANNEL, T_USER: USER}
+
+DOUBLE = struct.Struct('!d')
+
+# Numerotaulujen enimmäiskoko lajia kohden. Täyttynyt taulu tyhjennetään:
+# numeroita ei käytetä uudelleen, joten nimet vain määritellään uudestaan.
+TABLE_LIMIT = 65536
+
+
+# Virheellinen tai tuntematonta numeroa käyttävä kehys
+class WireError(ValueError):
+    pass
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+# Lukee varintin kohdasta pos, palauttaa (arvo, seuraava kohta)
+# Palauttaa (None, pos), jos luku jatkuu datan lopun yli
+def read_varint(data, pos, end):
+    value = 0
+    shift = 0
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+    return None, pos
+
+
+def write_str(out, text):
+    raw = text.encode()
+    write_varint(out, len(raw))
+    out += raw
+
+
+def write_key(out, key):
+    code = KEY_CODES.get(key)
+    if code is None:
+        out.append(INLINE)
+        write_str(out, key)
+    else:
+        out.append(code)
+
+
+def write_value(out, value):
+    if value is None:
+        out.append(T_NONE)
+    elif value is True:
+        out.append(T_TRUE)
+    elif value is False:
+        out.append(T_FALSE)
+    elif isinstance(value, str):
+        out.append(T_STR)
+        write_str(out, value)
+    elif isinstance(value, int):
+        out.append(T_INT)
+        write_varint(out, value << 1 if value >= 0 else ((-value) << 1) - 1)
+    elif isinstance(value, float):
+        out.append(T_FLOAT)
+        out += DOUBLE.pack(value)
+    elif isinstance(value, (list, tuple)):
+        out.append(T_LIST)
+        write_varint(out, len(value))
+        for item in value:
+            write_value(out, item)
+    elif isinstance(value, dict):
+        out.append(T_DICT)
+        write_varint(out, len(value))
+        for key, item in value.items():
+            write_key(out, key)
+            write_value(out, item)
+    else:
+        raise WireError(f"Tuntematon arvon tyyppi {type(value).__name__}")
+
+
+# Jakaa nimille numerot
+# Palvelimella yksi yhteinen taulu, jotta samat kehystavut kelpaavat kaikille
+# vastaanottajille; yhteyskohtaisesti pidetään kirjaa vain siitä, mitkä
+# numerot vastapuolelle on jo kerrottu.
+# Numerot jaetaan lukon alla kasvavasta laskurista eikä niitä käytetä
+# uudelleen, joten poistetun nimen vanha numero ei voi sekoittua uuteen.
+class Interner:
+    def __init__(self):
+        self.ids = {CHANNEL: {}, USER: {}}
+        self.next = {CHANNEL: 1, USER: 1}
+        self.defines = {}
+        self.lock = threading.Lock()
+
+    def intern(self, kind, name):
+        number = self.ids[kind].get(name)
+        if number is None:
+            with self.lock:
+                table = self.ids[kind]
+                number = table.get(name)
+                if number is None:
+                    if len(table) >= TABLE_LIMIT:
+                        self._clear(kind)
+                    number = table[name] = self.next[kind]
+                    self.next[kind] += 1
+        return number
+
+    # Unohtaa poistuneen kanavan tai käyttäjän numeron
+    def forget(self, kind, name):
+        with self.lock:
+            number = self.ids[kind].pop(name, None)
+            if number is not None:
+                self.defines.pop((number << 1) | (kind == USER), None)
+
+    # Kutsutaan lukon alla
+    def _clear(self, kind):
+        self.ids[kind].clear()
+        user = kind == USER
+        self.defines = {ref: frame for ref, frame in self.defines.items() if bool(ref & 1) != user}
+
+    # Numerotaulut palvelimen vaihtoa varten (JSON-muodossa)
+    def state(self):
+        with self.lock:
+            state = {kind: dict(table) for kind, table in self.ids.items()}
+            state['next'] = dict(self.next)
+            return state
+
+    def restore(self, state):
+        with self.lock:
+            self.ids = {kind: dict(state.get(kind, {})) for kind in (CHANNEL, USER)}
+            self.next = {kind: state.get('next', {}).get(kind, max(self.ids[kind].values(), default=0) + 1)
+                         for kind in (CHANNEL, USER)}
+            self.defines = {}
+
+    # Palauttaa nimen define-kehyksen, joka koodataan vain kerran
+    # Unohdetun numeron kehystä ei enää tallenneta välimuistiin
+    def define(self, ref, name):
+        frame = self.defines.get(ref)
+        if frame is None:
+            kind = USER if ref & 1 else CHANNEL
+            frame = encode({'action': 'define', 'kind': kind, 'id': ref >> 1, 'name': name}, self)[0]
+            if self.ids[kind].get(name) == ref >> 1:
+                self.defines[ref] = frame
+        return frame
+
+
+# Koodaa viestin kehykseksi
+# Palauttaa (kehys pituusetuliitteineen, viittaukset). Viittaukset ovat
+# (avain, nimi)-pareja, jotka vastaanottajan täytyy tuntea; avain on
+# numero * 2 kanaville ja numero * 2 + 1 käyttäjille.
+def encode(data, interner):
+    body = bytearray()
+    refs = []
+    action = data.get('action')
+    code = ACTION_CODES.get(action)
+    if code is None:
+        body.append(INLINE)
+        write_str(body, action)
+    else:
+        body.append(code)
+    write_varint(body, len(data) - ('action' in data))
+    for key, value in data.items():
+        if key == 'action':
+            continue
+        write_key(body, key)
+        interned = INTERNED_FIELDS.get(key)
+        if interned and isinstance(value, str):
+            kind, tag = interned
+            number = interner.intern(kind, value)
+            refs.append(((number << 1) | (kind == USER), value))
+            body.append(tag)
+            write_varint(body, number)
+        else:
+            write_value(body, value)
+    frame = bytearray()
+    write_varint(frame, len(body))
+    frame += body
+    return bytes(frame), refs
+
+
+def read_str(data, pos):
+    length, pos = read_varint(data, pos, len(data))
+    if length is None or pos + length > len(data):
+        raise WireError("Katkennut merkkijono")
+    return data[pos:pos + length].decode(), pos + length
+
+
+def read_key(data, pos):
+    code = data[pos]
+    if code == INLINE:
+        return read_str(data, pos + 1)
+    if code >= len(KEYS):
+        raise WireError(f"Tuntematon avain {code}")
+    return KEYS[code], pos + 1
+
+
+def read_value(data, pos, table):
+    tag = data[pos]
+    pos += 1
+    if tag == T_STR:
+        return read_str(data, pos)
+    if tag == T_INT:
+        raw, pos = read_varint(data, pos, len(data))
+        if raw is None:
+            raise WireError("Katkennut luku")
+        return (raw >> 1) ^ -(raw & 1), pos
+    if tag in REFERENCE_KINDS:
+        number, pos = read_varint(data, pos, len(data))
+        name = table[REFERENCE_KINDS[tag]].get(number)
+        if name is None:
+            raise WireError(f"Tuntematon numero {number}")
+        return name, pos
+    if tag == T_NONE:
+        return None, pos
+    if tag == T_TRUE:
+        return True, pos
+    if tag == T_FALSE:
+        return False, pos
+    if tag == T_FLOAT:
+        return DOUBLE.unpack_from(data, pos)[0], pos + DOUBLE.size
+    if tag == T_LIST:
+        count, pos = read_varint(data, pos, len(data))
+        items = []
+        for _ in range(count or 0):
+            item, pos = read_value(data, pos, table)
+            items.append(item)
+        return items, pos
+    if tag == T_DICT:
+        count, pos = read_varint(data, pos, len(data))
+        items = {}
+        for _ in range(count or 0):
+            key, pos = read_key(data, pos)
+            items[key], pos = read_value(data, pos, table)
+        return items, pos
+    raise WireError(f"Tuntematon tyyppi {tag}")
+
+
+# Purkaa kehyksen rungon (ilman pituusetuliitettä) sanakirjaksi
+# table sisältää vastapuolen aiemmin kertomat numerot
+def decode(body, table):
+    try:
+        code = body[0]
+        if code == INLINE:
+            action, pos = read_str(body, 1)
+        elif code < len(ACTIONS):
+            action, pos = ACTIONS[code], 1
+        else:
+            raise WireError(f"Tuntematon toiminto {code}")
+        data = {} if action is None else {'action': action}
+        count, pos = read_varint(body, pos, len(body))
+        for _ in range(count or 0):
+            key, pos = read_key(body, pos)
+            data[key], pos = read_value(body, pos, table)
+    except (IndexError, UnicodeDecodeError, struct.error) as e:
+        raise WireError(f"Virheellinen kehys: {e}")
+    return data
+
+
+# Yhden yhteyden binääriprotokollan tila
+# sent: numerot, jotka on jo kerrottu vastapuolelle
+# received: vastapuolen kertomat numerot
+# Jos yhteydelle lähetetään useasta säikeestä, numeroiden merkitseminen
+# kerrotuiksi ja kehysten jonoon lisääminen tehdään lockin alla yhtenä
+# askeleena; muuten toinen säie voisi lähettää numeroa käyttävän kehyksen
+# ennen sen define-kehystä.
+# limit rajaa vastapuolen määrittelemien numeroiden määrän (palvelimella,
+# jottei asiakas voi kasvattaa taulua rajatta).
+class Peer:
+    def __init__(self, interner=None, limit=None):
+        self.interner = interner or Interner()
+        self.sent = set()
+        self.received = {CHANNEL: {}, USER: {}}
+        self.limit = limit
+        self.lock = threading.Lock()
+
+    # Liittää valmiiksi koodattuun kehykseen tarvittavat define-kehykset
+    def frame(self, encoded):
+        frame, refs = encoded
+        missing = [ref for ref in refs if ref[0] not in self.sent]
+        if not missing:
+            return frame
+        return self.defines(encoded) + frame
+
+    # Palauttaa kehyksen tarvitsemat, vielä lähettämättömät define-kehykset
+    # ja merkitsee ne lähetetyiksi
+    def defines(self, encoded):
+        out = bytearray()
+        if len(self.sent) >= TABLE_LIMIT:
+            self.sent.clear()
+        for ref, name in encoded[1]:
+            if ref in self.sent:
+                continue
+            self.sent.add(ref)
+            out += self.interner.define(ref, name)
+        return bytes(out)
+
+    def encode(self, data):
+        return self.frame(encode(data, self.interner))
+
+    # Yhteyskohtainen tila palvelimen vaihtoa varten (JSON-muodossa)
+    def state(self):
+        return {
+            'sent': sorted(self.sent),
+            'received': {kind: {str(number): name for number, name in table.items()}
+                         for kind, table in self.received.items()}
+        }
+
+    def restore(self, state):
+        self.sent = set(state['sent'])
+        self.received = {kind: {int(number): name for number, name in state['received'].get(kind, {}).items()}
+                         for kind in (CHANNEL, USER)}
+
+    # Purkaa kehyksen; define-kehykset päivittävät taulua ja palauttavat None
+    def decode(self, body):
+        data = decode(body, self.received)
+        if data.get('action') == 'define':
+            kind = data.get('kind')
+            if kind not in self.received or not isinstance(data.get('id'), int):
+                raise WireError("Virheellinen define-kehys")
+            table = self.received[kind]
+            if self.limit is not None and len(table) >= self.limit and data['id'] not in table:
+                raise WireError("Liian monta määriteltyä numeroa")
+            table[data['id']] = data.get('name')
+            return None
+        return data